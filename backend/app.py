@@ -5,10 +5,18 @@ from flasgger import Swagger
 from flask_cors import CORS
 from datetime import timedelta
 from datamanager.sqllite_data_manager import SQLiteDataManager
+from datamanager.storage import LocalStorage, is_immutable
 from routes.activities import activities_bp
 from routes.trips import trips_bp
 from routes.users import users_bp
 from routes.photos import photos_bp
+from routes.map import map_bp
+from routes.search import search_bp
+from routes.metrics import metrics_bp
+from utils.access_log import AccessLog
+from utils.json_provider import configure_json
+from utils.metrics import Metrics
+from utils.query_profiler import QueryProfiler
 from dotenv import load_dotenv
 from routes.chat import chat_bp
 from supabase import create_client, Client
@@ -22,16 +30,20 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SUPABASE_BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME")
 SECRET_KEY = os.getenv("SECRET_KEY")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
+# "supabase" or "local"; local keeps photos under STORAGE_ROOT and serves them at /uploads
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise Exception("SUPABASE_URL or SUPABASE_KEY is not set in environment variables.")
-
-supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase_client = None
+if STORAGE_BACKEND == "supabase":
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise Exception("SUPABASE_URL or SUPABASE_KEY is not set in environment variables.")
+    supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 from flask import send_from_directory
 
 
 app = Flask(__name__)
+configure_json(app)
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(seconds=3600)
@@ -40,6 +52,20 @@ app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(days=7)
 app.config["SUPABASE_URL"] = SUPABASE_URL
 app.config["supabase"] = supabase_client
 app.config["SUPABASE_BUCKET_NAME"] = SUPABASE_BUCKET_NAME
+app.config["STORAGE_BACKEND"] = STORAGE_BACKEND
+app.config["STORAGE_ROOT"] = os.getenv("STORAGE_ROOT")
+# Let a fronting nginx/apache send local files (X-Sendfile) instead of the app
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+# Fraction of requests written to the access log; errors and slow requests are always logged
+app.config["ACCESS_LOG_SAMPLE_RATE"] = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1"))
+app.config["ACCESS_LOG_SLOW_MS"] = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
+app.config["ACCESS_LOG_FILE"] = os.getenv("ACCESS_LOG_FILE")
+# Directory shared by the worker processes so /metrics can add up all of them
+app.config["METRICS_DIR"] = os.getenv("METRICS_DIR")
+# Development aid: count each request's queries and warn about N+1 patterns and slow queries
+app.config["QUERY_PROFILER"] = os.getenv("QUERY_PROFILER", "").lower() in ("1", "true", "yes")
+# Seconds between reloads of the token blacklist written by other workers (0 turns them off)
+app.config["REVOCATION_REFRESH_SECONDS"] = float(os.getenv("REVOCATION_REFRESH_SECONDS", "5"))
 
 
 # allow all origins
@@ -47,9 +73,14 @@ CORS(app,
      origins=["http://localhost:5173", "https://pin-trail.vercel.app"],
      supports_credentials=True,
      allow_headers=["Content-Type", "Authorization"],
+     expose_headers=["X-Next-Cursor"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
 
+access_log = AccessLog(app)
+metrics = Metrics(app)
+if app.config["QUERY_PROFILER"]:
+    QueryProfiler(app)
 jwt = JWTManager(app)
 swagger = Swagger(app, template={
     "swagger": "2.0",
@@ -68,10 +99,39 @@ app.register_blueprint(trips_bp)
 app.register_blueprint(users_bp)
 app.register_blueprint(photos_bp)
 app.register_blueprint(chat_bp)
+app.register_blueprint(map_bp)
+app.register_blueprint(search_bp)
+app.register_blueprint(metrics_bp)
 
 @app.route('/uploads/<path:filename>')
 def serve_uploaded_file(filename):
-    return send_from_directory('uploads', filename)
+    """
+    Serves a photo file kept by the local storage backend (supports Range requests).
+    ---
+    parameters:
+      - name: filename
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: The file
+      206:
+        description: The requested byte range of the file
+      404:
+        description: No such file, or photos are not stored locally
+    """
+    photo_storage = db_manager.storage
+    if not isinstance(photo_storage, LocalStorage):
+        return jsonify({"error": "Not found"}), 404
+    immutable = is_immutable(filename)
+    # Content-addressed files never change, so caches may keep them for a year without asking.
+    response = send_from_directory(photo_storage.root, filename, conditional=True,
+                                   max_age=31536000 if immutable else 3600)
+    if immutable:
+        response.cache_control.immutable = True
+        response.cache_control.public = True
+    return response
 
 
 @jwt.unauthorized_loader
@@ -85,7 +145,6 @@ def check_if_token_revoked(jwt_header, jwt_payload):
 
 @jwt.invalid_token_loader
 def custom_invalid_token_response(callback):
-    print(f"Invalid token received: {request.headers.get('Authorization')}")
     return jsonify({"error": "Invalid token", "reason": str(callback)}), 422
 
 
@@ -106,13 +165,7 @@ def home():
     return "Welcome to PinTrail API!"
 
 @app.before_request
-def handle_request_info_and_options():
-    # Log useful request info
-    print(f"Request method: {request.method}")
-    print(f"Request path: {request.path}")
-    print(f"Authorization header: {request.headers.get('Authorization')}")
-    print(f"Origin: {request.headers.get('Origin')}")
-
+def handle_options():
     # Handle CORS preflight requests (OPTIONS)
     if request.method == "OPTIONS":
         return '', 200
@@ -0,0 +1,18 @@
+"""ASGI entry point, for serving many slow clients with few threads:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 2
+
+ASGI_THREADS sets the worker threads per process (default 16) and ASGI_MAX_BODY_SIZE the
+largest request body accepted, in bytes (default: a full batch photo upload).
+"""
+import os
+
+from app import app
+from utils.asgi import AsgiAdapter
+from utils.uploads import MAX_BATCH_FILES, MAX_FORM_OVERHEAD, MAX_UPLOAD_SIZE
+
+application = AsgiAdapter(
+    app,
+    threads=int(os.getenv("ASGI_THREADS", 16)),
+    max_body_size=int(os.getenv("ASGI_MAX_BODY_SIZE", MAX_BATCH_FILES * MAX_UPLOAD_SIZE + MAX_FORM_OVERHEAD)),
+)
@@ -0,0 +1,62 @@
+"""Bulk trip import throughput through the data manager.
+
+    python -m benchmarks.bench_bulk [trips]      # default: 50000
+
+Every trip has a pin and two activities (one with a pin), like an imported travel history.
+"clustered" pins fall around 50 cities, "scattered" pins anywhere on the map; the latter
+touches the most map cluster cells and is the worst case.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_app
+from datamanager.data_models import db, User
+from utils.validates import parse_bulk_trip
+
+
+def payload(count, rng, scattered):
+    cities = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(50)]
+    for i in range(count):
+        if scattered:
+            lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        else:
+            lat, lng = rng.choice(cities)
+            lat, lng = lat + rng.gauss(0, 0.05), lng + rng.gauss(0, 0.05)
+        yield {
+            "title": f"Trip {i}", "user_id": 1, "country": "Bench", "city": "Somewhere",
+            "start_date": "2024-04-01", "end_date": "2024-04-10", "notes": "Imported",
+            "lat": lat, "lng": lng,
+            "activities": [{"name": f"Museum {i}", "type": "museum", "lat": lat + 0.01, "lng": lng},
+                           {"name": "Hotel", "type": "lodging"}],
+        }
+
+
+def run(count, scattered=False):
+    rng = random.Random(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with app.app_context():
+            db.session.add(User(username="bench", email="bench@example.com", password_hash="x"))
+            db.session.commit()
+            items = [(index, *parse_bulk_trip(item)) for index, item in enumerate(payload(count, rng, scattered))]
+            start = time.perf_counter()
+            created, errors = app.config["db_manager"].add_trips_bulk(items)
+            elapsed = time.perf_counter() - start
+            assert len(created) == count and not errors
+            db.session.remove()
+            db.engine.dispose()
+    return {"trips": count, "seconds": round(elapsed, 3), "trips_per_second": round(count / elapsed)}
+
+
+def main(argv):
+    count = int(argv[0]) if argv else 50000
+    for label, scattered in (("clustered", False), ("scattered", True)):
+        r = run(count, scattered)
+        print(f"{label:>10}: {r['trips']} trips in {r['seconds']} s, {r['trips_per_second']} trips/s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+"""Concurrent reads and writes on a file database, with SQLite's defaults and with the engine profile.
+
+    python -m benchmarks.bench_concurrency [seconds] [readers] [writers]      # default: 5 8 2
+
+Every reader and writer is its own process, as with several gunicorn workers on one database.
+Readers fetch random trips with their activities; writers add trips with an activity and a pin,
+which also touches the pin, cluster, search and revision tables. Reports operations per second
+and how many operations failed, e.g. with "database is locked".
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_app
+from datamanager import engine_profile
+from datamanager.data_models import db, User
+from utils.validates import parse_bulk_trip
+
+SEED_TRIPS = 2000
+PROFILES = {
+    # Everything at SQLite's and the sqlite3 module's defaults: rollback journal, FULL sync.
+    "default": {"SQLITE_PRAGMAS": {name: None for name in engine_profile.SQLITE_PRAGMAS},
+                "SQLITE_STATEMENT_CACHE": 128},
+    "tuned": {},
+}
+
+
+def trip(rng, i):
+    lat, lng = rng.uniform(-60, 70), rng.uniform(-180, 180)
+    return {
+        "title": f"Trip {i}", "user_id": 1, "country": "Bench", "city": "Somewhere",
+        "start_date": "2024-04-01", "end_date": "2024-04-10", "lat": lat, "lng": lng,
+        "activities": [{"name": f"Museum {i}", "type": "museum", "lat": lat, "lng": lng}],
+    }
+
+
+def worker(url, profile, kind, seed, start, deadline, results):
+    """One process, like one gunicorn worker, doing reads or writes from ``start`` to ``deadline``."""
+    app = make_app(url, **PROFILES[profile])
+    manager = app.config["db_manager"]
+    rng, done, failed = random.Random(seed), 0, 0
+    time.sleep(max(0.0, start - time.time()))
+    with app.app_context():
+        while time.time() < deadline:
+            try:
+                if kind == "writes":
+                    manager.add_trip(trip(rng, seed))
+                else:
+                    manager.get_trip_dict(rng.randint(1, SEED_TRIPS), expand=("activities",))
+                done += 1
+            except Exception:
+                db.session.rollback()
+                failed += 1
+    results.put((kind, done, failed))
+
+
+def run(profile, seconds, readers, writers):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app = make_app(url, **PROFILES[profile])
+        manager = app.config["db_manager"]
+        with app.app_context():
+            db.session.add(User(username="bench", email="bench@example.com", password_hash="x"))
+            db.session.commit()
+            manager.add_trips_bulk([(i, *parse_bulk_trip(trip(random.Random(i), i)))
+                                    for i in range(SEED_TRIPS)])
+            db.session.remove()
+            db.engine.dispose()
+
+        results = multiprocessing.Queue()
+        # Started together once they have all built their app.
+        start = time.time() + 3
+        deadline = start + seconds
+        kinds = ["reads"] * readers + ["writes"] * writers
+        processes = [multiprocessing.Process(target=worker, args=(url, profile, kind, i, start, deadline,
+                                                                      results))
+                     for i, kind in enumerate(kinds)]
+        for process in processes:
+            process.start()
+        counts = {"reads": 0, "writes": 0, "errors": 0}
+        for _ in processes:
+            kind, done, failed = results.get()
+            counts[kind] += done
+            counts["errors"] += failed
+        for process in processes:
+            process.join()
+    return {"reads": round(counts["reads"] / seconds, 1), "writes": round(counts["writes"] / seconds, 1),
+            "errors": counts["errors"]}
+
+
+def main(argv):
+    seconds, readers, writers = (float(argv[0]) if argv else 5), *(int(a) for a in (argv[1:] or [8, 2]))
+    print(f"{readers} readers, {writers} writers, {seconds} s per profile")
+    print(f"{'profile':>8} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+    for profile in PROFILES:
+        r = run(profile, seconds, readers, writers)
+        print(f"{profile:>8} {r['reads']:>10} {r['writes']:>10} {r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
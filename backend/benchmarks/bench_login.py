@@ -0,0 +1,67 @@
+"""Login throughput through /users/login with password hashing on the bounded pool.
+
+    python -m benchmarks.bench_login [logins] [method]      # default: 200, werkzeug's scrypt
+
+Each run sends ``logins`` logins from 1, 4 and 16 concurrent clients and reports successful
+logins per second per core, plus how many were turned away with 503 once the queue filled.
+"""
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_jwt_extended import JWTManager
+
+from benchmarks.common import make_app
+from datamanager.data_models import db
+from routes.users import users_bp
+
+CLIENTS = (1, 4, 16)
+
+
+def run(count, method=None):
+    cores = os.cpu_count() or 1
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                       JWT_SECRET_KEY="bench", PASSWORD_HASH_METHOD=method)
+        JWTManager(app)
+        app.register_blueprint(users_bp)
+        with app.app_context():
+            app.config["db_manager"].add_user("bench", "bench@example.com", "secret")
+
+        def login(_):
+            with app.test_client() as client:
+                return client.post("/users/login", json={"email": "bench@example.com",
+                                                         "password": "secret"}).status_code
+
+        for clients in CLIENTS:
+            with ThreadPoolExecutor(clients) as pool:
+                start = time.perf_counter()
+                statuses = list(pool.map(login, range(count)))
+                elapsed = time.perf_counter() - start
+            ok = statuses.count(200)
+            results.append({
+                "clients": clients, "ok": ok, "busy": statuses.count(503),
+                "logins_per_second": round(ok / elapsed, 1),
+                "logins_per_second_per_core": round(ok / elapsed / cores, 1),
+            })
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+    return {"cores": cores, "runs": results}
+
+
+def main(argv):
+    count = int(argv[0]) if argv else 200
+    r = run(count, argv[1] if len(argv) > 1 else None)
+    print(f"{count} logins per run, {r['cores']} core(s)")
+    print(f"{'clients':>8} {'ok':>6} {'503':>6} {'logins/s':>10} {'per core':>10}")
+    for row in r["runs"]:
+        print(f"{row['clients']:>8} {row['ok']:>6} {row['busy']:>6} "
+              f"{row['logins_per_second']:>10} {row['logins_per_second_per_core']:>10}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
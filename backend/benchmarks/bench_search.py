@@ -0,0 +1,79 @@
+"""Ranked prefix search latency as the corpus grows.
+
+    python -m benchmarks.bench_search [--fts5-only] [sizes...]      # default: 10000 100000 1000000
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import date
+
+from sqlalchemy import insert
+
+from benchmarks.common import make_app, summarize, time_calls
+from datamanager import search_index
+from datamanager.data_models import db, Trip
+
+QUERIES = 200
+VOCABULARY_SIZE = 20000
+SYLLABLES = ["ka", "to", "ra", "mi", "su", "no", "ha", "ri", "zu", "te", "lo", "pa", "an", "el", "or", "us"]
+CITIES = ["Osaka", "Kyoto", "Lisbon", "Paris", "Cusco", "Hanoi", "Oaxaca", "Reykjavik", "Tbilisi", "Zanzibar"]
+
+
+def vocabulary(rng):
+    """Pseudo-words with Zipf-distributed frequencies, like the words of real trip notes."""
+    words = sorted({"".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(VOCABULARY_SIZE)})
+    rng.shuffle(words)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    return words, weights
+
+
+def seed(count, rng, words, weights, batch_size=20000):
+    rows = []
+    for i in range(count):
+        picked = rng.choices(words, weights, k=7)
+        rows.append({
+            "title": f"{picked[0].title()} {picked[1]} #{i}", "user_id": 1, "country": "Bench",
+            "city": rng.choice(CITIES), "start_date": date(2024, 1, 1), "end_date": date(2024, 1, 2),
+            "description": " ".join(picked[2:5]), "notes": " ".join(picked[5:]),
+        })
+        if len(rows) == batch_size:
+            db.session.execute(insert(Trip), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+
+def run(count, prefer_fts5):
+    rng = random.Random(count)
+    search_index.PREFER_FTS5 = prefer_fts5
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with app.app_context():
+            words, weights = vocabulary(rng)
+            seed(count, rng, words, weights)
+            app.config["db_manager"].rebuild_search_index()
+            queries = []
+            for _ in range(QUERIES):
+                word = rng.choices(words, weights)[0]
+                queries.append((f"{word} {rng.choice(CITIES)[:3]}" if rng.random() < 0.5 else word[:4],))
+            search = app.config["db_manager"].search
+            result = summarize(time_calls(search, queries))
+            db.session.remove()
+            db.engine.dispose()
+    return result
+
+
+def main(argv):
+    modes = [(True, "fts5")] if "--fts5-only" in argv else [(True, "fts5"), (False, "tokens")]
+    sizes = [int(arg) for arg in argv if arg.isdigit()] or [10000, 100000, 1000000]
+    print(f"{'trips':>10} {'mode':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for count in sizes:
+        for prefer_fts5, mode in modes:
+            r = run(count, prefer_fts5)
+            print(f"{count:>10} {mode:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
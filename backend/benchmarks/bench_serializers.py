@@ -0,0 +1,101 @@
+"""Serializing trip listings: ORM objects + to_dict + stdlib json versus row tuples + orjson.
+
+    python -m benchmarks.bench_serializers [trips]      # default: 10000
+
+Each trip has two activities and one photo, and is serialized with both relationships.
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
+
+from benchmarks.common import make_app, summarize, time_calls
+from datamanager.data_models import db, Activity, Photo, Trip
+from utils.json_provider import OrjsonProvider
+
+RUNS = 10
+
+
+def seed(count, batch_size=5000):
+    for start in range(0, count, batch_size):
+        ids = range(start + 1, min(start + batch_size, count) + 1)
+        db.session.execute(insert(Trip), [{
+            "id": i, "title": f"Trip {i}", "user_id": 1, "country": "Japan", "city": "Osaka",
+            "start_date": date(2024, 4, 1), "end_date": date(2024, 4, 10),
+            "description": "Street food and castles " * 8, "notes": "Get a JR pass", "is_public": True,
+            "lat": 34.69, "lng": 135.50,
+        } for i in ids])
+        db.session.execute(insert(Activity), [{
+            "trip_id": i, "name": name, "type": "sightseeing", "location": "Osaka", "cost": 12.5,
+            "rating": 4, "notes": "Go early", "lat": 34.68, "lng": 135.52,
+        } for i in ids for name in ("Castle", "Dotonbori")])
+        db.session.execute(insert(Photo), [{"trip_id": i, "url": f"https://example.com/{i}.jpg",
+                                            "caption": "View"} for i in ids])
+    db.session.commit()
+
+
+def legacy_to_dict(trip):
+    """The attribute-by-attribute mapping Trip.to_dict used before the serializer module."""
+    return {
+        "id": trip.id, "title": trip.title, "user_id": trip.user_id, "country": trip.country,
+        "city": trip.city,
+        "start_date": trip.start_date.isoformat() if trip.start_date else None,
+        "end_date": trip.end_date.isoformat() if trip.end_date else None,
+        "description": trip.description, "notes": trip.notes, "is_public": trip.is_public,
+        "activities": [{
+            "id": a.id, "trip_id": a.trip_id, "type": a.type, "name": a.name, "location": a.location,
+            "cost": a.cost, "rating": a.rating, "notes": a.notes, "lat": a.lat, "lng": a.lng,
+        } for a in trip.activities],
+        "photos": [{"id": p.id, "trip_id": p.trip_id, "url": p.url, "caption": p.caption} for p in trip.photos],
+        "lat": trip.lat, "lng": trip.lng,
+    }
+
+
+def run(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with app.app_context():
+            seed(count)
+            manager = app.config["db_manager"]
+            stdlib, fast = DefaultJSONProvider(app), OrjsonProvider(app)
+
+            def orm_path():
+                db.session.expunge_all()
+                trips = db.session.scalars(
+                    select(Trip).options(selectinload(Trip.activities), selectinload(Trip.photos))
+                    .order_by(Trip.id)).all()
+                return stdlib.dumps([legacy_to_dict(trip) for trip in trips], separators=(",", ":"))
+
+            def row_path():
+                db.session.expunge_all()
+                return fast.dumps(manager.get_trips(expand=("activities", "photos")))
+
+            assert stdlib.loads(orm_path()) == stdlib.loads(row_path())
+            payload = manager.get_trips(expand=("activities", "photos"))
+            result = {
+                "trips": count,
+                "to_dict": summarize(time_calls(orm_path, [()] * RUNS)),
+                "rows": summarize(time_calls(row_path, [()] * RUNS)),
+                "encode_stdlib": summarize(time_calls(
+                    lambda: stdlib.dumps(payload, separators=(",", ":")), [()] * RUNS)),
+                "encode_orjson": summarize(time_calls(lambda: fast.dumps(payload), [()] * RUNS)),
+            }
+            db.session.remove()
+            db.engine.dispose()
+    return result
+
+
+def main(argv):
+    count = int(argv[0]) if argv else 10000
+    r = run(count)
+    print(f"{count} trips, p50 / p99 ms over {RUNS} runs")
+    for key in ("to_dict", "rows", "encode_stdlib", "encode_orjson"):
+        print(f"{key:>14} {r[key]['p50_ms']:>10} {r[key]['p99_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+"""Read latency while slow clients upload, under the threaded WSGI server and the ASGI adapter.
+
+    python -m benchmarks.bench_serving [seconds] [slow clients] [readers] [threads]    # default: 10 200 8 16
+
+Starts the real app once under gunicorn's gthread worker and once under uvicorn with
+``asgi:application``, each with one process and ``threads`` threads. ``slow clients`` keep
+sending login requests whose bodies trickle in over two seconds, like uploads over a poor
+connection, while ``readers`` fetch pages of trips back to back. Reports the readers' latency
+percentiles and how many requests of each kind completed.
+"""
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import make_app, percentile
+from datamanager.data_models import db
+from utils.validates import parse_bulk_trip
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_TRIPS = 500
+TRICKLE_SECONDS = 2.0
+TRICKLE_PIECES = 10
+READ_PATH = "/trips/?limit=20&expand=activities"
+SERVERS = {"wsgi": "gunicorn", "asgi": "uvicorn"}
+
+
+def seed(database_url):
+    app = make_app(database_url)
+    manager = app.config["db_manager"]
+    rng = random.Random(1)
+    with app.app_context():
+        manager.add_user("bench", "bench@example.com", "secret")
+        manager.add_trips_bulk([(1, *parse_bulk_trip({
+            "title": f"Trip {i}", "user_id": 1, "country": "Bench", "city": "Somewhere",
+            "start_date": "2024-04-01", "end_date": "2024-04-10",
+            "lat": rng.uniform(-60, 70), "lng": rng.uniform(-180, 180),
+            "activities": [{"name": f"Museum {i}", "type": "museum"}],
+        })) for i in range(SEED_TRIPS)])
+        db.session.remove()
+        db.engine.dispose()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, threads, env):
+    if mode == "wsgi":
+        command = [SERVERS[mode], "-w", "1", "-k", "gthread", "--threads", str(threads),
+                   "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        command = [SERVERS[mode], "asgi:application", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", "1", "--no-access-log"]
+        env = {**env, "ASGI_THREADS": str(threads)}
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+async def request(port, head, body=b"", trickle=0.0):
+    """One HTTP/1.1 request on its own connection; returns the status code."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(head)
+        if trickle:
+            piece = -(-len(body) // TRICKLE_PIECES)
+            for start in range(0, len(body), piece):
+                await asyncio.sleep(trickle / TRICKLE_PIECES)
+                writer.write(body[start:start + piece])
+                await writer.drain()
+        else:
+            writer.write(body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+async def load(port, seconds, slow_clients, readers):
+    body = json.dumps({"email": "bench@example.com", "password": "wrong-" + "x" * 200}).encode()
+    upload = (f"POST /users/login HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+              f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode()
+    read = f"GET {READ_PATH} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode()
+    deadline = time.monotonic() + seconds
+    latencies, counts = [], {"reads": 0, "uploads": 0, "errors": 0}
+
+    async def slow_client():
+        while time.monotonic() < deadline:
+            try:
+                await request(port, upload, body, TRICKLE_SECONDS)
+                counts["uploads"] += 1
+            except (OSError, ValueError, IndexError):
+                counts["errors"] += 1
+
+    async def reader():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await request(port, read)
+            except (OSError, ValueError, IndexError):
+                status = None
+            if status == 200:
+                latencies.append((time.perf_counter() - start) * 1000)
+                counts["reads"] += 1
+            else:
+                counts["errors"] += 1
+
+    await asyncio.gather(*[slow_client() for _ in range(slow_clients)], *[reader() for _ in range(readers)])
+    return {**counts, "p50_ms": round(percentile(latencies, 50), 1), "p99_ms": round(percentile(latencies, 99), 1)}
+
+
+def run(seconds, slow_clients, readers, threads):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed(database_url)
+        env = {**os.environ, "DATABASE_URL": database_url, "STORAGE_BACKEND": "local",
+               "STORAGE_ROOT": os.path.join(tmp, "uploads"), "SECRET_KEY": "bench", "JWT_SECRET_KEY": "bench"}
+        for mode, server_command in SERVERS.items():
+            if shutil.which(server_command) is None:
+                print(f"Skipping {mode}: {server_command} is not installed", file=sys.stderr)
+                continue
+            port = free_port()
+            server = start_server(mode, port, threads, env)
+            try:
+                results[mode] = asyncio.run(load(port, seconds, slow_clients, readers))
+            finally:
+                server.terminate()
+                server.wait()
+    return results
+
+
+def main(argv):
+    seconds = float(argv[0]) if argv else 10
+    slow_clients, readers, threads = (int(a) for a in (argv[1:] or [200, 8, 16]))
+    print(f"{slow_clients} slow clients, {readers} readers, {threads} threads, {seconds} s per mode")
+    print(f"{'mode':>6} {'reads':>8} {'p50 ms':>9} {'p99 ms':>9} {'uploads':>9} {'errors':>8}")
+    for mode, r in run(seconds, slow_clients, readers, threads).items():
+        print(f"{mode:>6} {r['reads']:>8} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['uploads']:>9} {r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,77 @@
+"""Bounding-box lookups through the pin index versus a full scan of the trips table.
+
+    python -m benchmarks.bench_spatial [sizes...]      # default: 10000 100000 1000000
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import date
+
+from sqlalchemy import func, insert, select
+
+from benchmarks.common import make_app, summarize, time_calls
+from datamanager import spatial_index
+from datamanager.data_models import db, Trip
+
+QUERIES = 200
+BOX_DEGREES = 0.5
+
+
+def seed(count, rng, batch_size=20000):
+    rows = []
+    for i in range(count):
+        rows.append({
+            "title": f"Trip {i}", "user_id": 1, "country": "Bench",
+            "start_date": date(2024, 1, 1), "end_date": date(2024, 1, 2),
+            "lat": rng.uniform(-60, 70), "lng": rng.uniform(-180, 180),
+        })
+        if len(rows) == batch_size:
+            db.session.execute(insert(Trip), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+
+def indexed(south, west, north, east):
+    ids = spatial_index.within_ids("trip", south, west, north, east).subquery()
+    return db.session.execute(select(func.count()).select_from(ids)).scalar()
+
+
+def full_scan(south, west, north, east):
+    return db.session.execute(
+        select(func.count(Trip.id)).where(Trip.lat.between(south, north), Trip.lng.between(west, east))
+    ).scalar()
+
+
+def run(count):
+    rng = random.Random(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        with app.app_context():
+            seed(count, rng)
+            app.config["db_manager"].rebuild_pin_index()
+            boxes = []
+            for _ in range(QUERIES):
+                south, west = rng.uniform(-60, 70 - BOX_DEGREES), rng.uniform(-180, 180 - BOX_DEGREES)
+                boxes.append((south, west, south + BOX_DEGREES, west + BOX_DEGREES))
+            assert [indexed(*box) for box in boxes[:20]] == [full_scan(*box) for box in boxes[:20]]
+            result = {"pins": count, "index": summarize(time_calls(indexed, boxes)),
+                      "full_scan": summarize(time_calls(full_scan, boxes))}
+            db.session.remove()
+            db.engine.dispose()
+    return result
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or [10000, 100000, 1000000]
+    print(f"{'pins':>10} {'index p50':>10} {'index p99':>10} {'scan p50':>10} {'scan p99':>10}")
+    for count in sizes:
+        r = run(count)
+        print(f"{r['pins']:>10} {r['index']['p50_ms']:>10} {r['index']['p99_ms']:>10} "
+              f"{r['full_scan']['p50_ms']:>10} {r['full_scan']['p99_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
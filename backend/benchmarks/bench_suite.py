@@ -0,0 +1,278 @@
+"""Throughput and latency of the real app under realistic mixed workloads, saved as JSON.
+
+    python -m benchmarks.bench_suite [--scale 1k] [--clients 8] [--seconds 10] [--scenarios ...] [--output FILE]
+    python -m benchmarks.bench_suite --compare before.json after.json
+
+Runs the full app from ``app.py`` (every blueprint, hook and the JWT checks) on a copy of a
+dataset from ``benchmarks.dataset``, with photos going to local storage. Each scenario keeps
+``clients`` threads issuing requests for ``seconds``; every client draws its requests from
+its own seeded generator, so runs are repeatable up to thread scheduling:
+
+    browse       map clusters and boxes, trip pages and search, as an anonymous visitor
+    mixed        browsing plus signed-in listings, trip edits, logins and photo uploads
+    login_storm  logins only, the password hashing pool at its limit
+    uploads      single photo uploads only
+
+The JSON file records the commit, the machine and the dataset with the requests per second
+and the p50/p95/p99 latency of every request kind, so two files can be compared with
+``--compare``. Latencies only cover successful requests; failures are counted by status, so
+logins shed with 503 by the password check limit show up as such rather than as fast logins.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+
+from benchmarks import dataset
+from benchmarks.common import percentile
+
+SCENARIOS = {
+    "browse": {"map_clusters": 40, "map_within": 15, "trip_detail": 25, "search": 20},
+    "mixed": {"map_clusters": 25, "trip_detail": 20, "user_trips": 20, "search": 10, "edit_trip": 10,
+              "login": 10, "upload": 5},
+    "login_storm": {"login": 1},
+    "uploads": {"upload": 1},
+}
+# Users that sign in during a run; each gets a token up front for the signed-in requests.
+SIGNED_IN_USERS = 200
+
+
+def png(rng, size=32):
+    """A small PNG with random pixels, so no two uploads share content."""
+    rows = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(size * 3)) for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+class Workload:
+    """The requests of one client, drawn from ``rng``."""
+
+    def __init__(self, client, rng, info):
+        self.client = client
+        self.rng = rng
+        self.info = info
+
+    def _bbox(self, span):
+        _, _, lat, lng = self.rng.choice(self.info["cities"])
+        south, north = max(-90, lat - span / 2), min(90, lat + span / 2)
+        west, east = max(-180, lng - span), min(180, lng + span)
+        return f"{west:.4f},{south:.4f},{east:.4f},{north:.4f}"
+
+    def _trip(self):
+        return self.rng.randint(1, self.info["trips"])
+
+    def map_clusters(self):
+        zoom = self.rng.randint(2, 12)
+        return self.client.get(f"/map/clusters?zoom={zoom}&bbox={self._bbox(360 / 2 ** zoom)}")
+
+    def map_within(self):
+        return self.client.get(f"/trips/within?bbox={self._bbox(0.5)}&fields=title,lat,lng&expand=")
+
+    def trip_detail(self):
+        return self.client.get(f"/trips/{self._trip()}")
+
+    def search(self):
+        city = self.rng.choice(self.info["cities"])[0].split()[1]
+        return self.client.get(f"/search?q=city+{city}+{self.rng.choice(dataset.WORDS).split()[0][:4]}")
+
+    def user_trips(self):
+        user_id, token = self.rng.choice(self.info["tokens"])
+        return self.client.get(f"/trips/user/{user_id}", headers={"Authorization": f"Bearer {token}"})
+
+    def edit_trip(self):
+        return self.client.put(f"/trips/{self._trip()}", json={"notes": f"Edited {self.rng.getrandbits(32)}"})
+
+    def login(self):
+        user_id = self.rng.randint(1, self.info["users"])
+        return self.client.post("/users/login", json={"email": f"user{user_id}@bench.pintrail.app",
+                                                      "password": dataset.PASSWORD})
+
+    def upload(self):
+        data = {"file": (io.BytesIO(png(self.rng)), "bench.png", "image/png"), "caption": "Bench"}
+        return self.client.post(f"/photos/upload/{self._trip()}", data=data, content_type="multipart/form-data")
+
+
+def run_scenario(app, info, weights, clients, seconds, seed):
+    kinds, cumulative = list(weights), []
+    for weight in weights.values():
+        cumulative.append((cumulative[-1] if cumulative else 0) + weight)
+    samples = {kind: [] for kind in kinds}
+    errors = {kind: Counter() for kind in kinds}
+    lock = threading.Lock()
+    start_at = time.perf_counter() + 0.5
+    deadline = start_at + seconds
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        workload = Workload(app.test_client(), rng, info)
+        mine = {kind: [] for kind in kinds}
+        failed = {kind: Counter() for kind in kinds}
+        time.sleep(max(0.0, start_at - time.perf_counter()))
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, cum_weights=cumulative)[0]
+            started = time.perf_counter()
+            try:
+                response = getattr(workload, kind)()
+                status = response.status_code
+                response.close()
+            except Exception as e:
+                status = type(e).__name__
+            if isinstance(status, int) and status < 400:
+                mine[kind].append((time.perf_counter() - started) * 1000)
+            else:
+                failed[kind][str(status)] += 1
+        with lock:
+            for kind in kinds:
+                samples[kind] += mine[kind]
+                errors[kind] += failed[kind]
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    requests = {}
+    for kind in kinds:
+        latencies = samples[kind]
+        requests[kind] = {
+            "count": len(latencies), "errors": sum(errors[kind].values()), "error_statuses": dict(errors[kind]),
+            "per_second": round(len(latencies) / seconds, 2),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+        }
+    everything = [latency for kind in kinds for latency in samples[kind]]
+    return {
+        "per_second": round(len(everything) / seconds, 2),
+        "errors": sum(sum(failed.values()) for failed in errors.values()),
+        "p50_ms": round(percentile(everything, 50), 2),
+        "p99_ms": round(percentile(everything, 99), 2),
+        "requests": requests,
+    }
+
+
+def load_app(database_path, work_dir):
+    """Import the real app against ``database_path``, with photos stored under ``work_dir``."""
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{database_path}", "STORAGE_BACKEND": "local",
+        "STORAGE_ROOT": os.path.join(work_dir, "uploads"), "SECRET_KEY": "bench", "JWT_SECRET_KEY": "bench",
+        "ACCESS_LOG_FILE": os.path.join(work_dir, "access.log"),
+    })
+    from app import app
+    return app
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scale, clients, seconds, scenarios, seed):
+    from flask_jwt_extended import create_access_token
+    from datamanager.data_models import db
+
+    source = dataset.ensure(scale, seed)
+    manifest = dataset.manifest(scale, seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        database_path = os.path.join(work_dir, "bench.db")
+        shutil.copyfile(source, database_path)  # edits and uploads must not change the cached dataset
+        app = load_app(database_path, work_dir)
+        rng = random.Random(seed)
+        with app.app_context():
+            user_ids = sorted(rng.sample(range(1, manifest["users"] + 1), min(SIGNED_IN_USERS, manifest["users"])))
+            tokens = [(user_id, create_access_token(identity=str(user_id))) for user_id in user_ids]
+        info = {"trips": manifest["trips"], "users": manifest["users"], "tokens": tokens,
+                "cities": dataset.cities(random.Random(seed + 1))}
+        results = {}
+        for index, name in enumerate(scenarios):
+            results[name] = run_scenario(app, info, SCENARIOS[name], clients, seconds, seed + index)
+            print(f"{name:>12} {results[name]['per_second']:>10} req/s  p50 {results[name]['p50_ms']:>8} ms"
+                  f"  p99 {results[name]['p99_ms']:>8} ms  errors {results[name]['errors']}", file=sys.stderr)
+        app.config["db_manager"].photo_ingestion.executor.shutdown(wait=True)
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+    return {
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "dataset": manifest,
+        "settings": {"clients": clients, "seconds": seconds},
+        "scenarios": results,
+    }
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['commit']} -> {after['commit']}, {after['dataset']['scale']} dataset")
+    print(f"{'scenario':>12} {'request':>14} {'req/s':>18} {'p50 ms':>22} {'p99 ms':>22}")
+
+    def change(old, new):
+        delta = f"{(new - old) / old * 100:+.0f}%" if old else "n/a"
+        return f"{old:>8} {new:>8} {delta:>5}"
+
+    for name, result in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is None:
+            continue
+        for kind, new in result["requests"].items():
+            if kind in old["requests"]:
+                was = old["requests"][kind]
+                print(f"{name:>12} {kind:>14} {change(was['per_second'], new['per_second'])}"
+                      f" {change(was['p50_ms'], new['p50_ms'])} {change(was['p99_ms'], new['p99_ms'])}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", default="1k", choices=dataset.SCALES)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--output", help="JSON file to write (default: bench-<scale>-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args(argv)
+    if args.compare:
+        return compare(*args.compare)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    result = run(args.scale, args.clients, args.seconds, scenarios, args.seed)
+    output = args.output or f"bench-{args.scale}-{result['commit'] or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,53 @@
+"""Shared helpers for the benchmark scripts. Run them from the backend directory, e.g.
+
+    python -m benchmarks.bench_spatial 10000 100000
+"""
+import os
+import statistics
+import time
+
+from flask import Flask
+
+
+def make_app(database_url, **config):
+    """Build a bare Flask app wired to a SQLiteDataManager on ``database_url`` (no blueprints).
+
+    Photos go to local storage next to a file database, so nothing touches the network.
+    """
+    from datamanager.sqllite_data_manager import SQLiteDataManager
+
+    os.environ["DATABASE_URL"] = database_url
+    app = Flask("pintrail-bench")
+    database_dir = os.getcwd()
+    if database_url.startswith("sqlite:///"):
+        database_dir = os.path.dirname(database_url.removeprefix("sqlite:///"))
+    app.config.update({"supabase": None, "SUPABASE_BUCKET_NAME": None, "STORAGE_BACKEND": "local",
+                       "STORAGE_ROOT": os.path.join(database_dir, "uploads"), **config})
+    app.config["db_manager"] = SQLiteDataManager(app)
+    return app
+
+
+def time_calls(fn, args_list):
+    """Call ``fn(*args)`` for every entry and return per-call latencies in milliseconds."""
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
@@ -0,0 +1,151 @@
+"""Deterministic PinTrail datasets for the benchmark suite.
+
+    python -m benchmarks.dataset [scale] [--seed N] [--force]      # scales: 1k, 100k, 1m
+
+Every scale is built from ``seed`` alone, so two machines (or two commits) benchmark the
+same rows. Users own 20 trips each; every trip has three activities and one photo, and its pin
+falls near one of a few hundred cities, so the map has dense and empty areas like real data.
+All users log in with the password ``secret``.
+
+Datasets take a while to build at the large scales, so they are kept in ``BENCH_DATA_DIR``
+(a directory under the system temp dir by default) next to a manifest, and rebuilt only
+when the manifest does not match.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from benchmarks.common import make_app
+from datamanager.data_models import db, Photo, User
+from utils.validates import parse_bulk_trip
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+# Bump when the generated rows change, so cached datasets are rebuilt.
+VERSION = 1
+TRIPS_PER_USER = 20
+CITY_COUNT = 300
+PASSWORD = "secret"
+ACTIVITY_TYPES = ("museum", "restaurant", "hike", "beach", "market", "lodging")
+WORDS = ("harbour", "old town", "castle", "ramen", "sunset", "night market", "vineyard", "temple",
+         "lagoon", "glacier", "street food", "cathedral")
+CHUNK_SIZE = 5000
+
+
+def data_dir():
+    return os.environ.get("BENCH_DATA_DIR") or os.path.join(tempfile.gettempdir(), "pintrail-bench")
+
+
+def password_hash(password=PASSWORD, salt="pintrail-bench"):
+    """A werkzeug scrypt hash with a fixed salt: checked like any other, but the same on every run."""
+    n, r, p = 2 ** 15, 8, 1
+    digest = hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=132 * n * r * p)
+    return f"scrypt:{n}:{r}:{p}${salt}${digest.hex()}"
+
+
+def cities(rng):
+    return [(f"City {i}", f"Country {i % 40}", rng.uniform(-55, 65), rng.uniform(-175, 175))
+            for i in range(CITY_COUNT)]
+
+
+def trips(count, seed):
+    """The trip payloads of a dataset, in the format of the bulk import endpoint."""
+    rng = random.Random(seed)
+    places = cities(random.Random(seed + 1))
+    users = user_count(count)
+    for i in range(count):
+        city, country, lat, lng = rng.choice(places)
+        lat, lng = lat + rng.gauss(0, 0.2), lng + rng.gauss(0, 0.2)
+        start = date(2015, 1, 1) + timedelta(days=rng.randrange(3650))
+        words = rng.sample(WORDS, 2)
+        yield {
+            "title": f"{words[0].title()} and {words[1]} in {city}", "user_id": i % users + 1,
+            "country": country, "city": city, "start_date": start.isoformat(),
+            "end_date": (start + timedelta(days=rng.randrange(1, 21))).isoformat(),
+            "description": f"{rng.choice(WORDS)} and {rng.choice(WORDS)}", "is_public": rng.random() < 0.8,
+            "lat": round(lat, 5), "lng": round(lng, 5),
+            "activities": [
+                {"name": f"{rng.choice(WORDS).title()} {j}", "type": rng.choice(ACTIVITY_TYPES),
+                 "lat": round(lat + rng.gauss(0, 0.02), 5), "lng": round(lng + rng.gauss(0, 0.02), 5),
+                 "cost": round(rng.uniform(0, 200), 2), "rating": rng.randint(1, 5)}
+                for j in range(3)
+            ],
+        }
+
+
+def user_count(trip_count):
+    return max(10, trip_count // TRIPS_PER_USER)
+
+
+def manifest(scale, seed):
+    count = SCALES[scale]
+    return {"version": VERSION, "scale": scale, "seed": seed, "trips": count, "users": user_count(count),
+            "activities": 3 * count, "photos": count, "password": PASSWORD}
+
+
+def generate(path, scale, seed):
+    """Build the dataset into the SQLite file at ``path``; returns its manifest."""
+    count = SCALES[scale]
+    if os.path.exists(path):
+        os.remove(path)
+    app = make_app(f"sqlite:///{path}")
+    manager = app.config["db_manager"]
+    with app.app_context():
+        hashed = password_hash()
+        users = user_count(count)
+        for start in range(0, users, CHUNK_SIZE):
+            db.session.execute(insert(User), [
+                {"id": i, "username": f"user{i}", "email": f"user{i}@bench.pintrail.app", "password_hash": hashed}
+                for i in range(start + 1, min(users, start + CHUNK_SIZE) + 1)])
+        db.session.commit()
+
+        _, errors = manager.add_trips_bulk((i, *parse_bulk_trip(trip)) for i, trip in enumerate(trips(count, seed)))
+        if errors:
+            raise RuntimeError(f"{len(errors)} trips were not imported, e.g. {errors[0]}")
+        for start in range(0, count, CHUNK_SIZE):
+            db.session.execute(insert(Photo), [
+                {"trip_id": trip_id, "url": f"/uploads/photos/bench/{trip_id}.jpg", "caption": f"Photo {trip_id}"}
+                for trip_id in range(start + 1, min(count, start + CHUNK_SIZE) + 1)])
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+    return manifest(scale, seed)
+
+
+def ensure(scale, seed=42, force=False):
+    """The path of the dataset for ``scale`` and ``seed``, generating it when it is missing or stale."""
+    directory = data_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"pintrail-{scale}-{seed}.db")
+    manifest_path = path + ".json"
+    expected = manifest(scale, seed)
+    if not force and os.path.exists(path) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) == expected:
+                return path
+    started = time.perf_counter()
+    generate(path, scale, seed)
+    with open(manifest_path, "w") as f:
+        json.dump(expected, f, indent=2)
+    print(f"Generated {scale} dataset in {time.perf_counter() - started:.1f} s: {path}", file=sys.stderr)
+    return path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scale", nargs="?", default="1k", choices=SCALES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--force", action="store_true", help="rebuild even when a matching dataset exists")
+    args = parser.parse_args(argv)
+    print(ensure(args.scale, args.seed, args.force))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
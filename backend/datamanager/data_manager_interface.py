@@ -5,7 +5,7 @@ class DataManagerInterface(ABC):
 
 
     @abstractmethod
-    def get_trips(self):
+    def get_trips(self, limit=None, after=None, sort="id", fields=None, expand=("activities", "photos")):
         pass
 
     @abstractmethod
@@ -25,7 +25,7 @@ class DataManagerInterface(ABC):
         pass
 
     @abstractmethod
-    def get_trips_by_user(self, user_id):
+    def get_trips_by_user(self, user_id, fields=None, expand=("activities", "photos")):
         pass
 
     @abstractmethod
@@ -33,7 +33,7 @@ class DataManagerInterface(ABC):
         pass
 
     @abstractmethod
-    def get_all_users(self):
+    def get_all_users(self, limit=None, after=None):
         pass
 
     @abstractmethod
@@ -53,7 +53,7 @@ class DataManagerInterface(ABC):
         pass
 
     @abstractmethod
-    def get_activities(self):
+    def get_activities(self, limit=None, after=None):
         pass
 
     @abstractmethod
@@ -69,7 +69,7 @@ class DataManagerInterface(ABC):
         pass
 
     @abstractmethod
-    def get_photos(self):
+    def get_photos(self, limit=None, after=None):
         pass
 
     @abstractmethod
@@ -83,3 +83,11 @@ class DataManagerInterface(ABC):
     @abstractmethod
     def add_photo(self, photo_data):
         pass
+
+    @abstractmethod
+    def update_photo(self, photo_id, data):
+        pass
+
+    @abstractmethod
+    def delete_photo(self, photo_id):
+        pass
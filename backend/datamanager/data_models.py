@@ -3,7 +3,10 @@ from datetime import datetime
 
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from . import serializers
+from .replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = "users"
@@ -17,12 +20,7 @@ class User(db.Model):
     trips = db.relationship("Trip", backref="user", cascade="all, delete-orphan")
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "username": self.username,
-            "email": self.email,
-            "created_at": self.created_at.isoformat() if self.created_at else None
-        }
+        return serializers.to_dict("user", self)
 
 class Trip(db.Model):
     __tablename__ = "trips"
@@ -44,22 +42,7 @@ class Trip(db.Model):
     photos = db.relationship("Photo", backref="trip", cascade="all, delete-orphan")
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "user_id": self.user_id,
-            "country": self.country,
-            "city": self.city,
-            "start_date": self.start_date.isoformat() if self.start_date else None,
-            "end_date": self.end_date.isoformat() if self.end_date else None,
-            "description": self.description,
-            "notes": self.notes,
-            "is_public": self.is_public,
-            "activities": [activity.to_dict() for activity in self.activities] if self.activities else [],
-            "photos": [p.to_dict() for p in self.photos],
-            "lat": self.lat,
-            "lng": self.lng
-        }
+        return serializers.trip_to_dict(self)
 
 
 class Activity(db.Model):
@@ -77,18 +60,7 @@ class Activity(db.Model):
     lng = db.Column(db.Float, nullable=True)
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "trip_id": self.trip_id,
-            "type": self.type,
-            "name": self.name,
-            "location": self.location,
-            "cost": self.cost,
-            "rating": self.rating,
-            "notes": self.notes,
-            "lat": self.lat,
-            "lng": self.lng
-        }
+        return serializers.to_dict("activity", self)
 
 class Photo(db.Model):
     __tablename__ = "photos"
@@ -97,14 +69,41 @@ class Photo(db.Model):
     trip_id = db.Column(db.Integer, db.ForeignKey("trips.id"), nullable=False)
     url = db.Column(db.String(255))
     caption = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64), index=True)  # sha256 of the uploaded file
+    variants = db.Column(db.JSON(none_as_null=True))  # variant name -> URL, see photo_variants
 
     def to_dict(self):
-        return {
-            "id": self.id,
-            "trip_id": self.trip_id,
-            "url": self.url,
-            "caption": self.caption
-        }
+        return serializers.to_dict("photo", self)
+
+
+class PhotoBlob(db.Model):
+    """One stored photo file, shared by every photo with the same content."""
+    __tablename__ = "photo_blobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)  # sha256 of the file
+    path = db.Column(db.String(255), nullable=False)  # object path in storage
+    url = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # photos with this content_hash
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class PhotoVariant(db.Model):
+    """A stored derivative of an image, shared by every photo with the same content."""
+    __tablename__ = "photo_variants"
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    name = db.Column(db.String(20), nullable=False)  # 'thumb', 'medium' or 'webp'
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    url = db.Column(db.String(255), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("content_hash", "name", name="uq_photo_variants_hash_name"),
+    )
 
 
 class TokenBlackList(db.Model):
@@ -112,4 +111,113 @@ class TokenBlackList(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(120), nullable=False, unique=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, index=True)  # the token's exp, in UTC; the row can go after it
+
+class PinIndex(db.Model):
+    """Grid-cell index over trip and activity coordinates, maintained by the data manager."""
+    __tablename__ = "pin_index"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'trip' or 'activity'
+    ref_id = db.Column(db.Integer, nullable=False)
+    cell = db.Column(db.Integer, nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("kind", "ref_id", name="uq_pin_index_kind_ref"),
+        db.Index("ix_pin_index_cell", "cell", "lat", "lng", "ref_id"),
+    )
+
+
+class MapCluster(db.Model):
+    """Precomputed pin cluster for one grid cell at one zoom level."""
+    __tablename__ = "map_clusters"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'trip' or 'activity'
+    zoom = db.Column(db.Integer, nullable=False)
+    cx = db.Column(db.Integer, nullable=False)
+    cy = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    lat_sum = db.Column(db.Float, nullable=False, default=0.0)
+    lng_sum = db.Column(db.Float, nullable=False, default=0.0)
+    rep_id = db.Column(db.Integer)
+    rep_lat = db.Column(db.Float)
+    rep_lng = db.Column(db.Float)
+
+    __table_args__ = (
+        db.UniqueConstraint("kind", "zoom", "cy", "cx", name="uq_map_clusters_cell"),
+        db.Index("ix_map_clusters_rep", "kind", "rep_id"),
+    )
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "count": self.count,
+            "lat": self.lat_sum / self.count,
+            "lng": self.lng_sum / self.count,
+            "representative": {"id": self.rep_id, "lat": self.rep_lat, "lng": self.rep_lng},
+        }
+
+
+class SearchTerm(db.Model):
+    """Token index used for search when the database has no SQLite FTS5 support."""
+    __tablename__ = "search_terms"
+
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(100), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # 'trip' or 'activity'
+    ref_id = db.Column(db.Integer, nullable=False)
+    weight = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_search_terms_term", "term", "kind", "ref_id", "weight"),
+        db.Index("ix_search_terms_ref", "kind", "ref_id"),
+    )
+
+
+class ResourceRevision(db.Model):
+    """Write counter per resource, used as the ETag of its API representation."""
+    __tablename__ = "resource_revisions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'trip', 'activity', 'photo' or 'user_trips'
+    ref_id = db.Column(db.Integer, nullable=False)
+    revision = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        db.UniqueConstraint("kind", "ref_id", name="uq_resource_revisions_ref"),
+    )
+
+
+class PhotoJob(db.Model):
+    """A spooled photo upload waiting for, or done with, its trip to storage."""
+    __tablename__ = "photo_jobs"
+
+    id = db.Column(db.String(36), primary_key=True)  # uuid4, handed to the client
+    trip_id = db.Column(db.Integer, db.ForeignKey("trips.id", ondelete="CASCADE"), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued, running, done, failed
+    filename = db.Column(db.String(255), nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)
+    content_hash = db.Column(db.String(64))
+    caption = db.Column(db.String(255))
+    spool_path = db.Column(db.String(1024))  # local file, removed once the job is finished
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    photo_id = db.Column(db.Integer, db.ForeignKey("photos.id", ondelete="SET NULL"))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "trip_id": self.trip_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "photo_id": self.photo_id,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
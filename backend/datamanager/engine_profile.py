@@ -0,0 +1,75 @@
+"""Engine settings applied to every database connection.
+
+SQLite defaults suit a single writer: a rollback journal that blocks readers while writing, no
+busy timeout (concurrent writers fail at once with "database is locked"), a 2 MB page cache and
+a sync to disk on every commit. The profile below switches to WAL, waits for locks and trades
+the per-commit fsync for one per checkpoint, which is still durable against application crashes.
+Server databases get a sized connection pool instead.
+
+Everything can be overridden from the app config; ``SQLITE_PRAGMAS`` entries set to None are
+left at SQLite's default.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": 5000,  # ms
+    "synchronous": "NORMAL",
+    "cache_size": -65536,  # KiB when negative, so 64 MiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# Prepared statements kept per sqlite3 connection, and compiled SQL kept per engine.
+SQLITE_STATEMENT_CACHE = 256
+QUERY_CACHE_SIZE = 1000
+
+SERVER_POOL = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+
+def _is_memory(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def pragmas(config):
+    """The PRAGMAs for this app: the defaults merged with ``SQLITE_PRAGMAS``, unset ones dropped."""
+    merged = {**SQLITE_PRAGMAS, **(config.get("SQLITE_PRAGMAS") or {})}
+    return {name: value for name, value in merged.items() if value is not None}
+
+
+def engine_options(config, database_url):
+    """SQLAlchemy engine options for ``database_url``, with ``SQLALCHEMY_ENGINE_OPTIONS`` on top."""
+    url = make_url(database_url)
+    options = {"query_cache_size": config.get("SQLALCHEMY_QUERY_CACHE_SIZE", QUERY_CACHE_SIZE)}
+    if url.get_backend_name() == "sqlite":
+        timeout = pragmas(config).get("busy_timeout", 5000) / 1000
+        options["connect_args"] = {
+            "timeout": timeout,
+            "cached_statements": config.get("SQLITE_STATEMENT_CACHE", SQLITE_STATEMENT_CACHE),
+        }
+    else:
+        options.update({key: config.get(f"DB_{key.upper()}", value) for key, value in SERVER_POOL.items()})
+    return {**options, **(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})}
+
+
+def apply(engine, config):
+    """Run the SQLite PRAGMAs on every new connection of ``engine``; a no-op for other databases."""
+    if engine.dialect.name != "sqlite":
+        return
+    settings = pragmas(config)
+    if _is_memory(engine.url):
+        settings.pop("journal_mode", None)  # an in-memory database has no journal file
+        settings.pop("mmap_size", None)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
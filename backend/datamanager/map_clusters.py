@@ -0,0 +1,249 @@
+"""Hierarchical grid clustering of trip and activity pins for the map view.
+
+For every zoom level up to ``MAX_CLUSTER_ZOOM`` the world is cut into Web Mercator cells of
+``CELL_PIXELS`` screen pixels, and ``map_clusters`` keeps one row per non-empty cell with the
+pin count, the coordinate sums (for the centroid) and one representative pin. Pin writes only
+adjust the cells they touch, so serving a viewport is one indexed range query at any scale.
+Above ``MAX_CLUSTER_ZOOM`` viewports are small enough to return raw pins from the pin index.
+"""
+import math
+from collections import defaultdict
+
+from sqlalchemy import and_, bindparam, case, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from . import spatial_index
+from .data_models import MapCluster, PinIndex
+
+MAX_CLUSTER_ZOOM = 12
+MAX_ZOOM = 20
+TILE_PIXELS = 256
+CELL_PIXELS = 64
+MAX_LATITUDE = 85.05112878
+MAX_RESULTS = 10000
+KEY_BATCH = 300
+
+_clusters = MapCluster.__table__
+_upserts = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def grid_size(zoom):
+    return (2 ** zoom) * (TILE_PIXELS // CELL_PIXELS)
+
+
+def _finest_cell(lat, lng):
+    n = grid_size(MAX_CLUSTER_ZOOM)
+    sin_lat = math.sin(math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_xy(zoom, lat, lng):
+    """Cell of a point at ``zoom``.
+
+    Each zoom level halves the cells of the next one, so every level is derived from the
+    finest cell by a shift; a pin then lands in nested cells at all levels.
+    """
+    x, y = _finest_cell(lat, lng)
+    shift = MAX_CLUSTER_ZOOM - zoom
+    return x >> shift, y >> shift
+
+
+def cell_path(lat, lng):
+    """Return the (zoom, cx, cy) cell of a point at every zoom level up to ``MAX_CLUSTER_ZOOM``."""
+    x, y = _finest_cell(lat, lng)
+    return [(zoom, x >> (MAX_CLUSTER_ZOOM - zoom), y >> (MAX_CLUSTER_ZOOM - zoom))
+            for zoom in range(MAX_CLUSTER_ZOOM + 1)]
+
+
+def cell_bounds(zoom, cx, cy):
+    """Return (south, west, north, east) of a cell."""
+    n = grid_size(zoom)
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return latitude(cy + 1), cx / n * 360 - 180, latitude(cy), (cx + 1) / n * 360 - 180
+
+
+def _accumulate(deltas, pins, sign):
+    for ref_id, lat, lng in pins:
+        if lat is None or lng is None:
+            continue
+        for key in cell_path(lat, lng):
+            delta = deltas[key]
+            delta[0] += sign
+            delta[1] += sign * lat
+            delta[2] += sign * lng
+            if sign > 0 and delta[3] is None:
+                delta[3] = (ref_id, lat, lng)
+
+
+def _batches(items, size=KEY_BATCH):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _key_filter(kind, keys):
+    return and_(_clusters.c.kind == kind, tuple_(_clusters.c.zoom, _clusters.c.cx, _clusters.c.cy).in_(keys))
+
+
+def _cell_filter():
+    return and_(_clusters.c.kind == bindparam("b_kind"), _clusters.c.zoom == bindparam("b_zoom"),
+                _clusters.c.cx == bindparam("b_cx"), _clusters.c.cy == bindparam("b_cy"))
+
+
+def apply_pin_changes(session, kind, added, removed):
+    """Move ``removed`` pins out of and ``added`` pins into their cells at every zoom level.
+
+    Both are lists of (ref_id, lat, lng); a moved pin appears in both with its old and new
+    coordinates. Cells whose representative was removed get a new one from the pin index,
+    so the pin index must already reflect the change.
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0.0, None])
+    _accumulate(deltas, removed, -1)
+    _accumulate(deltas, added, 1)
+    if not deltas:
+        return
+
+    upsert = _upserts.get(session.get_bind().dialect.name)
+    if upsert is not None:
+        _upsert_cells(session, upsert, kind, deltas)
+    else:
+        _merge_cells(session, kind, deltas)
+
+    emptied = [{"b_kind": kind, "b_zoom": zoom, "b_cx": cx, "b_cy": cy}
+               for (zoom, cx, cy), delta in deltas.items() if delta[0] < 0]
+    if emptied:
+        session.execute(delete(_clusters).where(_cell_filter(), _clusters.c.count <= 0), emptied)
+
+    removed_ids = {ref_id for ref_id, _, _ in removed}
+    if removed_ids:
+        _replace_representatives(session, kind, removed_ids)
+
+
+def _upsert_cells(session, upsert, kind, deltas):
+    """Add every delta to its cell in one executemany, creating missing cells."""
+    statement = upsert(_clusters)
+    new = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=["kind", "zoom", "cy", "cx"],
+        set_={
+            "count": _clusters.c.count + new.count,
+            "lat_sum": _clusters.c.lat_sum + new.lat_sum,
+            "lng_sum": _clusters.c.lng_sum + new.lng_sum,
+            "rep_id": func.coalesce(_clusters.c.rep_id, new.rep_id),
+            "rep_lat": case((_clusters.c.rep_id.is_(None), new.rep_lat), else_=_clusters.c.rep_lat),
+            "rep_lng": case((_clusters.c.rep_id.is_(None), new.rep_lng), else_=_clusters.c.rep_lng),
+        },
+    )
+    session.execute(statement, [
+        {"kind": kind, "zoom": zoom, "cx": cx, "cy": cy, "count": delta[0],
+         "lat_sum": delta[1], "lng_sum": delta[2],
+         "rep_id": delta[3][0] if delta[3] else None,
+         "rep_lat": delta[3][1] if delta[3] else None,
+         "rep_lng": delta[3][2] if delta[3] else None}
+        for (zoom, cx, cy), delta in deltas.items()
+    ])
+
+
+def _merge_cells(session, kind, deltas):
+    """Portable version of ``_upsert_cells``: look up the existing cells, then update or insert."""
+    existing = set()
+    for keys in _batches(deltas):
+        existing.update(tuple(row) for row in session.execute(
+            select(_clusters.c.zoom, _clusters.c.cx, _clusters.c.cy).where(_key_filter(kind, keys))))
+
+    updates = [
+        {"b_kind": kind, "b_zoom": zoom, "b_cx": cx, "b_cy": cy,
+         "d_count": delta[0], "d_lat": delta[1], "d_lng": delta[2]}
+        for (zoom, cx, cy), delta in deltas.items() if (zoom, cx, cy) in existing
+    ]
+    if updates:
+        session.execute(
+            update(_clusters).where(_cell_filter()).values(
+                count=_clusters.c.count + bindparam("d_count"),
+                lat_sum=_clusters.c.lat_sum + bindparam("d_lat"),
+                lng_sum=_clusters.c.lng_sum + bindparam("d_lng"),
+            ),
+            updates,
+        )
+
+    inserts = [
+        {"kind": kind, "zoom": zoom, "cx": cx, "cy": cy, "count": delta[0],
+         "lat_sum": delta[1], "lng_sum": delta[2],
+         "rep_id": delta[3][0], "rep_lat": delta[3][1], "rep_lng": delta[3][2]}
+        for (zoom, cx, cy), delta in deltas.items()
+        if (zoom, cx, cy) not in existing and delta[0] > 0
+    ]
+    if inserts:
+        session.execute(insert(_clusters), inserts)
+
+
+def _replace_representatives(session, kind, removed_ids):
+    """Pick a new representative for every remaining cluster represented by a removed pin."""
+    for batch in _batches(removed_ids):
+        orphaned = session.execute(
+            select(_clusters.c.id, _clusters.c.zoom, _clusters.c.cx, _clusters.c.cy)
+            .where(_clusters.c.kind == kind, _clusters.c.rep_id.in_(batch))
+        ).all()
+        for cluster_id, zoom, cx, cy in orphaned:
+            pin = spatial_index.first_pin(session, kind, *cell_bounds(zoom, cx, cy))
+            rep_id, rep_lat, rep_lng = pin if pin else (None, None, None)
+            session.execute(update(_clusters).where(_clusters.c.id == cluster_id)
+                            .values(rep_id=rep_id, rep_lat=rep_lat, rep_lng=rep_lng))
+
+
+def apply_changes(session, changes, previous):
+    """Apply ``spatial_index.pending_changes`` output; ``previous`` maps kind to the old pins."""
+    for kind, (added, moved, _removed) in changes.items():
+        apply_pin_changes(session, kind, added + moved, previous.get(kind, []))
+
+
+def clusters_in_box(session, kind, zoom, south, west, north, east, limit=MAX_RESULTS):
+    """Clusters of ``kind`` pins overlapping the box at ``zoom``, as dicts."""
+    if zoom > MAX_CLUSTER_ZOOM:
+        return [
+            {"kind": kind, "count": 1, "lat": lat, "lng": lng,
+             "representative": {"id": ref_id, "lat": lat, "lng": lng}}
+            for ref_id, lat, lng in spatial_index.pins_within(session, kind, south, west, north, east, limit)
+        ]
+    n = grid_size(zoom)
+    first_x, north_y = cell_xy(zoom, north, west)
+    last_x, south_y = cell_xy(zoom, south, east)
+    x_ranges = [(first_x, last_x)] if west <= east else [(first_x, n - 1), (0, last_x)]
+    query = (
+        select(MapCluster)
+        .where(MapCluster.kind == kind, MapCluster.zoom == zoom, MapCluster.cy.between(north_y, south_y),
+               or_(*(MapCluster.cx.between(first, last) for first, last in x_ranges)))
+        .limit(limit)
+    )
+    return [cluster.to_dict() for cluster in session.scalars(query)]
+
+
+def rebuild(session, batch_size=5000):
+    """Recompute every cluster from the pin index, one zoom level at a time."""
+    session.execute(delete(_clusters))
+    for kind in spatial_index.PIN_MODELS:
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            cells = {}
+            query = (select(PinIndex.ref_id, PinIndex.lat, PinIndex.lng)
+                     .where(PinIndex.kind == kind).execution_options(yield_per=batch_size))
+            for ref_id, lat, lng in session.execute(query):
+                key = cell_xy(zoom, lat, lng)
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = [1, lat, lng, ref_id, lat, lng]
+                else:
+                    cell[0] += 1
+                    cell[1] += lat
+                    cell[2] += lng
+            rows = [
+                {"kind": kind, "zoom": zoom, "cx": cx, "cy": cy, "count": count, "lat_sum": lat_sum,
+                 "lng_sum": lng_sum, "rep_id": rep_id, "rep_lat": rep_lat, "rep_lng": rep_lng}
+                for (cx, cy), (count, lat_sum, lng_sum, rep_id, rep_lat, rep_lng) in cells.items()
+            ]
+            for batch in _batches(rows, batch_size):
+                session.execute(insert(_clusters), batch)
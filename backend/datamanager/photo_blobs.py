@@ -0,0 +1,84 @@
+"""Stored photo files shared by every photo with the same content.
+
+A ``PhotoBlob`` is one object in storage, named by the sha256 of its bytes, with a count of the
+``Photo`` rows that point at it through ``content_hash``. The count is kept by the session
+hook like the other derived tables, so it follows photos however they are removed, including
+the cascades from trips and users. Blobs whose count has dropped to zero are removed by
+``collect_orphans`` after the transaction that dropped it has committed.
+
+A writer may find a blob just before it is collected. Its count update then matches no row,
+and the flush fails with ``BlobGone`` rather than linking a photo to a removed file; the
+caller looks the content up again, which stores it anew.
+"""
+from collections import Counter
+
+from sqlalchemy import delete, inspect, select, update
+
+from . import photo_variants
+from .data_models import Photo, PhotoBlob, PhotoVariant
+
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif"}
+
+_blobs = PhotoBlob.__table__
+
+
+class BlobGone(Exception):
+    """Raised when a photo is linked to a blob that was collected after it was looked up."""
+
+    def __init__(self, content_hash):
+        super().__init__(f"The stored file for {content_hash} was removed meanwhile, store it again")
+        self.content_hash = content_hash
+
+
+def storage_path(content_hash, content_type):
+    return f"photos/blobs/{content_hash[:2]}/{content_hash}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def pending_changes(session):
+    """Reference count change per content hash from the photos in this flush."""
+    changes = Counter()
+    for obj in session.new:
+        if isinstance(obj, Photo) and obj.content_hash:
+            changes[obj.content_hash] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Photo) and obj.content_hash:
+            changes[obj.content_hash] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Photo):
+            history = inspect(obj).attrs.content_hash.history
+            for content_hash in history.added or ():
+                if content_hash:
+                    changes[content_hash] += 1
+            for content_hash in history.deleted or ():
+                if content_hash:
+                    changes[content_hash] -= 1
+    return {content_hash: delta for content_hash, delta in changes.items() if delta}
+
+
+def sync_session(session):
+    for content_hash, delta in pending_changes(session).items():
+        linked = session.execute(update(_blobs).where(_blobs.c.content_hash == content_hash)
+                                 .values(ref_count=_blobs.c.ref_count + delta)).rowcount
+        if delta > 0 and not linked:
+            raise BlobGone(content_hash)
+
+
+def find(session, content_hash):
+    """The blob already stored with ``content_hash``, if any."""
+    return session.scalars(select(PhotoBlob).where(PhotoBlob.content_hash == content_hash)).first()
+
+
+def collect_orphans(session):
+    """Delete the blobs no photo uses any more, with their variants; returns the storage paths to remove."""
+    variants = PhotoVariant.__table__
+    paths = []
+    for blob_id, content_hash, path in session.execute(
+            select(_blobs.c.id, _blobs.c.content_hash, _blobs.c.path).where(_blobs.c.ref_count <= 0)).all():
+        # Conditional, so a blob an upload has just linked to again survives.
+        if session.execute(delete(_blobs).where(_blobs.c.id == blob_id, _blobs.c.ref_count <= 0)).rowcount:
+            names = set(session.scalars(select(variants.c.name).where(variants.c.content_hash == content_hash)))
+            session.execute(delete(variants).where(variants.c.content_hash == content_hash))
+            paths.append(path)
+            paths.extend(photo_variants.storage_path(content_hash, variant)
+                         for variant in photo_variants.VARIANTS if variant.name in names)
+    return paths
@@ -0,0 +1,182 @@
+"""Background upload of spooled photos to storage.
+
+The upload route only spools the file to local disk and records a ``PhotoJob``; a small thread
+pool then sends the file to storage (unless a blob with the same content is there already),
+renders its resized variants, inserts the ``Photo`` row and retries failed attempts with
+exponential backoff. Jobs live in the database, so any worker can report their status, and a
+job is claimed with a conditional UPDATE, so it runs once even if several processes pick it up.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+
+from . import photo_blobs, photo_variants
+from .data_models import db, Photo, PhotoBlob, PhotoJob, PhotoVariant
+
+logger = logging.getLogger(__name__)
+
+# A job still "running" after this long belonged to a worker that went away.
+STALE_AFTER = timedelta(minutes=10)
+
+
+class PhotoIngestion:
+    """Runs photo jobs for ``app``; ``store(path, body, content_type)`` uploads and returns the URL."""
+
+    def __init__(self, app, store, workers=2, max_attempts=5, backoff=1.0):
+        self.app = app
+        self.store = store
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo-ingest")
+
+    def submit(self, job_id, delay=0):
+        if delay:
+            timer = threading.Timer(delay, self.submit, (job_id,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.executor.submit(self._run, job_id)
+
+    def submit_variants(self, content_hash, spool_path):
+        """Render the variants of a spooled image for the photos that have its content but none yet.
+
+        Takes over ``spool_path`` and removes it when done.
+        """
+        self.executor.submit(self._run_variants, content_hash, spool_path)
+
+    def _run_variants(self, content_hash, spool_path):
+        with self.app.app_context():
+            try:
+                variants, rows = self._variants(content_hash, spool_path)
+                if variants:
+                    db.session.add_all(rows)
+                    # Through the ORM, so the photos' and trips' ETags move on.
+                    for photo in Photo.query.filter(Photo.content_hash == content_hash, Photo.variants.is_(None)):
+                        photo.variants = variants
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not store variants of %s", content_hash)
+            finally:
+                _remove(spool_path)
+
+    def recover(self):
+        """Requeue the jobs a previous process accepted but did not finish."""
+        stale = datetime.utcnow() - STALE_AFTER
+        jobs = PhotoJob.query.filter(or_(
+            PhotoJob.status == "queued",
+            (PhotoJob.status == "running") & (PhotoJob.updated_at < stale),
+        )).all()
+        for job in jobs:
+            if job.spool_path and os.path.exists(job.spool_path):
+                job.status = "queued"
+            else:
+                job.status, job.error = "failed", "The spooled file is gone"
+        db.session.commit()
+        for job in jobs:
+            if job.status == "queued":
+                self.submit(job.id)
+
+    def discard(self, jobs):
+        """Remove the spooled files of deleted ``jobs`` that no worker has claimed.
+
+        A running job removes its own file once it finds its row gone.
+        """
+        for job in jobs:
+            if job.status == "queued" and job.spool_path:
+                _remove(job.spool_path)
+
+    def _claim(self, job_id):
+        claimed = db.session.execute(
+            update(PhotoJob)
+            .where(PhotoJob.id == job_id, PhotoJob.status == "queued")
+            .values(status="running", attempts=PhotoJob.attempts + 1, updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return db.session.get(PhotoJob, job_id) if claimed else None
+
+    def _store_original(self, job):
+        """(URL, new ``PhotoBlob`` or None) of the job's file, uploading it only when no blob has the
+        same content yet. Adds nothing to the session, so no write transaction is open meanwhile."""
+        blob = photo_blobs.find(db.session, job.content_hash) if job.content_hash else None
+        if blob is not None:
+            return blob.url, None
+        # A fixed path per content (or per job), so a retry overwrites rather than duplicates the object.
+        path = (photo_blobs.storage_path(job.content_hash, job.content_type) if job.content_hash
+                else f"photos/{job.trip_id}/{job.id}_{job.filename}")
+        with open(job.spool_path, "rb") as body:
+            url = self.store(path, body, job.content_type)
+        if not job.content_hash:
+            return url, None
+        # Starts unreferenced; the session hook counts the photo about to be added.
+        return url, PhotoBlob(content_hash=job.content_hash, path=path, url=url,
+                              content_type=job.content_type, size=os.path.getsize(job.spool_path))
+
+    def _variants(self, content_hash, spool_path):
+        """Variant URLs for the spooled image and the new ``PhotoVariant`` rows to add with them,
+        rendering and storing only the variants not cached yet."""
+        if not content_hash or not photo_variants.available():
+            return None, []
+        urls = {variant.name: variant.url
+                for variant in PhotoVariant.query.filter_by(content_hash=content_hash)}
+        missing = [variant for variant in photo_variants.VARIANTS if variant.name not in urls]
+        rows = []
+        if missing:
+            try:
+                rendered = list(photo_variants.render(spool_path, missing))
+            except Exception:
+                # The original is still worth keeping when it cannot be decoded.
+                logger.exception("Could not render variants of %s", content_hash)
+                return urls or None, []
+            for variant, data, (width, height) in rendered:
+                url = self.store(photo_variants.storage_path(content_hash, variant), data,
+                                 variant.content_type)
+                rows.append(PhotoVariant(content_hash=content_hash, name=variant.name,
+                                         width=width, height=height, url=url))
+                urls[variant.name] = url
+        return urls, rows
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = self._claim(job_id)
+            if job is None:
+                return
+            spool_path = job.spool_path
+            try:
+                # Every upload first, then every row in one short transaction: a pending row would
+                # be flushed by the next query and hold the database's write lock through the uploads.
+                url, blob = self._store_original(job)
+                variants, rows = self._variants(job.content_hash, spool_path)
+                photo = Photo(trip_id=job.trip_id, url=url, caption=job.caption,
+                              content_hash=job.content_hash, variants=variants)
+                db.session.add_all(([blob] if blob is not None else []) + rows + [photo])
+                db.session.flush()
+                job.photo_id, job.status, job.error = photo.id, "done", None
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(PhotoJob, job_id)
+                if job is None:  # the trip, and with it the job, was deleted meanwhile
+                    _remove(spool_path)
+                    return
+                if job.attempts < self.max_attempts and os.path.exists(spool_path):
+                    job.status, job.error = "queued", str(e)
+                    db.session.commit()
+                    self.submit(job_id, self.backoff * 2 ** (job.attempts - 1))
+                    return
+                _remove(spool_path)
+                job.status, job.error = "failed", str(e)
+                db.session.commit()
+                return
+            _remove(spool_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
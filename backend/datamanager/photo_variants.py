@@ -0,0 +1,51 @@
+"""Resized derivatives of uploaded photos, for gallery tiles and previews.
+
+Variants are rendered by the ingestion workers, never in a request. They are stored under the
+content hash of the original plus the variant's size, so the same picture uploaded twice
+shares one set of files, and ``PhotoVariant`` rows remember which ones already exist.
+"""
+import io
+from collections import namedtuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: photos are stored without variants without it
+    Image = None
+
+Variant = namedtuple("Variant", "name size format content_type extension")
+
+VARIANTS = (
+    Variant("thumb", 256, "JPEG", "image/jpeg", "jpg"),
+    Variant("medium", 1024, "JPEG", "image/jpeg", "jpg"),
+    Variant("webp", 1024, "WEBP", "image/webp", "webp"),
+)
+QUALITY = 82
+
+
+def available():
+    return Image is not None
+
+
+def storage_path(content_hash, variant):
+    return f"variants/{content_hash[:2]}/{content_hash}/{variant.name}-{variant.size}.{variant.extension}"
+
+
+def render(path, variants=VARIANTS):
+    """Yield ``(variant, data, (width, height))`` for each of ``variants`` of the image at ``path``."""
+    largest = max(variant.size for variant in variants)
+    with Image.open(path) as original:
+        # Lets the JPEG decoder scale down while decoding instead of decoding full size.
+        original.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        # Largest first, each one resized from the previous to keep the work small.
+        for variant in sorted(variants, key=lambda v: -v.size):
+            resized = image.copy()
+            resized.thumbnail((variant.size, variant.size), Image.LANCZOS)
+            image = resized
+            if variant.format == "JPEG" and resized.mode != "RGB":
+                resized = resized.convert("RGB")
+            buffer = io.BytesIO()
+            resized.save(buffer, variant.format, quality=QUALITY, optimize=True)
+            yield variant, buffer.getvalue(), resized.size
@@ -0,0 +1,96 @@
+"""Read replicas for the data manager's read-only methods.
+
+Methods decorated with ``replica_read`` run their queries on one of the engines listed in
+``SQLALCHEMY_REPLICA_URIS``; every other query, every flush and every INSERT, UPDATE or DELETE
+goes to the primary. Once the session has written, the rest of the app context (one request)
+reads from the primary too, so a request always sees its own writes. Between requests the
+replicas may lag: a read right after a write made by an earlier request can briefly return the
+older rows.
+
+Objects loaded from a replica belong to the same session as everything else, so changing them
+and committing writes to the primary as usual. The identity map would hand the replica's copy
+back to a later lookup by id, so the data manager's write methods reload their object from the
+primary (``read_from_replica``) before changing it.
+"""
+import functools
+import itertools
+import threading
+from contextvars import ContextVar
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.sql.dml import UpdateBase
+
+from . import engine_profile
+
+_reading = ContextVar("replica_read", default=False)
+
+
+class ReplicaSet:
+    """The replica engines, handed out round-robin, one per app context."""
+
+    def __init__(self, engines=()):
+        self.engines = list(engines)
+        self._next = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.engines)
+
+    def choose(self):
+        with self._lock:
+            return next(self._next)
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+def create_replicas(app):
+    """Create the engines for ``SQLALCHEMY_REPLICA_URIS`` with the same profile as the primary."""
+    engines = []
+    for url in app.config.get("SQLALCHEMY_REPLICA_URIS") or ():
+        engine = create_engine(url, **engine_profile.engine_options(app.config, url))
+        engine_profile.apply(engine, app.config)
+        engines.append(engine)
+    app.extensions["db_replicas"] = ReplicaSet(engines)
+    return app.extensions["db_replicas"]
+
+
+def replica_read(method):
+    """Run ``method``'s queries on a replica unless this request has already written."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        token = _reading.set(True)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _reading.reset(token)
+    return wrapper
+
+
+def read_from_replica():
+    """True once this app context has run a query on a replica."""
+    return has_app_context() and "db_replica" in g
+
+
+def _replica():
+    replicas = current_app.extensions.get("db_replicas")
+    if not replicas:
+        return None
+    if "db_replica" not in g:
+        g.db_replica = replicas.choose()
+    return g.db_replica
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            elif _reading.get() and not g.get("db_wrote"):
+                replica = _replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
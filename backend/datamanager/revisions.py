@@ -0,0 +1,82 @@
+"""Per-resource revision counters behind the ETags of trip, activity and photo reads.
+
+Every flush that writes a Trip, Activity or Photo bumps the revision of that resource, of
+the trip it belongs to (a trip's representation embeds its activities and photos) and of the
+owner's ``user_trips`` listing. Counters are never deleted, so a re-used id keeps counting
+up instead of repeating an ETag that a client may still hold.
+"""
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from .data_models import Activity, Photo, ResourceRevision, Trip
+
+_revisions = ResourceRevision.__table__
+_upserts = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def etag(kind, ref_id, revision):
+    return f"{kind}-{ref_id}-r{revision}"
+
+
+def _previous(obj, attribute):
+    """Values the attribute had before this flush, if it changed."""
+    return [value for value in inspect(obj).attrs[attribute].history.deleted if value is not None]
+
+
+def changed_resources(session):
+    """Return the (kind, ref_id) pairs whose representation the flush in progress changes."""
+    keys = set()
+    trip_ids = set()
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Trip):
+            keys.add(("trip", obj.id))
+            user_ids.update([obj.user_id] + _previous(obj, "user_id"))
+        elif isinstance(obj, (Activity, Photo)):
+            keys.add(("activity" if isinstance(obj, Activity) else "photo", obj.id))
+            trip_ids.update([obj.trip_id] + _previous(obj, "trip_id"))
+    trip_ids.discard(None)
+    if trip_ids:
+        keys.update(("trip", trip_id) for trip_id in trip_ids)
+        user_ids.update(session.scalars(select(Trip.user_id).where(Trip.id.in_(trip_ids))))
+        user_ids.update(obj.user_id for obj in session.deleted if isinstance(obj, Trip) and obj.id in trip_ids)
+    user_ids.discard(None)
+    keys.update(("user_trips", user_id) for user_id in user_ids)
+    return keys
+
+
+def bump(session, keys):
+    """Increment the revision of every (kind, ref_id) in ``keys``, creating counters at 1."""
+    keys = sorted(keys)
+    if not keys:
+        return
+    upsert = _upserts.get(session.get_bind().dialect.name)
+    if upsert is not None:
+        statement = upsert(_revisions).on_conflict_do_update(
+            index_elements=["kind", "ref_id"], set_={"revision": _revisions.c.revision + 1})
+        session.execute(statement, [{"kind": kind, "ref_id": ref_id, "revision": 1} for kind, ref_id in keys])
+        return
+    existing = set(session.execute(
+        select(_revisions.c.kind, _revisions.c.ref_id)
+        .where(_revisions.c.ref_id.in_([ref_id for _, ref_id in keys]))))
+    for kind, ref_id in keys:
+        if (kind, ref_id) in existing:
+            session.execute(_revisions.update()
+                            .where(_revisions.c.kind == kind, _revisions.c.ref_id == ref_id)
+                            .values(revision=_revisions.c.revision + 1))
+        else:
+            session.execute(_revisions.insert().values(kind=kind, ref_id=ref_id, revision=1))
+
+
+def sync_session(session):
+    bump(session, changed_resources(session))
+
+
+def current(session, kind, ref_id):
+    """Revision of a resource; 0 when it has never been written since revisions were tracked."""
+    revision = session.execute(
+        select(_revisions.c.revision).where(_revisions.c.kind == kind, _revisions.c.ref_id == ref_id)
+    ).scalar()
+    return revision or 0
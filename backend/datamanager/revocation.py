@@ -0,0 +1,95 @@
+"""In-memory front for the token blacklist.
+
+Every ``@jwt_required`` request asks whether its token was revoked, and almost never is. A bloom
+filter over the revoked jtis answers that common case without a query; only its (rare) hits
+are looked up in the table, and those answers are kept in a small LRU. A bloom filter cannot
+forget, so purging expired rows rebuilds it from what is left.
+
+Revocations made by this process are seen at once. Those made by other workers reach the
+filter on the next refresh, which reads the rows created since the newest one seen, minus an
+overlap window: a row can commit after rows created later than it (concurrent transactions,
+sequences handed out of order), and the window picks it up anyway. A row that takes longer than
+the window to commit is picked up by the next purge, which reloads everything.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+
+class BloomFilter:
+    """Fixed-size bloom filter sized for ``capacity`` items at ``error_rate`` false positives."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationCache:
+    """Bloom filter plus bounded LRU of confirmed answers, in front of the blacklist table."""
+
+    def __init__(self, lru_size=10000, error_rate=0.001):
+        self.lru_size = lru_size
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.watermark = None  # created_at of the newest blacklist row seen so far
+        self.reset()
+
+    def reset(self, rows=(), capacity=1024):
+        """Replace the contents with ``rows`` of (created_at, jti); the filter leaves room to grow."""
+        rows = list(rows)
+        with self.lock:
+            self.bloom = BloomFilter(max(capacity, 2 * len(rows)), self.error_rate)
+            self.lru = OrderedDict()
+            self.watermark = None
+            self._add_rows(rows)
+
+    def add(self, rows):
+        """Record revoked ``rows`` of (created_at, jti). Returns False once the filter is full."""
+        with self.lock:
+            self._add_rows(rows)
+            return self.bloom.count <= self.bloom.capacity
+
+    def _add_rows(self, rows):
+        for created_at, jti in rows:
+            if jti not in self.bloom:  # rows in the overlap window come back on every refresh
+                self.bloom.add(jti)
+            self._remember(jti, True)
+            if created_at is not None and (self.watermark is None or created_at > self.watermark):
+                self.watermark = created_at
+
+    def _remember(self, jti, revoked):
+        self.lru[jti] = revoked
+        self.lru.move_to_end(jti)
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def is_revoked(self, jti, lookup):
+        """Answer from the filter or the LRU when possible, otherwise call ``lookup(jti)``."""
+        with self.lock:
+            if jti not in self.bloom:
+                return False
+            if jti in self.lru:
+                self.lru.move_to_end(jti)
+                return self.lru[jti]
+        revoked = lookup(jti)
+        with self.lock:
+            # A revocation recorded while the lookup ran wins over its answer.
+            self._remember(jti, revoked or self.lru.get(jti, False))
+        return revoked
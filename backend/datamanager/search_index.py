@@ -0,0 +1,221 @@
+"""Full-text search over trips and activities.
+
+On SQLite builds with FTS5 the documents live in the ``search_fts`` virtual table (prefix
+indexes for 2 to 4 characters, bm25 ranking). Everywhere else the same documents are split
+into tokens in ``search_terms`` and matched with index range scans on the token prefix.
+Either way each trip or activity is one document with four weighted fields.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+from sqlalchemy import delete, event, func, insert, inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+from .data_models import db, Activity, SearchTerm, Trip
+
+FTS_TABLE = "search_fts"
+FIELDS = ("title", "place", "body", "tags")
+FIELD_WEIGHTS = {"title": 10.0, "place": 5.0, "body": 1.0, "tags": 3.0}
+KIND_CODES = {"trip": 0, "activity": 1}
+KIND_NAMES = {code: kind for kind, code in KIND_CODES.items()}
+MAX_QUERY_TERMS = 8
+MAX_TERM_LENGTH = 100
+
+# Set to False to force the token-table path even where FTS5 is available.
+PREFER_FTS5 = True
+
+INDEXED_FIELDS = {
+    Trip: ("title", "description", "notes", "city", "country"),
+    Activity: ("name", "location", "notes", "type"),
+}
+
+_fts5_databases = {}
+
+
+def _join(*parts):
+    return " ".join(part for part in parts if part)
+
+
+def trip_document(trip):
+    """Return (kind, ref_id, fields) for a Trip or a row with the same attributes."""
+    return "trip", trip.id, {"title": trip.title or "", "place": _join(trip.city, trip.country),
+                             "body": _join(trip.description, trip.notes), "tags": ""}
+
+
+def activity_document(activity):
+    return "activity", activity.id, {"title": activity.name or "", "place": activity.location or "",
+                                     "body": activity.notes or "", "tags": activity.type or ""}
+
+
+DOCUMENT_BUILDERS = {Trip: trip_document, Activity: activity_document}
+
+
+def tokenize(value):
+    """Lower-case word tokens with accents removed, matching FTS5's unicode61 tokenizer."""
+    if not value:
+        return []
+    decomposed = unicodedata.normalize("NFKD", value)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return [token[:MAX_TERM_LENGTH] for token in re.findall(r"\w+", stripped.lower())]
+
+
+def _rowid(kind, ref_id):
+    return ref_id * len(KIND_CODES) + KIND_CODES[kind]
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_fts_table(target, connection, **kw):
+    available = False
+    if PREFER_FTS5 and connection.dialect.name == "sqlite":
+        try:
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(FIELDS)}, prefix='2 3 4', tokenize='unicode61 remove_diacritics 2')"
+            )
+            available = True
+        except OperationalError:
+            available = False
+    _fts5_databases[str(connection.engine.url)] = available
+
+
+@event.listens_for(db.metadata, "after_drop")
+def _drop_fts_table(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def uses_fts5(session):
+    # Keyed by the primary: a replica is a copy of it, FTS table included, and is never created here.
+    return _fts5_databases.get(str(db.engine.url), False)
+
+
+def _fts_delete(session, rowids):
+    if rowids:
+        session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :rowid"),
+                        [{"rowid": rowid} for rowid in rowids])
+
+
+def _term_rows(kind, ref_id, fields):
+    weights = defaultdict(float)
+    for field, value in fields.items():
+        for token in tokenize(value):
+            weights[token] += FIELD_WEIGHTS[field]
+    return [{"term": term, "kind": kind, "ref_id": ref_id, "weight": weight} for term, weight in weights.items()]
+
+
+def index_documents(session, documents, replace=True):
+    """Write (kind, ref_id, fields) documents; ``replace`` first removes any existing entries."""
+    documents = list(documents)
+    if not documents:
+        return
+    if replace:
+        remove_documents(session, [(kind, ref_id) for kind, ref_id, _ in documents])
+    if uses_fts5(session):
+        session.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FIELDS)}) "
+                 f"VALUES (:rowid, {', '.join(':' + field for field in FIELDS)})"),
+            [{"rowid": _rowid(kind, ref_id), **fields} for kind, ref_id, fields in documents],
+        )
+    else:
+        rows = [row for kind, ref_id, fields in documents for row in _term_rows(kind, ref_id, fields)]
+        if rows:
+            session.execute(insert(SearchTerm), rows)
+
+
+def remove_documents(session, keys):
+    """Remove the documents for (kind, ref_id) keys."""
+    keys = list(keys)
+    if not keys:
+        return
+    if uses_fts5(session):
+        _fts_delete(session, [_rowid(kind, ref_id) for kind, ref_id in keys])
+        return
+    by_kind = defaultdict(list)
+    for kind, ref_id in keys:
+        by_kind[kind].append(ref_id)
+    for kind, ref_ids in by_kind.items():
+        session.execute(delete(SearchTerm).where(SearchTerm.kind == kind, SearchTerm.ref_id.in_(ref_ids)))
+
+
+def _text_changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def sync_session(session):
+    """Mirror the Trip/Activity text written by the flush in progress (run from ``after_flush``)."""
+    added, changed, removed = [], [], []
+    for model, fields in INDEXED_FIELDS.items():
+        build = DOCUMENT_BUILDERS[model]
+        added += [build(obj) for obj in session.new if isinstance(obj, model)]
+        changed += [build(obj) for obj in session.dirty
+                    if isinstance(obj, model) and _text_changed(obj, fields)]
+        removed += [build(obj)[:2] for obj in session.deleted if isinstance(obj, model)]
+    index_documents(session, added, replace=False)
+    index_documents(session, changed)
+    remove_documents(session, removed)
+
+
+def _fts_query(tokens):
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search(session, query, limit=20, offset=0, kind=None):
+    """Rank documents matching every term of ``query`` as a prefix; returns [(kind, ref_id, score)].
+
+    Higher scores are better. ``kind`` restricts results to 'trip' or 'activity'. Every match
+    is ranked; with FTS5 the weights go through the ``rank`` column, so ``ORDER BY rank LIMIT``
+    keeps only the best ``offset + limit`` rows while it scores them.
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TERMS]
+    if not tokens:
+        return []
+    if uses_fts5(session):
+        weights = ", ".join(str(FIELD_WEIGHTS[field]) for field in FIELDS)
+        kind_filter = f"AND rowid % {len(KIND_CODES)} = {KIND_CODES[kind]}" if kind else ""
+        rows = session.execute(
+            text(f"SELECT rowid, rank FROM {FTS_TABLE} "
+                 f"WHERE {FTS_TABLE} MATCH :match AND rank MATCH 'bm25({weights})' {kind_filter} "
+                 f"ORDER BY rank, rowid LIMIT :limit OFFSET :offset"),
+            {"match": _fts_query(tokens), "limit": limit, "offset": offset},
+        )
+        return [(KIND_NAMES[rowid % len(KIND_CODES)], rowid // len(KIND_CODES), -rank) for rowid, rank in rows]
+
+    scores = None
+    for token in dict.fromkeys(tokens):
+        matches = (select(SearchTerm.kind, SearchTerm.ref_id, func.sum(SearchTerm.weight))
+                   .where(SearchTerm.term >= token, SearchTerm.term < token + "\U0010ffff")
+                   .group_by(SearchTerm.kind, SearchTerm.ref_id))
+        if kind:
+            matches = matches.where(SearchTerm.kind == kind)
+        token_scores = {(row_kind, ref_id): weight for row_kind, ref_id, weight in session.execute(matches)}
+        if scores is None:
+            scores = token_scores
+        else:
+            scores = {key: score + token_scores[key] for key, score in scores.items() if key in token_scores}
+        if not scores:
+            return []
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], KIND_CODES[item[0][0]], item[0][1]))
+    return [(row_kind, ref_id, score) for (row_kind, ref_id), score in ranked[offset:offset + limit]]
+
+
+def is_empty(session):
+    if uses_fts5(session):
+        return session.execute(text(f"SELECT rowid FROM {FTS_TABLE} LIMIT 1")).first() is None
+    return session.execute(select(SearchTerm.id).limit(1)).first() is None
+
+
+def rebuild(session, batch_size=2000):
+    """Re-index every trip and activity."""
+    if uses_fts5(session):
+        session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    session.execute(delete(SearchTerm))
+    for model, fields in INDEXED_FIELDS.items():
+        build = DOCUMENT_BUILDERS[model]
+        columns = [model.id] + [getattr(model, field) for field in fields]
+        query = select(*columns).execution_options(yield_per=batch_size)
+        for partition in session.execute(query).partitions():
+            index_documents(session, (build(row) for row in partition), replace=False)
+    if uses_fts5(session):
+        session.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
@@ -0,0 +1,71 @@
+"""The one mapping from users, trips, activities and photos to JSON-ready dicts.
+
+Every kind has a fixed field order. ``row_serializer`` compiles, once per field selection, a
+function that turns a row tuple in that order into a dict, so list queries can select plain
+columns and skip building ORM objects altogether. ``to_dict`` applies the same function to a
+loaded instance, reading its ``__dict__`` instead of going through the instrumented attributes.
+"""
+from functools import lru_cache
+
+USER_FIELDS = ("id", "username", "email", "created_at")
+TRIP_FIELDS = (
+    "id", "title", "user_id", "country", "city", "start_date", "end_date",
+    "description", "notes", "is_public", "lat", "lng",
+)
+ACTIVITY_FIELDS = ("id", "trip_id", "type", "name", "location", "cost", "rating", "notes", "lat", "lng")
+PHOTO_FIELDS = ("id", "trip_id", "url", "caption", "variants")
+
+FIELDS = {"user": USER_FIELDS, "trip": TRIP_FIELDS, "activity": ACTIVITY_FIELDS, "photo": PHOTO_FIELDS}
+# Relationships a trip can embed, mapped to the kind of their items.
+TRIP_EXPANSIONS = {"activities": "activity", "photos": "photo"}
+TEMPORAL_FIELDS = frozenset(("created_at", "start_date", "end_date"))
+
+
+@lru_cache(maxsize=None)
+def row_serializer(kind, fields=None):
+    """Return a function mapping a row of ``fields`` (default: all of ``kind``'s) to a dict."""
+    fields = tuple(fields or FIELDS[kind])
+    temporal = [field for field in fields if field in TEMPORAL_FIELDS]
+    if not temporal:
+        return lambda row: dict(zip(fields, row))
+
+    def serialize(row):
+        item = dict(zip(fields, row))
+        for field in temporal:
+            value = item[field]
+            if value is not None:
+                item[field] = value.isoformat()
+        return item
+
+    return serialize
+
+
+def columns(model, kind, fields=None):
+    """The mapped columns of ``model`` in the order ``row_serializer(kind, fields)`` expects."""
+    return [getattr(model, field) for field in fields or FIELDS[kind]]
+
+
+def to_dict(kind, obj, fields=None):
+    state = obj.__dict__
+    values = [state[field] if field in state else getattr(obj, field) for field in fields or FIELDS[kind]]
+    return row_serializer(kind, fields)(values)
+
+
+def trip_to_dict(trip, fields=None, expand=tuple(TRIP_EXPANSIONS)):
+    item = to_dict("trip", trip, fields)
+    for name in expand:
+        item[name] = [to_dict(TRIP_EXPANSIONS[name], child) for child in getattr(trip, name)]
+    return item
+
+
+def embed(items, name, rows):
+    """Attach serialized ``rows`` of the ``name`` relationship to the trip dicts they belong to."""
+    serialize = row_serializer(TRIP_EXPANSIONS[name])
+    by_id = {}
+    for item in items:
+        item[name] = []
+        by_id[item["id"]] = item[name]
+    for row in rows:
+        child = serialize(row)
+        by_id[child["trip_id"]].append(child)
+    return items
@@ -0,0 +1,196 @@
+"""Grid-cell spatial index over trip and activity pins.
+
+Every pin is stored in ``pin_index`` with the id of the 0.1 degree grid cell it falls in.
+Cells are numbered row by row, so the cells of a bounding box form one contiguous id range
+per grid row and a box query becomes a handful of index range scans instead of a table scan.
+Each kind of pin gets its own block of cell ids, which keeps the query down to range terms
+only (an extra ``kind = ?`` term makes SQLite prefer the equality index and scan every pin).
+"""
+import math
+
+from sqlalchemy import and_, delete, insert, inspect, or_, select
+
+from .data_models import Activity, PinIndex, Trip
+
+CELL_DEGREES = 0.1
+ROWS = int(180 / CELL_DEGREES)
+COLUMNS = int(360 / CELL_DEGREES)
+# Boxes taller than this many rows are searched as one coarse cell range.
+MAX_ROW_RANGES = 64
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+CELLS = ROWS * COLUMNS
+
+PIN_MODELS = {"trip": Trip, "activity": Activity}
+KIND_BLOCKS = {"trip": 0, "activity": 1}
+
+
+def _row(lat):
+    return min(max(int((lat + 90) / CELL_DEGREES), 0), ROWS - 1)
+
+
+def _column(lng):
+    return min(max(int((lng + 180) / CELL_DEGREES), 0), COLUMNS - 1)
+
+
+def cell_of(kind, lat, lng):
+    return KIND_BLOCKS[kind] * CELLS + _row(lat) * COLUMNS + _column(lng)
+
+
+def cell_ranges(kind, south, west, north, east):
+    """Return (first, last) cell id ranges covering the box; west > east crosses the antimeridian."""
+    if west > east:
+        return cell_ranges(kind, south, west, north, 180.0) + cell_ranges(kind, south, -180.0, north, east)
+    base = KIND_BLOCKS[kind] * CELLS
+    first_row, last_row = _row(south), _row(north)
+    first_col, last_col = _column(west), _column(east)
+    if last_row - first_row >= MAX_ROW_RANGES:
+        return [(base + first_row * COLUMNS + first_col, base + last_row * COLUMNS + last_col)]
+    return [(base + row * COLUMNS + first_col, base + row * COLUMNS + last_col)
+            for row in range(first_row, last_row + 1)]
+
+
+def _box_filter(kind, south, west, north, east):
+    lng_filter = (PinIndex.lng.between(west, east) if west <= east
+                  else or_(PinIndex.lng >= west, PinIndex.lng <= east))
+    return and_(
+        or_(*(PinIndex.cell.between(first, last) for first, last in cell_ranges(kind, south, west, north, east))),
+        PinIndex.lat.between(south, north),
+        lng_filter,
+    )
+
+
+def within_ids(kind, south, west, north, east):
+    """Select statement for the ids of ``kind`` pins inside the box."""
+    return select(PinIndex.ref_id).where(_box_filter(kind, south, west, north, east))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(lat, lng, radius_km):
+    """Bounding box (south, west, north, east) that contains the circle around a point."""
+    dlat = radius_km / KM_PER_DEGREE
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat <= 0 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        return south, -180.0, north, 180.0
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat)
+    west, east = lng - dlng, lng + dlng
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
+
+
+def nearby(session, kind, lat, lng, radius_km):
+    """Return [(ref_id, distance_km)] of ``kind`` pins within the radius, nearest first."""
+    south, west, north, east = radius_box(lat, lng, radius_km)
+    rows = session.execute(
+        select(PinIndex.ref_id, PinIndex.lat, PinIndex.lng).where(_box_filter(kind, south, west, north, east))
+    )
+    hits = []
+    for ref_id, pin_lat, pin_lng in rows:
+        distance = haversine_km(lat, lng, pin_lat, pin_lng)
+        if distance <= radius_km:
+            hits.append((ref_id, distance))
+    hits.sort(key=lambda hit: hit[1])
+    return hits
+
+
+def set_pins(session, kind, pins):
+    """Replace the index entries for ``pins``, an iterable of (ref_id, lat, lng); missing coordinates unindex."""
+    pins = list(pins)
+    if not pins:
+        return
+    remove_pins(session, kind, [ref_id for ref_id, _, _ in pins])
+    insert_pins(session, kind, pins)
+
+
+def insert_pins(session, kind, pins):
+    """Index new (ref_id, lat, lng) pins; pins without coordinates are skipped."""
+    rows = [
+        {"kind": kind, "ref_id": ref_id, "cell": cell_of(kind, lat, lng), "lat": lat, "lng": lng}
+        for ref_id, lat, lng in pins
+        if lat is not None and lng is not None
+    ]
+    if rows:
+        session.execute(insert(PinIndex), rows)
+
+
+def remove_pins(session, kind, ref_ids):
+    ref_ids = list(ref_ids)
+    if ref_ids:
+        session.execute(delete(PinIndex).where(PinIndex.kind == kind, PinIndex.ref_id.in_(ref_ids)))
+
+
+def _coordinates_changed(obj):
+    state = inspect(obj)
+    return state.attrs.lat.history.has_changes() or state.attrs.lng.history.has_changes()
+
+
+def pending_changes(session):
+    """Collect the pin changes of the flush in progress as {kind: (added, moved, removed)}.
+
+    ``added`` and ``moved`` hold (ref_id, lat, lng) with the new coordinates, ``removed`` holds ids.
+    Meant to run from an ``after_flush`` hook, where primary keys are assigned but the session
+    still lists what the flush wrote.
+    """
+    changes = {}
+    for kind, model in PIN_MODELS.items():
+        added = [(obj.id, obj.lat, obj.lng) for obj in session.new if isinstance(obj, model)]
+        moved = [(obj.id, obj.lat, obj.lng) for obj in session.dirty
+                 if isinstance(obj, model) and _coordinates_changed(obj)]
+        removed = [obj.id for obj in session.deleted if isinstance(obj, model)]
+        if added or moved or removed:
+            changes[kind] = (added, moved, removed)
+    return changes
+
+
+def indexed_pins(session, kind, ref_ids):
+    """Return the (ref_id, lat, lng) currently indexed for ``ref_ids``."""
+    ref_ids = list(ref_ids)
+    if not ref_ids:
+        return []
+    return session.execute(
+        select(PinIndex.ref_id, PinIndex.lat, PinIndex.lng)
+        .where(PinIndex.kind == kind, PinIndex.ref_id.in_(ref_ids))
+    ).all()
+
+
+def pins_within(session, kind, south, west, north, east, limit=None):
+    """Return the (ref_id, lat, lng) of ``kind`` pins inside the box."""
+    return session.execute(
+        select(PinIndex.ref_id, PinIndex.lat, PinIndex.lng)
+        .where(_box_filter(kind, south, west, north, east)).limit(limit)
+    ).all()
+
+
+def first_pin(session, kind, south, west, north, east):
+    """Return one (ref_id, lat, lng) inside the box, or None."""
+    pins = pins_within(session, kind, south, west, north, east, limit=1)
+    return pins[0] if pins else None
+
+
+def apply_changes(session, changes):
+    for kind, (added, moved, removed) in changes.items():
+        insert_pins(session, kind, added)
+        set_pins(session, kind, moved)
+        remove_pins(session, kind, removed)
+
+
+def rebuild(session, batch_size=5000):
+    """Re-create every index entry from the trips and activities tables."""
+    session.execute(delete(PinIndex))
+    for kind, model in PIN_MODELS.items():
+        query = (select(model.id, model.lat, model.lng)
+                 .where(model.lat.isnot(None), model.lng.isnot(None))
+                 .execution_options(yield_per=batch_size))
+        for partition in session.execute(query).partitions():
+            insert_pins(session, kind, partition)
@@ -1,40 +1,303 @@
+import logging
 import os
 import sqlite3
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from types import SimpleNamespace
 
 from .data_manager_interface import DataManagerInterface
-from .data_models import db, User, Trip, Activity, Photo, TokenBlackList
+from . import (engine_profile, map_clusters, photo_blobs, photo_ingestion, replicas, revisions, revocation,
+               search_index, serializers, spatial_index, storage)
+from .replicas import replica_read
+from .data_models import (db, User, Trip, Activity, Photo, PhotoBlob, PhotoJob, PhotoVariant, TokenBlackList,
+                          PinIndex, MapCluster)
 from pathlib import Path
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import date, datetime, timedelta
 from werkzeug.utils import secure_filename
-from supabase import Client, StorageException
+from sqlalchemy import delete, event, func, insert, inspect, or_, select, text, tuple_
+from utils.access_log import timed
+from utils import timing
+from utils.metrics import instrument
+from utils.pagination import Page, encode_cursor, STREAM_BATCH_SIZE
+from utils.passwords import HashingBusy, PasswordHasher
+
+logger = logging.getLogger(__name__)
 
 # Database configuration
 basedir = Path(__file__).resolve().parent.parent
 database_path = os.path.join(basedir,'database', 'pintrail.db')
 
-
+TRIP_RELATIONS = tuple(serializers.TRIP_EXPANSIONS)
+CHILD_MODELS = {"activities": Activity, "photos": Photo}
+# The row each ETag kind belongs to, looked up when a resource has no revision yet.
+ETAG_MODELS = {"trip": Trip, "activity": Activity, "photo": Photo, "user_trips": User}
+# Trip ids per IN (...) query when embedding relationships.
+EMBED_BATCH_SIZE = 500
+# Trips per transaction in bulk imports.
+BULK_CHUNK_SIZE = 1000
+ACTIVITY_FIELDS = ("name", "location", "type", "notes", "cost", "rating", "lat", "lng")
+# Seconds between picking up other workers' revocations, and between purges of expired ones;
+# a refresh interval of 0 turns both off (the startup purge still runs).
+REVOCATION_REFRESH_SECONDS = 5
+REVOCATION_PURGE_SECONDS = 3600
+# How far back before the newest revocation seen each refresh reads, for rows committed late.
+REVOCATION_REFRESH_OVERLAP_SECONDS = 60
+
+
+def _sync_indexes(session, flush_context):
+    """Keep the derived index tables in step with every flush, whichever code path wrote the rows."""
+    pins = spatial_index.pending_changes(session)
+    if pins:
+        # Clusters subtract the old coordinates, so read them before the pin index is updated.
+        previous = {
+            kind: spatial_index.indexed_pins(session, kind, [ref_id for ref_id, _, _ in moved] + removed)
+            for kind, (added, moved, removed) in pins.items()
+        }
+        spatial_index.apply_changes(session, pins)
+        map_clusters.apply_changes(session, pins, previous)
+    search_index.sync_session(session)
+    photo_blobs.sync_session(session)
+    revisions.sync_session(session)
+
+
+@instrument
 class SQLiteDataManager(DataManagerInterface):
     def __init__(self, app):
         """Initialize the data manager with Flask app and configure the database."""
+        self.app = app
         app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        self.supabase: Client = app.config['supabase']
-        self.bucket_name = app.config['SUPABASE_BUCKET_NAME']
+        if 'SQLALCHEMY_REPLICA_URIS' not in app.config:
+            app.config['SQLALCHEMY_REPLICA_URIS'] = [
+                url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+        self.replicas = replicas.create_replicas(app)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_profile.engine_options(
+            app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+        self.storage = storage.create_storage(app)
+        self.revocations = revocation.RevocationCache(app.config.get("REVOCATION_CACHE_SIZE", 10000))
+        self.revocation_refresh = app.config.get("REVOCATION_REFRESH_SECONDS", REVOCATION_REFRESH_SECONDS)
+        self.revocation_purge = app.config.get("REVOCATION_PURGE_SECONDS", REVOCATION_PURGE_SECONDS)
+        self.revocation_overlap = timedelta(seconds=app.config.get(
+            "REVOCATION_REFRESH_OVERLAP_SECONDS", REVOCATION_REFRESH_OVERLAP_SECONDS))
+        self._revocation_lock = threading.Lock()
+        self._revocation_pid = None
+        self._revocation_stop = None
+        # Rows from before expires_at was recorded are kept as long as any token can live.
+        self.token_lifetime = max(app.config.get("JWT_ACCESS_TOKEN_EXPIRES", timedelta(minutes=15)),
+                                  app.config.get("JWT_REFRESH_TOKEN_EXPIRES", timedelta(days=30)))
+        self.passwords = PasswordHasher(app.config.get("PASSWORD_HASH_METHOD"),
+                                        app.config.get("PASSWORD_HASH_WORKERS"),
+                                        app.config.get("PASSWORD_HASH_QUEUE"))
+        self.photo_batch_parallelism = app.config.get("PHOTO_BATCH_PARALLELISM", 8)
+        self.photo_ingestion = photo_ingestion.PhotoIngestion(
+            app, self._storage_upload,
+            workers=app.config.get("PHOTO_INGEST_WORKERS", 2),
+            max_attempts=app.config.get("PHOTO_INGEST_ATTEMPTS", 5),
+            backoff=app.config.get("PHOTO_INGEST_BACKOFF", 1.0))
         db.init_app(app)
 
+        if not event.contains(db.session, "after_flush", _sync_indexes):
+            event.listen(db.session, "after_flush", _sync_indexes)
+
         with app.app_context():
+            engine_profile.apply(db.engine, app.config)
             db.create_all()
+            self._upgrade_schema()
+            self.purge_revoked_tokens()
+            self.photo_ingestion.recover()
+            if PinIndex.query.first() is None and Trip.query.filter(Trip.lat.isnot(None)).first() is not None:
+                self.rebuild_pin_index()
+            elif MapCluster.query.first() is None and PinIndex.query.first() is not None:
+                self.rebuild_map_clusters()
+            if search_index.is_empty(db.session) and Trip.query.first() is not None:
+                self.rebuild_search_index()
+
+    def _upgrade_schema(self):
+        """Add the nullable columns and the indexes introduced since the database was created."""
+        inspector = inspect(db.engine)
+        preparer = db.engine.dialect.identifier_preparer
+        with db.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing and column.nullable and column.server_default is None:
+                        conn.execute(text(
+                            f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                            f"{preparer.format_column(column)} {column.type.compile(db.engine.dialect)}"))
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+    def _trip_rows(self, fields=None):
+        """Select the trip columns named by ``fields`` (all by default) as plain rows."""
+        return db.session.query(*serializers.columns(Trip, "trip", fields))
+
+    def _trip_dicts(self, rows, fields=None, expand=TRIP_RELATIONS):
+        """Serialize trip rows and embed the ``expand``ed relationships, one query per relationship."""
+        serialize = serializers.row_serializer("trip", fields)
+        items = [serialize(row) for row in rows]
+        for name in expand:
+            model = CHILD_MODELS[name]
+            children = []
+            for start in range(0, len(items), EMBED_BATCH_SIZE):
+                ids = [item["id"] for item in items[start:start + EMBED_BATCH_SIZE]]
+                children += db.session.execute(
+                    select(*serializers.columns(model, serializers.TRIP_EXPANSIONS[name]))
+                    .where(model.trip_id.in_(ids)).order_by(model.id)
+                ).all()
+            serializers.embed(items, name, children)
+        return items
+
+    def _paginate(self, query, columns, limit=None, after=None):
+        """Keyset pagination: order by ``columns`` and return the rows that sort after ``after``.
+
+        ``query`` selects plain columns; the returned rows hold just those. The last keyset
+        column must be unique so every row has a distinct position. With no ``limit`` the
+        whole result is returned as a single page.
+        """
+        width = len(query.column_descriptions)
+        if after is not None:
+            if len(after) != len(columns):
+                raise ValueError("Invalid cursor")
+            query = query.filter(tuple_(*columns) > tuple_(*after))
+        query = query.add_columns(*columns).order_by(*columns)
+        if limit is None:
+            return Page(row[:width] for row in query.all())
+        rows = query.limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1][width:]) if len(rows) > limit else None
+        return Page((row[:width] for row in rows[:limit]), next_cursor)
+
+    def _iter_query(self, query, order_by, batch_size=STREAM_BATCH_SIZE):
+        """Iterate a query through a server-side cursor, ``batch_size`` rows at a time."""
+        return query.order_by(order_by).yield_per(batch_size)
+
+    def _page_dicts(self, model, kind, limit=None, after=None):
+        """A keyset page of ``model`` rows serialized straight from their columns."""
+        columns = serializers.columns(model, kind)
+        rows = self._paginate(db.session.query(*columns), (model.id,), limit, after)
+        serialize = serializers.row_serializer(kind)
+        return Page((serialize(row) for row in rows), rows.next_cursor)
+
+    def _iter_dicts(self, model, kind, batch_size=STREAM_BATCH_SIZE):
+        serialize = serializers.row_serializer(kind)
+        for row in self._iter_query(db.session.query(*serializers.columns(model, kind)), model.id, batch_size):
+            yield serialize(row)
+
+    def _trip_keyset(self, sort, after):
+        if sort == "start_date":
+            if after is not None:
+                try:
+                    after = [date.fromisoformat(after[0]), *after[1:]]
+                except (TypeError, ValueError, IndexError):
+                    raise ValueError("Invalid cursor")
+            return (func.coalesce(Trip.start_date, date.min), Trip.id), after
+        if sort != "id":
+            raise ValueError("sort must be 'id' or 'start_date'")
+        return (Trip.id,), after
+
+    @replica_read
+    def get_trips(self, limit=None, after=None, sort="id", fields=None, expand=TRIP_RELATIONS):
+        """A page of trip dicts with only ``fields`` (the id is always included) and the ``expand``ed relationships."""
+        columns, after = self._trip_keyset(sort, after)
+        rows = self._paginate(self._trip_rows(fields), columns, limit, after)
+        return Page(self._trip_dicts(rows, fields, expand), rows.next_cursor)
+
+    def iter_trips(self, fields=None, expand=TRIP_RELATIONS, batch_size=STREAM_BATCH_SIZE):
+        rows = db.session.execute(self._trip_rows(fields).order_by(Trip.id).statement
+                                  .execution_options(yield_per=batch_size))
+        for partition in rows.partitions():
+            yield from self._trip_dicts(partition, fields, expand)
+
+    @replica_read
+    def get_trips_within(self, south, west, north, east, fields=None, expand=TRIP_RELATIONS):
+        """Trips whose pin lies inside the box; west > east wraps across the antimeridian."""
+        ids = spatial_index.within_ids("trip", south, west, north, east)
+        rows = self._trip_rows(fields).filter(Trip.id.in_(ids)).order_by(Trip.id).all()
+        return self._trip_dicts(rows, fields, expand)
+
+    @replica_read
+    def get_activities_nearby(self, lat, lng, radius_km, limit=None):
+        """Activities within ``radius_km`` of a point, nearest first, each with its ``distance_km``."""
+        hits = spatial_index.nearby(db.session, "activity", lat, lng, radius_km)[:limit]
+        activities = {a.id: a for a in Activity.query.filter(Activity.id.in_([ref_id for ref_id, _ in hits]))}
+        return [
+            {**activities[ref_id].to_dict(), "distance_km": round(distance, 3)}
+            for ref_id, distance in hits if ref_id in activities
+        ]
+
+    @replica_read
+    def get_map_clusters(self, zoom, south, west, north, east, kind="trip"):
+        return map_clusters.clusters_in_box(db.session, kind, zoom, south, west, north, east)
+
+    def rebuild_pin_index(self):
+        spatial_index.rebuild(db.session)
+        map_clusters.rebuild(db.session)
+        db.session.commit()
 
-    def get_trips(self):
-        return Trip.query.all()
+    def rebuild_map_clusters(self):
+        map_clusters.rebuild(db.session)
+        db.session.commit()
 
+    @replica_read
+    def search(self, query, limit=20, offset=0, kind=None):
+        """Ranked trips and activities matching every word of ``query`` (as a prefix)."""
+        hits = search_index.search(db.session, query, limit=limit, offset=offset, kind=kind)
+        trip_ids = [ref_id for hit_kind, ref_id, _ in hits if hit_kind == "trip"]
+        activity_ids = [ref_id for hit_kind, ref_id, _ in hits if hit_kind == "activity"]
+        found = {("trip", t.id): t for t in Trip.query.filter(Trip.id.in_(trip_ids))} if trip_ids else {}
+        if activity_ids:
+            found.update((("activity", a.id), a) for a in Activity.query.filter(Activity.id.in_(activity_ids)))
+        results = []
+        for hit_kind, ref_id, score in hits:
+            obj = found.get((hit_kind, ref_id))
+            if obj is None:
+                continue
+            if hit_kind == "trip":
+                item = {"title": obj.title, "city": obj.city, "country": obj.country,
+                        "start_date": obj.start_date.isoformat() if obj.start_date else None,
+                        "end_date": obj.end_date.isoformat() if obj.end_date else None,
+                        "user_id": obj.user_id}
+            else:
+                item = {"title": obj.name, "type": obj.type, "location": obj.location, "trip_id": obj.trip_id}
+            results.append({"kind": hit_kind, "id": ref_id, "score": round(score, 4),
+                            "lat": obj.lat, "lng": obj.lng, **item})
+        return results
+
+    def rebuild_search_index(self):
+        search_index.rebuild(db.session)
+        db.session.commit()
+
+    @replica_read
+    def get_etag(self, kind, ref_id):
+        """Strong ETag of a resource ('trip', 'activity', 'photo' or 'user_trips'), read without loading it.
+
+        Read from the same database as the body it tags: a replica read after it can only be newer,
+        so a lagging replica never serves old rows under a current ETag. None when the resource has
+        no revision and does not exist, so a guessed "-r0" tag cannot earn a 304 for a missing id.
+        """
+        revision = revisions.current(db.session, kind, ref_id)
+        if revision == 0:
+            model = ETAG_MODELS[kind]
+            if db.session.execute(select(model.id).where(model.id == ref_id)).first() is None:
+                return None
+        return revisions.etag(kind, ref_id, revision)
+
+    def _get_for_write(self, model, ident):
+        """``model`` by id for a change: refreshed from the primary when this request has used a replica,
+        since the identity map would otherwise hand back the replica's copy."""
+        return db.session.get(model, ident, populate_existing=replicas.read_from_replica())
+
+    @replica_read
     def get_trip_by_id(self, trip_id):
-        trip = Trip.query.get(trip_id)
-        if trip:
-            return trip
-        return None
+        return db.session.get(Trip, trip_id)
+
+    @replica_read
+    def get_trip_dict(self, trip_id, fields=None, expand=TRIP_RELATIONS):
+        """The serialized trip, or None; loads nothing beyond ``fields`` and the ``expand``ed relationships."""
+        rows = self._trip_rows(fields).filter(Trip.id == trip_id).all()
+        return self._trip_dicts(rows, fields, expand)[0] if rows else None
 
     def add_trip(self, data):
         try:
@@ -64,6 +327,8 @@ class SQLiteDataManager(DataManagerInterface):
                     notes=activity_data.get("notes"),
                     cost=activity_data.get("cost"),
                     rating=activity_data.get("rating"),
+                    lat=activity_data.get("lat"),
+                    lng=activity_data.get("lng"),
                     trip_id=new_trip.id
                 )
                 db.session.add(activity)
@@ -75,8 +340,83 @@ class SQLiteDataManager(DataManagerInterface):
             db.session.rollback()
             raise e
 
+    def add_trips_bulk(self, items, chunk_size=BULK_CHUNK_SIZE):
+        """Insert validated (index, trip columns, [activity columns]) items, one transaction per chunk.
+
+        Rows are written with multi-row INSERT ... RETURNING instead of ORM objects, so the pin,
+        cluster, search and revision tables are updated here rather than by the flush hook.
+        Returns (created, errors): [(index, trip_id)] and [(index, message)].
+        """
+        created, errors = [], []
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return created, errors
+            user_ids = {trip["user_id"] for _, trip, _ in chunk}
+            known = set(db.session.scalars(select(User.id).where(User.id.in_(user_ids))))
+            valid = []
+            for item in chunk:
+                if item[1]["user_id"] in known:
+                    valid.append(item)
+                else:
+                    errors.append((item[0], f"User {item[1]['user_id']} not found"))
+            if not valid:
+                continue
+            try:
+                trip_ids = self._insert_trip_chunk(valid)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Bulk insert of %d trips failed; inserting them one by one", len(valid))
+                self._insert_trips_singly(valid, created, errors)
+                continue
+            created += [(index, trip_id) for (index, _, _), trip_id in zip(valid, trip_ids)]
+
+    def _insert_trips_singly(self, items, created, errors):
+        """Insert ``items`` in a transaction each, so a row the database rejects fails on its own."""
+        for item in items:
+            try:
+                trip_ids = self._insert_trip_chunk([item])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Bulk import item %d could not be inserted", item[0])
+                errors.append((item[0], "Trip could not be saved"))
+                continue
+            created.append((item[0], trip_ids[0]))
+
+    def _insert_returning_ids(self, table, rows):
+        """Insert ``rows`` with multi-row INSERTs and return their new ids in the order of ``rows``."""
+        if db.session.get_bind().dialect.name == "sqlite":
+            # SQLite cannot order RETURNING, and asking for it falls back to one INSERT per row.
+            # Rows of an INSERT get ascending rowids in VALUES order, so sorting restores it.
+            return sorted(db.session.scalars(insert(table).returning(table.c.id), rows))
+        return db.session.scalars(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).all()
+
+    def _insert_trip_chunk(self, items):
+        trip_ids = self._insert_returning_ids(Trip.__table__, [trip for _, trip, _ in items])
+        trips = [SimpleNamespace(id=trip_id, **trip) for (_, trip, _), trip_id in zip(items, trip_ids)]
+        activity_rows = [{**activity, "trip_id": trip_id}
+                         for (_, _, activities), trip_id in zip(items, trip_ids) for activity in activities]
+        activities = []
+        if activity_rows:
+            activity_ids = self._insert_returning_ids(Activity.__table__, activity_rows)
+            activities = [SimpleNamespace(id=activity_id, **row) for row, activity_id in zip(activity_rows, activity_ids)]
+
+        for kind, rows in (("trip", trips), ("activity", activities)):
+            pins = [(row.id, row.lat, row.lng) for row in rows if row.lat is not None and row.lng is not None]
+            spatial_index.insert_pins(db.session, kind, pins)
+            map_clusters.apply_pin_changes(db.session, kind, pins, [])
+        search_index.index_documents(
+            db.session, [search_index.trip_document(trip) for trip in trips]
+            + [search_index.activity_document(activity) for activity in activities], replace=False)
+        revisions.bump(db.session, {("trip", trip.id) for trip in trips}
+                       | {("user_trips", trip.user_id) for trip in trips})
+        return trip_ids
+
     def update_trip(self, trip_id, data):
-        trip = Trip.query.get(trip_id)
+        trip = self._get_for_write(Trip, trip_id)
         if not trip:
             return None
 
@@ -85,44 +425,80 @@ class SQLiteDataManager(DataManagerInterface):
                 setattr(trip, field, data[field])
 
         if 'activities' in data:
-            trip.activities.clear()
-            for activity_data in data['activities']:
-                activity = Activity(**activity_data)
-                trip.activities.append(activity)
+            self._reconcile_activities(trip, data['activities'])
 
         db.session.commit()
         return trip
 
+    def _reconcile_activities(self, trip, activities_data):
+        """Make the trip's activities match ``activities_data``, matching existing ones by id.
+
+        Known ids are updated in place (only the fields that differ), entries without a known
+        id are added, and activities missing from the list are deleted; the flush then emits
+        just those statements. Dropped activities are deleted explicitly rather than left to the
+        delete-orphan cascade, which only runs inside the flush, after ``_sync_indexes`` has
+        looked at ``session.deleted``.
+        """
+        existing = {activity.id: activity for activity in trip.activities}
+        kept = set()
+        for activity_data in activities_data:
+            activity = existing.get(activity_data.get("id"))
+            values = {field: activity_data[field] for field in ACTIVITY_FIELDS if field in activity_data}
+            if activity is None:
+                trip.activities.append(Activity(**values))
+                continue
+            kept.add(activity.id)
+            for field, value in values.items():
+                if getattr(activity, field) != value:
+                    setattr(activity, field, value)
+        for activity_id, activity in existing.items():
+            if activity_id not in kept:
+                trip.activities.remove(activity)
+                db.session.delete(activity)
+
     def delete_trip(self, trip_id):
-        trip = Trip.query.get(trip_id)
+        trip = self._get_for_write(Trip, trip_id)
         if not trip:
             return False
+        # photo_jobs cascades on delete in the schema, but SQLite leaves foreign keys unenforced.
+        jobs = PhotoJob.query.filter_by(trip_id=trip_id).all()
+        for job in jobs:
+            db.session.delete(job)
         db.session.delete(trip)
         db.session.commit()
+        self.photo_ingestion.discard(jobs)
+        self.collect_photo_blobs()
         return True
 
-    def get_trips_by_user(self, user_id):
-        return Trip.query.filter_by(user_id=user_id).all()
+    @replica_read
+    def get_trips_by_user(self, user_id, fields=None, expand=TRIP_RELATIONS):
+        rows = self._trip_rows(fields).filter(Trip.user_id == user_id).order_by(Trip.id).all()
+        return self._trip_dicts(rows, fields, expand)
 
     # Create a new user
     def add_user(self, username, email, password):
-        hashed_password = generate_password_hash(password)
+        hashed_password = self.passwords.hash(password)
         new_user = User(username=username, email=email, password_hash=hashed_password)
         db.session.add(new_user)
         db.session.commit()
         return new_user
 
     # Get all users
-    def get_all_users(self):
-        return User.query.all()
+    @replica_read
+    def get_all_users(self, limit=None, after=None):
+        return self._page_dicts(User, "user", limit, after)
+
+    def iter_users(self, batch_size=STREAM_BATCH_SIZE):
+        return self._iter_dicts(User, "user", batch_size)
 
     # Get a user by ID
+    @replica_read
     def get_user_by_id(self, user_id):
         return User.query.get(user_id)
 
     # Update a user
     def update_user(self, user_id, updated_data):
-        user = User.query.get(user_id)
+        user = self._get_for_write(User, user_id)
         if not user:
             return None
         for key, value in updated_data.items():
@@ -132,18 +508,29 @@ class SQLiteDataManager(DataManagerInterface):
 
     # Delete a user
     def delete_user(self, user_id):
-        user = User.query.get(user_id)
+        user = self._get_for_write(User, user_id)
         if not user:
             return False
         db.session.delete(user)
         db.session.commit()
+        self.collect_photo_blobs()
         return True
 
+    @replica_read
     def get_user_by_email(self, email):
         return User.query.filter_by(email=email).first()
 
     def verify_password(self, user, input_password):
-        return check_password_hash(user.password_hash, input_password)
+        """Check a password, rehashing it when the configured hash parameters have changed."""
+        if not self.passwords.verify(user.password_hash, input_password):
+            return False
+        if self.passwords.needs_rehash(user.password_hash):
+            try:
+                user.password_hash = self.passwords.hash(input_password)
+            except HashingBusy:
+                return True  # the password was right; rehash on a quieter login
+            db.session.commit()
+        return True
 
 
     def add_activity(self, data):
@@ -162,14 +549,20 @@ class SQLiteDataManager(DataManagerInterface):
         db.session.commit()
         return new_activity
 
-    def get_activities(self):
+    @replica_read
+    def get_activities(self, limit=None, after=None):
         try:
-            activities = Activity.query.all()
-            return [activity.to_dict() for activity in activities]
+            return self._page_dicts(Activity, "activity", limit, after)
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error fetching activities: {e}")
             return []
 
+    def iter_activities(self, batch_size=STREAM_BATCH_SIZE):
+        return self._iter_dicts(Activity, "activity", batch_size)
+
+    @replica_read
     def get_activities_by_trip_id(self, trip_id):
         try:
             activities = Activity.query.filter_by(trip_id=trip_id).all()
@@ -182,7 +575,7 @@ class SQLiteDataManager(DataManagerInterface):
         return Activity.query.get(activity_id)
 
     def update_activity(self, activity_id, updates):
-        activity = Activity.query.get(activity_id)
+        activity = self._get_for_write(Activity, activity_id)
         if not activity:
             return None
         for key, value in updates.items():
@@ -191,30 +584,166 @@ class SQLiteDataManager(DataManagerInterface):
         return activity
 
     def delete_activity(self, activity_id):
-        activity = Activity.query.get(activity_id)
+        activity = self._get_for_write(Activity, activity_id)
         if not activity:
             return False
         db.session.delete(activity)
         db.session.commit()
         return True
 
-    def get_trips_by_user_id(self, user_id):
-        return db.session.query(Trip).filter_by(user_id=user_id).all()
+    def get_trips_by_user_id(self, user_id, fields=None, expand=TRIP_RELATIONS):
+        return self.get_trips_by_user(user_id, fields, expand)
 
     def save_changes(self):
         db.session.commit()
 
-    def get_photos(self):
+    @replica_read
+    def get_photos(self, limit=None, after=None):
         try:
-            photos = Photo.query.all()
-            return [photo.to_dict() for photo in photos]
+            return self._page_dicts(Photo, "photo", limit, after)
+        except ValueError:
+            raise
         except Exception as e:
             print(f"Error fetching photos: {e}")
             return []
 
+    def iter_photos(self, batch_size=STREAM_BATCH_SIZE):
+        return self._iter_dicts(Photo, "photo", batch_size)
+
+    def add_photos_batch(self, trip_id, files, captions=(), retry_collected=True):
+        """Store many spooled ``files`` for a trip: uploads in parallel, every row in one transaction.
+
+        Files whose ``stream.error`` is set are reported, not stored; content stored before, or
+        twice in the batch, is uploaded once. Returns (created [(index, photo dict)],
+        errors [(index, message)]).
+        """
+        errors, by_hash = [], {}
+        for index, file in enumerate(files):
+            if file.stream.error is not None:
+                errors.append((index, file.stream.error.description))
+            else:
+                by_hash.setdefault(file.stream.content_hash, []).append(index)
+        known = {blob.content_hash: blob.url
+                 for blob in PhotoBlob.query.filter(PhotoBlob.content_hash.in_(list(by_hash)))}
+        uploads = {}
+        new = [content_hash for content_hash in by_hash if content_hash not in known]
+        if new:
+            with timed("storage"), ThreadPoolExecutor(min(self.photo_batch_parallelism, len(new))) as pool:
+                futures = {content_hash: pool.submit(self._upload_spool, files[by_hash[content_hash][0]])
+                           for content_hash in new}
+            for content_hash, future in futures.items():
+                try:
+                    uploads[content_hash] = future.result()
+                except Exception as e:
+                    errors.extend((index, f"Upload failed: {e}") for index in by_hash.pop(content_hash))
+
+        variants = {}
+        for variant in PhotoVariant.query.filter(PhotoVariant.content_hash.in_(list(known))):
+            variants.setdefault(variant.content_hash, {})[variant.name] = variant.url
+        try:
+            for content_hash, (path, url) in uploads.items():
+                file = files[by_hash[content_hash][0]]
+                db.session.add(PhotoBlob(content_hash=content_hash, path=path, url=url,
+                                         content_type=file.mimetype, size=file.stream.size))
+            created = []
+            for content_hash, indexes in by_hash.items():
+                url = known[content_hash] if content_hash in known else uploads[content_hash][1]
+                for index in indexes:
+                    photo = Photo(trip_id=trip_id, url=url, content_hash=content_hash,
+                                  caption=captions[index] if index < len(captions) else "",
+                                  variants=variants.get(content_hash))
+                    db.session.add(photo)
+                    created.append((index, photo))
+            db.session.commit()
+        except photo_blobs.BlobGone:
+            db.session.rollback()
+            if not retry_collected:
+                self._remove_uploads(uploads)
+                raise
+            # A blob found above was collected before the commit; looking again uploads it anew.
+            return self.add_photos_batch(trip_id, files, captions, retry_collected=False)
+        except Exception:
+            db.session.rollback()
+            self._remove_uploads(uploads)
+            raise
+        for content_hash in uploads:
+            self.photo_ingestion.submit_variants(content_hash, files[by_hash[content_hash][0]].stream.keep())
+        return sorted((index, photo.to_dict()) for index, photo in created), sorted(errors)
+
+    def _remove_uploads(self, uploads):
+        """Remove the files of a batch whose rows were rolled back, unless a blob row has linked them since."""
+        try:
+            linked = {content_hash for (content_hash,) in db.session.query(PhotoBlob.content_hash)
+                      .filter(PhotoBlob.content_hash.in_(list(uploads)))}
+            paths = [path for content_hash, (path, _) in uploads.items() if content_hash not in linked]
+            if paths:
+                self._storage_call("remove", self.storage.remove, paths)
+        except Exception:
+            logger.exception("Could not remove the uploads of a failed batch")
+
+    def _upload_spool(self, file):
+        """Upload a spooled file to its content-addressed path; returns (path, url)."""
+        path = photo_blobs.storage_path(file.stream.content_hash, file.mimetype)
+        with open(file.stream.name, "rb") as body:
+            return path, self._storage_upload(path, body, file.mimetype)
+
+    def _storage_upload(self, path, body, content_type):
+        return self._storage_call("upload", self.storage.upload, path, body, content_type)
+
+    def _storage_call(self, operation, fn, *args):
+        """Call the storage backend, timed for the access log and metrics."""
+        return timing.storage_call(self.storage.name, operation, fn, *args)
+
+    def enqueue_photo(self, trip_id, file, caption=""):
+        """Record an upload job for a spooled ``file`` and hand it to the ingestion workers."""
+        job = PhotoJob(id=str(uuid.uuid4()), trip_id=trip_id, filename=secure_filename(file.filename),
+                       content_type=file.mimetype, content_hash=file.stream.content_hash, caption=caption,
+                       spool_path=file.stream.keep())
+        db.session.add(job)
+        db.session.commit()
+        self.photo_ingestion.submit(job.id)
+        return job
+
+    def get_photo_job(self, job_id):
+        return db.session.get(PhotoJob, job_id)
+
+    def update_photo(self, photo_id, data):
+        photo = self._get_for_write(Photo, photo_id)
+        if not photo:
+            return None
+        if "caption" in data:
+            photo.caption = data["caption"]
+        if "url" in data and data["url"] != photo.url:
+            # Pointing elsewhere releases the stored file and its variants.
+            photo.url, photo.content_hash, photo.variants = data["url"], None, None
+        db.session.commit()
+        self.collect_photo_blobs()
+        return photo
+
+    def delete_photo(self, photo_id):
+        photo = self._get_for_write(Photo, photo_id)
+        if not photo:
+            return False
+        db.session.delete(photo)
+        db.session.commit()
+        self.collect_photo_blobs()
+        return True
+
+    def collect_photo_blobs(self):
+        """Remove the stored files that no photo references any more."""
+        paths = photo_blobs.collect_orphans(db.session)
+        db.session.commit()
+        if paths:
+            try:
+                self._storage_call("remove", self.storage.remove, paths)
+            except Exception:
+                logger.exception("Could not remove photo files %s", paths)
+        return paths
+
     def get_photo_by_id(self, photo_id):
         return Photo.query.get(photo_id)
 
+    @replica_read
     def get_photos_by_trip_id(self, trip_id):
         try:
             photos = Photo.query.filter_by(trip_id=trip_id).all()
@@ -223,42 +752,92 @@ class SQLiteDataManager(DataManagerInterface):
             print(f"Error fetching photos for trip {trip_id}: {e}")
             return []
 
+    @replica_read
     def is_token_blacklisted(self, jti):
-        return TokenBlackList.query.filter_by(jti=jti).first() is not None
+        """Check a jti against the revocation cache; the table is read only on a bloom filter hit."""
+        self.start_revocation_refresh()
+        return self.revocations.is_revoked(
+            jti, lambda key: db.session.query(TokenBlackList.id).filter_by(jti=key).first() is not None)
 
-    def blacklist_token(self, jti):
-        token = TokenBlackList(jti=jti)
+    def blacklist_token(self, jti, expires_at=None):
+        token = TokenBlackList(jti=jti, expires_at=expires_at)
         db.session.add(token)
         db.session.commit()
+        if not self.revocations.add([(None, jti)]):
+            self._warm_revocations()
+
+    def _warm_revocations(self):
+        """Reload the revocation cache from every row in the blacklist."""
+        self.revocations.reset(db.session.execute(select(TokenBlackList.created_at, TokenBlackList.jti)))
+
+    def _refresh_revocations(self):
+        """Add the rows other workers blacklisted since the last refresh, re-reading an overlap window."""
+        query = select(TokenBlackList.created_at, TokenBlackList.jti)
+        if self.revocations.watermark is not None:
+            query = query.where(TokenBlackList.created_at >= self.revocations.watermark - self.revocation_overlap)
+        rows = db.session.execute(query).all()
+        if rows and not self.revocations.add(rows):
+            self._warm_revocations()
+
+    def start_revocation_refresh(self):
+        """Start the timer thread that refreshes and purges the revocations, once per process."""
+        with self._revocation_lock:
+            if self._revocation_pid == os.getpid() or not self.revocation_refresh:
+                return
+            self._revocation_pid = os.getpid()
+            self._revocation_stop = threading.Event()
+        threading.Thread(target=self._refresh_revocations_periodically, args=(self._revocation_stop,),
+                         name="revocation-refresh", daemon=True).start()
+
+    def stop_revocation_refresh(self):
+        with self._revocation_lock:
+            if self._revocation_stop is not None:
+                self._revocation_stop.set()
+            self._revocation_pid = self._revocation_stop = None
+
+    def _refresh_revocations_periodically(self, stop):
+        purge_due = time.monotonic() + self.revocation_purge
+        while not stop.wait(self.revocation_refresh):
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= purge_due:
+                        purge_due = time.monotonic() + self.revocation_purge
+                        self.purge_revoked_tokens()
+                    else:
+                        self._refresh_revocations()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Could not refresh the token blacklist")
+
+    def purge_revoked_tokens(self, now=None):
+        """Delete blacklist rows whose tokens have expired, then rebuild the cache from the rest.
+
+        Expired tokens are rejected before the blacklist is consulted, so their rows serve no purpose.
+        """
+        now = now or datetime.utcnow()
+        result = db.session.execute(delete(TokenBlackList).where(or_(
+            TokenBlackList.expires_at < now,
+            TokenBlackList.expires_at.is_(None) & (TokenBlackList.created_at < now - self.token_lifetime),
+        )))
+        db.session.commit()
+        self._warm_revocations()
+        return result.rowcount
 
     def add_photo(self, photo_data):
-        """Add a photo to supabase storage and store the metadata in the db"""
-        try:
-            file = photo_data.get("file")
-            trip_id = photo_data["trip_id"]
-            caption = photo_data.get("caption", "")
-            filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-            file_path = f"photos/{trip_id}/{filename}"
+        """Record a photo hosted at ``photo_data["url"]``; nothing is stored, so no blob is referenced.
 
-            file_content = file.read()
-            # Upload file
-            self.supabase.storage.from_(self.bucket_name).upload(file_path, file_content, file_options={"content-type": file.mimetype})
-
-            # Get url
-            url = self.supabase.storage.from_(self.bucket_name).get_public_url(file_path)
-
-            # Store the metadata in sQLite
+        Uploaded files go through ``enqueue_photo`` or ``add_photos_batch``, which store them
+        once per content hash.
+        """
+        try:
             new_photo = Photo(
-                trip_id=trip_id,
-                url=url,
-                caption=caption
+                trip_id=photo_data["trip_id"],
+                url=photo_data["url"],
+                caption=photo_data.get("caption", "")
             )
             db.session.add(new_photo)
             db.session.commit()
             return new_photo
-        except StorageException as e:
-            db.session.rollback()
-            raise e
         except Exception as e:
             db.session.rollback()
             raise e
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""Where photo files live.
+
+``SupabaseStorage`` keeps them in a Supabase bucket; ``LocalStorage`` keeps them under a
+directory this app serves itself at ``/uploads``, for self-hosting and for running the tests
+and benchmarks without a network. Both take streams, so uploads never have to be read whole.
+"""
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+
+# Paths under these prefixes are named by content hash, so their bytes can never change.
+IMMUTABLE_PREFIXES = ("photos/blobs/", "variants/")
+
+
+def is_immutable(path):
+    return path.startswith(IMMUTABLE_PREFIXES)
+
+
+class StorageBackend(ABC):
+    name = "custom"
+
+    @abstractmethod
+    def upload(self, path, body, content_type):
+        """Store ``body`` (bytes or a binary file) at ``path``, replacing any object there; returns its URL."""
+        pass
+
+    @abstractmethod
+    def remove(self, paths):
+        pass
+
+
+class SupabaseStorage(StorageBackend):
+    name = "supabase"
+
+    def __init__(self, client, bucket_name):
+        self.client = client
+        self.bucket_name = bucket_name
+
+    def upload(self, path, body, content_type):
+        bucket = self.client.storage.from_(self.bucket_name)
+        options = {"content-type": content_type, "upsert": "true"}
+        if is_immutable(path):
+            options["cache-control"] = "31536000"
+        bucket.upload(path, body, file_options=options)
+        return bucket.get_public_url(path)
+
+    def remove(self, paths):
+        self.client.storage.from_(self.bucket_name).remove(list(paths))
+
+
+class LocalStorage(StorageBackend):
+    """Files under ``root``, published at ``base_url``; writes are atomic renames."""
+
+    name = "local"
+
+    def __init__(self, root, base_url="/uploads"):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, path):
+        full = os.path.abspath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise ValueError(f"Path escapes the storage root: {path}")
+        return full
+
+    def upload(self, path, body, content_type):
+        target = self.local_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if isinstance(body, (bytes, bytearray, memoryview)):
+                    out.write(body)
+                else:
+                    shutil.copyfileobj(body, out, 1024 * 1024)
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, target)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        return f"{self.base_url}/{path}"
+
+    def remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(self.local_path(path))
+            except FileNotFoundError:
+                pass
+
+
+def create_storage(app):
+    """The backend named by ``STORAGE_BACKEND``: "supabase" (the default when a client is set) or "local"."""
+    backend = app.config.get("STORAGE_BACKEND") or ("supabase" if app.config.get("supabase") else "local")
+    if backend == "supabase":
+        return SupabaseStorage(app.config["supabase"], app.config["SUPABASE_BUCKET_NAME"])
+    if backend == "local":
+        root = app.config.get("STORAGE_ROOT") or os.path.join(app.root_path, "uploads")
+        return LocalStorage(root, app.config.get("STORAGE_BASE_URL", "/uploads"))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
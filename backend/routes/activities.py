@@ -1,4 +1,7 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from utils.pagination import parse_limit, parse_page_args, page_headers, stream_json_array, wants_stream
+from utils.conditional import is_fresh, not_modified, tag_response
+from utils.validates import parse_point
 
 
 activities_bp = Blueprint('activities', __name__, url_prefix='/activities')
@@ -11,16 +14,80 @@ def get_activities():
     ---
     tags:
       - Activities
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size; the cursor of the next page is returned in the X-Next-Cursor header
+      - name: cursor
+        in: query
+        type: string
+        description: Value of X-Next-Cursor from the previous page
+      - name: stream
+        in: query
+        type: boolean
+        description: Stream every activity as a chunked JSON array
     responses:
       200:
         description: A list of activities
+      400:
+        description: Invalid pagination parameters
       500:
         description: Server error
     """
     try:
         db = current_app.config["db_manager"]
-        activities = db.get_activities()
+        if wants_stream(request.args):
+            return Response(stream_with_context(stream_json_array(db.iter_activities())),
+                            mimetype="application/json")
+        limit, after = parse_page_args(request.args)
+        activities = db.get_activities(limit=limit, after=after)
+        return jsonify(activities), 200, page_headers(activities)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@activities_bp.route("/nearby", methods=["GET"])
+def get_activities_nearby():
+    """
+    Get the activities within a radius of a point, nearest first
+    ---
+    tags:
+      - Activities
+    parameters:
+      - name: lat
+        in: query
+        type: number
+        required: true
+      - name: lng
+        in: query
+        type: number
+        required: true
+      - name: radius
+        in: query
+        type: number
+        description: Search radius in km (default 5, max 500)
+      - name: limit
+        in: query
+        type: integer
+        description: Nearest activities to return (1-1000, default all)
+    responses:
+      200:
+        description: A list of activities, each with a distance_km field
+      400:
+        description: Invalid coordinates, radius or limit
+      500:
+        description: Server error
+    """
+    try:
+        lat, lng, radius = parse_point(request.args)
+        limit = parse_limit(request.args)
+        db = current_app.config["db_manager"]
+        activities = db.get_activities_nearby(lat, lng, radius, limit=limit)
         return jsonify(activities), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -36,16 +103,25 @@ def get_activity(activity_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
     responses:
       200:
-        description: Activity found
+        description: Activity found, with its ETag
+      304:
+        description: The activity has not changed since the given ETag
       404:
         description: Activity not found
     """
     db = current_app.config["db_manager"]
+    etag = db.get_etag("activity", activity_id)
+    if is_fresh(etag):
+        return not_modified(etag)
     activity = db.get_activity_by_id(activity_id)
     if activity:
-        return jsonify(activity.to_dict()), 200
+        return tag_response(jsonify(activity.to_dict()), etag), 200
     return jsonify({"error": "Activity not found"}), 404
 
 @activities_bp.route('/trip/<int:trip_id>', methods=['GET'])
@@ -60,16 +136,25 @@ def get_activities_by_trip_id(trip_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
     responses:
       200:
-        description: A list of activities for the trip
+        description: A list of activities for the trip, with its ETag
+      304:
+        description: Nothing in the trip changed since the given ETag
       500:
         description: Server error
     """
     try:
         db = current_app.config["db_manager"]
+        etag = db.get_etag("trip", trip_id)
+        if is_fresh(etag):
+            return not_modified(etag)
         activities = db.get_activities_by_trip_id(trip_id)
-        return jsonify(activities), 200
+        return tag_response(jsonify(activities), etag), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -0,0 +1,56 @@
+from flask import Blueprint, request, jsonify, current_app
+from datamanager.map_clusters import MAX_ZOOM
+from utils.validates import parse_bbox
+
+map_bp = Blueprint('map', __name__, url_prefix='/map')
+
+PIN_KINDS = ("trip", "activity")
+
+
+@map_bp.route("/clusters", methods=["GET"])
+def get_clusters():
+    """
+    Get the clustered trip or activity pins of a map viewport
+    ---
+    tags:
+      - Map
+    parameters:
+      - name: zoom
+        in: query
+        type: integer
+        required: true
+        description: Map zoom level (0-20); above 12 every pin is returned individually
+      - name: bbox
+        in: query
+        type: string
+        required: true
+        description: west,south,east,north in degrees; west > east crosses the antimeridian
+      - name: kind
+        in: query
+        type: string
+        enum: [trip, activity]
+        default: trip
+    responses:
+      200:
+        description: Clusters with their pin count, centroid and a representative pin
+      400:
+        description: Invalid zoom, bbox or kind
+      500:
+        description: Server error
+    """
+    try:
+        zoom = request.args.get("zoom", type=int)
+        if zoom is None or not 0 <= zoom <= MAX_ZOOM:
+            return jsonify({"error": f"zoom must be an integer between 0 and {MAX_ZOOM}"}), 400
+        kind = request.args.get("kind", "trip")
+        if kind not in PIN_KINDS:
+            return jsonify({"error": "kind must be 'trip' or 'activity'"}), 400
+        south, west, north, east = parse_bbox(request.args.get("bbox"))
+
+        db = current_app.config["db_manager"]
+        clusters = db.get_map_clusters(zoom, south, west, north, east, kind=kind)
+        return jsonify({"zoom": zoom, "kind": kind, "clusters": clusters}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,24 @@
+from flask import Blueprint, Response, jsonify, current_app
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Request, SQL and storage metrics in the Prometheus text format
+    ---
+    tags:
+      - Metrics
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Counters and latency histograms of every worker process
+      404:
+        description: Metrics are disabled
+    """
+    registry = current_app.extensions.get("metrics")
+    if registry is None:
+        return jsonify({"error": "Not found"}), 404
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
@@ -1,5 +1,10 @@
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context, url_for
+from utils.pagination import parse_page_args, page_headers, stream_json_array, wants_stream
+from werkzeug.exceptions import BadRequest, HTTPException
+from utils.conditional import is_fresh, not_modified, tag_response
+from utils.uploads import MAX_UPLOAD_SIZE, receive_image, receive_images
+from utils.validates import validate_fields
 
 photos_bp = Blueprint('photos', __name__, url_prefix='/photos')
 
@@ -14,6 +19,39 @@ def allowed_file(filename):
 @photos_bp.route("/upload/<int:trip_id>", methods=["POST"])
 # @jwt_required()
 def upload_photo(trip_id):
+    """
+    Upload a photo for a trip
+    ---
+    tags:
+      - Photos
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: trip_id
+        in: path
+        type: integer
+        required: true
+      - name: file
+        in: formData
+        type: file
+        required: true
+        description: PNG, JPEG or GIF image
+      - name: caption
+        in: formData
+        type: string
+    responses:
+      202:
+        description: Upload accepted; poll the job at the Location header until it is done
+      400:
+        description: Missing or invalid file
+      404:
+        description: Trip not found
+      413:
+        description: File too large
+      415:
+        description: File is not an image
+    """
+    file = None
     try:
         # current_user_id = int(get_jwt_identity())
         db = current_app.config["db_manager"]
@@ -21,31 +59,121 @@ def upload_photo(trip_id):
         if not trip:
             return jsonify({"error": "Trip not found or unauthorized"}), 404
 
-        if 'file' not in request.files:
+        form, file = receive_image("file", current_app.config.get("MAX_PHOTO_SIZE", MAX_UPLOAD_SIZE),
+                                   current_app.config.get("PHOTO_SPOOL_DIR"))
+        if file is None:
             return jsonify({"error": "No file provided"}), 400
-
-        file = request.files['file']
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         if not allowed_file(file.filename):
             return jsonify({"error": "Invalid file type"}), 400
 
-        MAX_FILE_SIZE = 5 * 1024 * 1024
-        if file.content_length and file.content_length > MAX_FILE_SIZE:
-            return jsonify({"error": "File too large"}), 400
+        job = db.enqueue_photo(trip_id, file, form.get("caption", ""))
+        return jsonify(job.to_dict()), 202, {"Location": url_for("photos.get_photo_job", job_id=job.id)}
+    except HTTPException as e:
+        return jsonify({"error": e.description}), e.code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        if file is not None:
+            file.close()
 
-        photo_data = {
-            "trip_id": trip_id,
-            "file": file,
-            "caption": request.form.get("caption", "")
-        }
 
-        new_photo = db.add_photo(photo_data)
-        return jsonify(new_photo.to_dict()), 201
+@photos_bp.route("/upload/<int:trip_id>/batch", methods=["POST"])
+def upload_photos_batch(trip_id):
+    """
+    Upload many photos for a trip in one request
+    ---
+    tags:
+      - Photos
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: trip_id
+        in: path
+        type: integer
+        required: true
+      - name: files
+        in: formData
+        type: file
+        required: true
+        description: PNG, JPEG or GIF images; repeat the field for each file
+      - name: caption
+        in: formData
+        type: string
+        description: Optional, repeated in the same order as the files
+    responses:
+      201:
+        description: >
+          At least one photo was stored. Files are uploaded in parallel and the photos are
+          written in one transaction; the body lists the photos by file index, plus an error for
+          each file that was skipped.
+      400:
+        description: No files, or none of them could be stored
+      404:
+        description: Trip not found
+      413:
+        description: Too many files, or the request is too large
+    """
+    files = []
+    try:
+        db = current_app.config["db_manager"]
+        if not db.get_trip_by_id(trip_id):
+            return jsonify({"error": "Trip not found or unauthorized"}), 404
+
+        form, files = receive_images("files", current_app.config.get("MAX_PHOTO_SIZE", MAX_UPLOAD_SIZE),
+                                     current_app.config.get("PHOTO_BATCH_MAX_FILES", 50),
+                                     current_app.config.get("PHOTO_SPOOL_DIR"))
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        for file in files:
+            if file.stream.error is None and not allowed_file(file.filename):
+                file.stream.error = BadRequest("Invalid file type")
+
+        created, errors = db.add_photos_batch(trip_id, files, form.getlist("caption"))
+        body = {
+            "created": len(created),
+            "photos": [{"index": index, "photo": photo} for index, photo in created],
+            "errors": [{"index": index, "error": message} for index, message in errors],
+        }
+        return jsonify(body), 201 if created else 400
+    except HTTPException as e:
+        return jsonify({"error": e.description}), e.code
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return jsonify({"error": str(e)}), 500
+    finally:
+        for file in files:
+            file.close()
 
 
+@photos_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_photo_job(job_id):
+    """
+    Get the status of a photo upload
+    ---
+    tags:
+      - Photos
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: The job; status is queued, running, done (with the photo) or failed (with the error)
+      404:
+        description: Job not found
+    """
+    db = current_app.config["db_manager"]
+    job = db.get_photo_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    result = job.to_dict()
+    if job.status == "done" and job.photo_id:
+        photo = db.get_photo_by_id(job.photo_id)
+        result["photo"] = photo.to_dict() if photo else None
+    return jsonify(result), 200
+
 
 @photos_bp.route("/", methods=["GET"])
 def get_photos():
@@ -54,16 +182,37 @@ def get_photos():
     ---
     tags:
       - Photos
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size; the cursor of the next page is returned in the X-Next-Cursor header
+      - name: cursor
+        in: query
+        type: string
+        description: Value of X-Next-Cursor from the previous page
+      - name: stream
+        in: query
+        type: boolean
+        description: Stream every photo as a chunked JSON array
     responses:
       200:
         description: A list of photos
+      400:
+        description: Invalid pagination parameters
       500:
         description: Server error
     """
     try:
         db = current_app.config["db_manager"]
-        photos = db.get_photos()
-        return jsonify(photos), 200
+        if wants_stream(request.args):
+            return Response(stream_with_context(stream_json_array(db.iter_photos())),
+                            mimetype="application/json")
+        limit, after = parse_page_args(request.args)
+        photos = db.get_photos(limit=limit, after=after)
+        return jsonify(photos), 200, page_headers(photos)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -79,16 +228,25 @@ def get_photo(photo_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
     responses:
       200:
-        description: Photo found
+        description: Photo found, with its ETag
+      304:
+        description: The photo has not changed since the given ETag
       404:
         description: Photo not found
     """
     db = current_app.config["db_manager"]
+    etag = db.get_etag("photo", photo_id)
+    if is_fresh(etag):
+        return not_modified(etag)
     photo = db.get_photo_by_id(photo_id)
     if photo:
-        return jsonify(photo.to_dict()), 200
+        return tag_response(jsonify(photo.to_dict()), etag), 200
     return jsonify({"error": "Photo not found"}), 404
 
 @photos_bp.route('/trip/<int:trip_id>', methods=['GET'])
@@ -103,16 +261,25 @@ def get_photos_by_trip_id(trip_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
     responses:
       200:
-        description: A list of photos for the trip
+        description: A list of photos for the trip, with its ETag
+      304:
+        description: Nothing in the trip changed since the given ETag
       500:
         description: Server error
     """
     try:
         db = current_app.config["db_manager"]
+        etag = db.get_etag("trip", trip_id)
+        if is_fresh(etag):
+            return not_modified(etag)
         photos = db.get_photos_by_trip_id(trip_id)
-        return jsonify(photos), 200
+        return tag_response(jsonify(photos), etag), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -147,10 +314,19 @@ def create_photo():
         description: Photo created
       400:
         description: Invalid input
+      404:
+        description: Trip not found
     """
     try:
-        photo_data = request.json
+        photo_data = request.get_json(silent=True)
+        error = validate_fields(photo_data, ["url", "trip_id"])
+        if error:
+            return jsonify(error), 400
+        if not isinstance(photo_data["url"], str):
+            return jsonify({"error": "url must be a string"}), 400
         db = current_app.config["db_manager"]
+        if not db.get_trip_by_id(photo_data["trip_id"]):
+            return jsonify({"error": "Trip not found"}), 404
         new_photo = db.add_photo(photo_data)
         return jsonify(new_photo.to_dict()), 201
     except Exception as e:
@@ -0,0 +1,67 @@
+from flask import Blueprint, request, jsonify, current_app
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+MAX_LIMIT = 100
+SEARCH_KINDS = ("trip", "activity")
+
+
+@search_bp.route("", methods=["GET"])
+@search_bp.route("/", methods=["GET"])
+def search():
+    """
+    Search trips and activities
+    ---
+    tags:
+      - Search
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: Words to look for; every word must match, the last letters may be omitted
+        example: ramen osa
+      - name: type
+        in: query
+        type: string
+        enum: [trip, activity]
+      - name: limit
+        in: query
+        type: integer
+        default: 20
+      - name: offset
+        in: query
+        type: integer
+        default: 0
+    responses:
+      200:
+        description: Ranked results, best match first
+      400:
+        description: Missing query or invalid paging parameters
+      500:
+        description: Server error
+    """
+    try:
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"error": "Missing search query"}), 400
+        kind = request.args.get("type")
+        if kind is not None and kind not in SEARCH_KINDS:
+            return jsonify({"error": "type must be 'trip' or 'activity'"}), 400
+        try:
+            limit = int(request.args.get("limit", 20))
+            offset = int(request.args.get("offset", 0))
+        except ValueError:
+            return jsonify({"error": "limit and offset must be integers"}), 400
+        if not 1 <= limit <= MAX_LIMIT or offset < 0:
+            return jsonify({"error": f"limit must be 1-{MAX_LIMIT} and offset must not be negative"}), 400
+
+        db = current_app.config["db_manager"]
+        results = db.search(query, limit=limit + 1, offset=offset, kind=kind)
+        return jsonify({
+            "query": query,
+            "results": results[:limit],
+            "next_offset": offset + limit if len(results) > limit else None,
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
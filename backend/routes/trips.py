@@ -1,7 +1,10 @@
-from flask import Blueprint, request, jsonify, current_app
-from utils.validates import validate_fields
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from utils.validates import validate_fields, parse_bbox, parse_bulk_trip, parse_expand, parse_fieldset
+from utils.pagination import parse_page_args, page_headers, stream_json_array, wants_stream
+from utils.conditional import is_fresh, not_modified, tag_response, variant_etag
 from datetime import datetime
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from datamanager.serializers import TRIP_EXPANSIONS, TRIP_FIELDS, trip_to_dict
 
 trips_bp = Blueprint('trips', __name__, url_prefix='/trips')
 
@@ -85,37 +88,85 @@ def add_new_trip():
         # Pass lat/lng into add_trip
         new_trip = db.add_trip(data)
 
-        return jsonify({
-            "id": new_trip.id,
-            "title": new_trip.title,
-            "user_id": new_trip.user_id,
-            "country": new_trip.country,
-            "city": new_trip.city,
-            "start_date": new_trip.start_date.isoformat(),
-            "end_date": new_trip.end_date.isoformat(),
-            "description": new_trip.description,
-            "notes": new_trip.notes,
-            "is_public": new_trip.is_public,
-            "lat": new_trip.lat,
-            "lng": new_trip.lng,
-            "activities": [
-                {
-                    "id": a.id,
-                    "name": a.name,
-                    "location": a.location,
-                    "type": a.type,
-                    "notes": a.notes,
-                    "cost": a.cost,
-                    "rating": a.rating,
-                    "trip_id": a.trip_id
-                } for a in new_trip.activities
-            ]
-        }), 201
+        return jsonify(trip_to_dict(new_trip)), 201
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 
+def _bulk_items(errors):
+    """Yield (index, trip, activities) for each valid trip of the request body, recording the invalid ones."""
+    if request.mimetype == "application/x-ndjson":
+        source = ((index, line) for index, line in enumerate(request.stream) if line.strip())
+        decode = current_app.json.loads
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            raise ValueError("Expected a JSON array of trips or an application/x-ndjson body")
+        source, decode = enumerate(data), None
+    for index, item in source:
+        try:
+            trip, activities = parse_bulk_trip(decode(item) if decode else item)
+        except ValueError as e:
+            errors.append((index, str(e)))
+            continue
+        yield index, trip, activities
+
+
+@trips_bp.route("/bulk", methods=["POST"])
+def bulk_import_trips():
+    """
+    Import many trips with their activities at once
+    ---
+    tags:
+      - Trips
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - in: body
+        name: body
+        required: true
+        description: >
+          A JSON array of trips, or one trip per line with Content-Type application/x-ndjson.
+          Each trip needs title, user_id, country, start_date and end_date and may carry an
+          activities list. Trips are written in chunks of 1000, one transaction per chunk.
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/Trip'
+    responses:
+      201:
+        description: >
+          At least one trip was created. The body lists the created ids by item index,
+          plus an error for each item that was skipped.
+      400:
+        description: The body could not be read, or no trip in it was valid
+    """
+    try:
+        errors = []
+        db = current_app.config["db_manager"]
+        created, failed = db.add_trips_bulk(_bulk_items(errors))
+        errors = sorted(errors + failed)
+        body = {
+            "created": len(created),
+            "trips": [{"index": index, "id": trip_id} for index, trip_id in created],
+            "errors": [{"index": index, "error": message} for index, message in errors],
+        }
+        return jsonify(body), 201 if created else 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _fieldset_args():
+    """Return (fields, expand, variant) from the query string; ``expand`` is None when absent."""
+    fields = parse_fieldset(request.args, TRIP_FIELDS)
+    expand = parse_expand(request.args, TRIP_EXPANSIONS) if "expand" in request.args else None
+    return fields, expand, (fields, expand)
+
+
 @trips_bp.route("/", methods=["GET", "OPTIONS"])
 def get_trips():
     """
@@ -123,43 +174,96 @@ def get_trips():
     ---
     tags:
       - Trips
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size; the cursor of the next page is returned in the X-Next-Cursor header
+      - name: cursor
+        in: query
+        type: string
+        description: Value of X-Next-Cursor from the previous page
+      - name: sort
+        in: query
+        type: string
+        enum: [id, start_date]
+      - name: stream
+        in: query
+        type: boolean
+        description: Stream every trip as a chunked JSON array
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated trip columns to return (id is always included); others are not loaded
+        example: title,start_date,end_date,lat,lng
+      - name: expand
+        in: query
+        type: string
+        description: Comma-separated relationships to embed, from activities and photos (default activities)
     responses:
       200:
         description: A list of trips
+      400:
+        description: Invalid pagination, fields or expand parameters
       500:
         description: Server error
     """
     try:
         db = current_app.config["db_manager"]
-        trips = db.get_trips()
-        return jsonify([
-            {
-            "id": trip.id,
-            "title": trip.title,
-            "user_id": trip.user_id,
-            "country": trip.country,
-            "city": trip.city,
-            "start_date": trip.start_date.isoformat(),
-            "end_date": trip.end_date.isoformat(),
-            "description": trip.description,
-            "notes": trip.notes,
-            "is_public": trip.is_public,
-             "lat": trip.lat,
-             "lng": trip.lng,
-            "activities": [
-                {
-                    "id": a.id,
-                    "name": a.name,
-                    "location": a.location,
-                    "type": a.type,
-                    "notes": a.notes,
-                    "cost": a.cost,
-                    "rating": a.rating,
-                    "trip_id": a.trip_id
-                } for a in trip.activities
-            ]
-        } for trip in trips
-    ])
+        fields, expand, _ = _fieldset_args()
+        expand = ("activities",) if expand is None else expand
+        if wants_stream(request.args):
+            trips = db.iter_trips(fields=fields, expand=expand)
+            return Response(stream_with_context(stream_json_array(trips)), mimetype="application/json")
+        limit, after = parse_page_args(request.args)
+        trips = db.get_trips(limit=limit, after=after, sort=request.args.get("sort", "id"),
+                             fields=fields, expand=expand)
+        return jsonify(trips), 200, page_headers(trips)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@trips_bp.route("/within", methods=["GET"])
+def get_trips_within():
+    """
+    Get the trips pinned inside a bounding box
+    ---
+    tags:
+      - Trips
+    parameters:
+      - name: bbox
+        in: query
+        type: string
+        required: true
+        description: west,south,east,north in degrees; west > east crosses the antimeridian
+        example: 135.3,34.5,135.7,34.8
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated trip columns to return (id is always included)
+      - name: expand
+        in: query
+        type: string
+        description: Comma-separated relationships to embed, from activities and photos (default activities)
+    responses:
+      200:
+        description: A list of trips
+      400:
+        description: Invalid bounding box, fields or expand parameters
+      500:
+        description: Server error
+    """
+    try:
+        south, west, north, east = parse_bbox(request.args.get("bbox"))
+        fields, expand, _ = _fieldset_args()
+        expand = ("activities",) if expand is None else expand
+        db = current_app.config["db_manager"]
+        trips = db.get_trips_within(south, west, north, east, fields=fields, expand=expand)
+        return jsonify(trips), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -176,9 +280,25 @@ def get_trip(trip_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated trip columns to return (id is always included)
+      - name: expand
+        in: query
+        type: string
+        description: Comma-separated relationships to embed, from activities and photos (default both)
     responses:
       200:
-        description: Trip data
+        description: Trip data, with its ETag
+      304:
+        description: The trip has not changed since the given ETag
+      400:
+        description: Invalid fields or expand parameters
       404:
         description: Trip not found
       500:
@@ -186,11 +306,18 @@ def get_trip(trip_id):
     """
     try:
         db = current_app.config["db_manager"]
-        trip = db.get_trip_by_id(trip_id)
+        fields, expand, variant = _fieldset_args()
+        etag = variant_etag(db.get_etag("trip", trip_id), *variant)
+        if is_fresh(etag):
+            return not_modified(etag)
+        expand = tuple(TRIP_EXPANSIONS) if expand is None else expand
+        trip = db.get_trip_dict(trip_id, fields=fields, expand=expand)
         if trip:
-            return jsonify(trip.to_dict()), 200
+            return tag_response(jsonify(trip), etag), 200
         else:
             return jsonify({"error": "Trip not found"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -208,9 +335,25 @@ def get_trips_by_user(user_id):
         in: path
         type: integer
         required: true
+      - name: If-None-Match
+        in: header
+        type: string
+        description: ETag of a previously fetched copy
+      - name: fields
+        in: query
+        type: string
+        description: Comma-separated trip columns to return (id is always included)
+      - name: expand
+        in: query
+        type: string
+        description: Comma-separated relationships to embed, from activities and photos (default both)
     responses:
       200:
-        description: A list of trips for the user
+        description: A list of trips for the user, with its ETag
+      304:
+        description: None of the user's trips changed since the given ETag
+      400:
+        description: Invalid fields or expand parameters
       404:
         description: No trips found
     """
@@ -221,37 +364,15 @@ def get_trips_by_user(user_id):
            return jsonify({"error": "Unauthorized access"}), 403
 
         db = current_app.config["db_manager"]
-        trips = db.get_trips_by_user_id(user_id)
-        return jsonify([
-            {
-                "id": trip.id,
-                "title": trip.title,
-                "user_id": trip.user_id,
-                "country": trip.country,
-                "city": trip.city,
-                "start_date": trip.start_date.isoformat(),
-                "end_date": trip.end_date.isoformat(),
-                "description": trip.description,
-                "notes": trip.notes,
-                "is_public": trip.is_public,
-                "lat": trip.lat,
-                "lng": trip.lng,
-                "activities": [
-                    {
-                        "id": a.id,
-                        "name": a.name,
-                        "location": a.location,
-                        "type": a.type,
-                        "notes": a.notes,
-                        "cost": a.cost,
-                        "rating": a.rating,
-                        "trip_id": a.trip_id
-                    } for a in trip.activities
-                ],
-                "photos": db.get_photos_by_trip_id(trip.id)
-
-                } for trip in trips
-        ]), 200
+        fields, expand, variant = _fieldset_args()
+        etag = variant_etag(db.get_etag("user_trips", user_id), *variant)
+        if is_fresh(etag):
+            return not_modified(etag)
+        expand = tuple(TRIP_EXPANSIONS) if expand is None else expand
+        trips = db.get_trips_by_user_id(user_id, fields=fields, expand=expand)
+        return tag_response(jsonify(trips), etag), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -288,6 +409,13 @@ parameters:
           type: string
         notes:
           type: string
+        activities:
+          type: array
+          description: >
+            The trip's full activity list. Entries with the id of one of its activities update
+            it in place, entries without one are added, and activities left out are deleted.
+          items:
+            type: object
 responses:
   200:
     description: Trip updated
@@ -298,13 +426,10 @@ responses:
     try:
         data = request.get_json()
         db = current_app.config["db_manager"]
-        trip = db.get_trip_by_id(trip_id)
-
-        if not trip:
-            return jsonify({"error": "Trip not found"}), 404
 
         # Only update known fields
         allowed_fields = ["title", "description", "city", "country", "start_date", "end_date", "notes", "lat", "lng", "is_public"]
+        updates = {}
         for field in allowed_fields:
             if field in data:
                 value = data[field]
@@ -312,9 +437,16 @@ responses:
                 if field in ["start_date", "end_date"] and isinstance(value, str):
                     value = datetime.strptime(value, "%Y-%m-%d").date()
 
-                setattr(trip, field, value)
+                updates[field] = value
 
-        db.save_changes()  # This method should commit changes to the DB
+        if "activities" in data:
+            if not isinstance(data["activities"], list) or not all(isinstance(a, dict) for a in data["activities"]):
+                return jsonify({"error": "activities must be a list of objects"}), 400
+            updates["activities"] = data["activities"]
+
+        trip = db.update_trip(trip_id, updates)
+        if not trip:
+            return jsonify({"error": "Trip not found"}), 404
         return jsonify(trip.to_dict()), 200
 
     except Exception as e:
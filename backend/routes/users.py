@@ -1,7 +1,9 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, create_refresh_token, \
     get_jwt
-from datetime import datetime
+from datetime import datetime, timezone
+from utils.passwords import HashingBusy
+from utils.pagination import parse_page_args, page_headers, stream_json_array, wants_stream
 
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
@@ -34,6 +36,8 @@ def login_user():
         description: Login successful
       401:
         description: Invalid credentials
+      503:
+        description: Too many password checks in progress; retry after the Retry-After header
     """
 
     try:
@@ -66,6 +70,8 @@ def login_user():
                 }
         }), 200
 
+    except HashingBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -73,9 +79,10 @@ def login_user():
 @users_bp.route('/logout', methods= ['POST'])
 @jwt_required()
 def logout():
-    jti = get_jwt()['jti']
+    token = get_jwt()
     db = current_app.config["db_manager"]
-    db.blacklist_token(jti)
+    expires_at = datetime.fromtimestamp(token['exp'], timezone.utc).replace(tzinfo=None) if 'exp' in token else None
+    db.blacklist_token(token['jti'], expires_at)
     return  jsonify({"message": "Succesfully logged out"}), 200
 
 
@@ -138,6 +145,8 @@ def add_user():
         description: User successfully created
       400:
         description: Validation error
+      503:
+        description: Too many password checks in progress; retry after the Retry-After header
     """
     created_at = datetime.utcnow()
     if request.method == 'OPTIONS':
@@ -160,6 +169,8 @@ def add_user():
             "created_at": new_user.created_at.isoformat() if new_user.created_at else None,
         }), 201
 
+    except HashingBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -170,16 +181,35 @@ def get_users():
     ---
     tags:
       - Users
+    parameters:
+      - name: limit
+        in: query
+        type: integer
+        description: Page size; the cursor of the next page is returned in the X-Next-Cursor header
+      - name: cursor
+        in: query
+        type: string
+        description: Value of X-Next-Cursor from the previous page
+      - name: stream
+        in: query
+        type: boolean
+        description: Stream every user as a chunked JSON array
     responses:
       200:
         description: A list of users
+      400:
+        description: Invalid pagination parameters
     """
     db = current_app.config["db_manager"]
-    users = db.get_all_users()
-    return jsonify([
-        { "id": user.id, "username": user.username, "email": user.email, "created_at": user.created_at}
-        for user in users
-    ])
+    if wants_stream(request.args):
+        return Response(stream_with_context(stream_json_array(db.iter_users())),
+                        mimetype="application/json")
+    try:
+        limit, after = parse_page_args(request.args)
+        users = db.get_all_users(limit=limit, after=after)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(users), 200, page_headers(users)
 
 
 @users_bp.route('/<int:user_id>', methods=['GET'])
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app reads its configuration at import time, so point it at an in-memory
+# database and dummy credentials before importing it.
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["SUPABASE_URL"] = "http://localhost:54321"
+os.environ["SUPABASE_KEY"] = "test-key"
+os.environ["SUPABASE_BUCKET_NAME"] = "test-bucket"
+os.environ["SECRET_KEY"] = "test-secret"
+os.environ["JWT_SECRET_KEY"] = "test-jwt-secret"
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["STORAGE_ROOT"] = tempfile.mkdtemp(prefix="pintrail-test-uploads-")
+os.environ["QUERY_PROFILER"] = "1"
+# Tests refresh the token blacklist themselves instead of racing a timer thread.
+os.environ["REVOCATION_REFRESH_SECONDS"] = "0"
+os.environ["ACCESS_LOG_FILE"] = os.path.join(tempfile.mkdtemp(prefix="pintrail-test-logs-"), "access.log")
+
+from app import app as flask_app  # noqa: E402
+from datamanager.data_models import db  # noqa: E402
+from utils import query_profiler  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config["TESTING"] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def db_manager(app):
+    return app.config["db_manager"]
+
+
+@pytest.fixture
+def query_counter(app):
+    """Collect every SQL statement sent to the database during the test."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def query_budget(app):
+    """``with query_budget(5): ...`` fails when the block runs more than 5 statements or repeats one."""
+    return query_profiler.budget
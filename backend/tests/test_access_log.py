@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+from flask import g
+from sqlalchemy import text
+
+from datamanager.data_models import db
+from utils import query_profiler
+from utils.access_log import redact_query
+
+
+def read_log(app):
+    app.extensions["access_log"].flush()
+    with open(os.environ["ACCESS_LOG_FILE"]) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_requests_are_logged_with_timings_and_without_credentials(app, client, db_manager):
+    db_manager.add_user("ana", "ana@example.com", "secret")
+    before = len(read_log(app))
+
+    response = client.get("/users/?limit=1&access_token=abc.def", headers={
+        "Authorization": "Bearer abc.def", "User-Agent": "pytest", "Origin": "http://localhost:5173"})
+    response.close()
+
+    entry = read_log(app)[before]
+    assert entry["method"] == "GET" and entry["path"] == "/users/" and entry["status"] == 200
+    assert entry["query"] == "limit=1&access_token=%5Bredacted%5D"
+    assert entry["user_agent"] == "pytest" and entry["origin"] == "http://localhost:5173"
+    assert entry["db_queries"] >= 1 and 0 < entry["db_ms"] <= entry["duration_ms"]
+    assert entry["storage_ms"] == 0
+    assert "abc.def" not in json.dumps(entry)
+
+
+def test_sampling_still_logs_errors(app, client, monkeypatch):
+    access_log = app.extensions["access_log"]
+    monkeypatch.setattr(access_log, "sample_rate", 0.0)
+    before = len(read_log(app))
+
+    client.get("/").close()
+    monkeypatch.setattr(app.config["db_manager"], "get_trips", lambda **kwargs: 1 / 0)
+    client.get("/trips/").close()
+
+    assert [entry["path"] for entry in read_log(app)[before:]] == ["/trips/"]
+    assert redact_query("password=x&sort=id") == "password=%5Bredacted%5D&sort=id"
+
+
+def test_statements_and_storage_calls_are_timed_once(app, db_manager, monkeypatch):
+    metrics = app.extensions["metrics"]
+    monkeypatch.setattr(metrics, "histograms", {})
+    clock_reads = []
+    perf_counter = time.perf_counter
+    monkeypatch.setattr(time, "perf_counter", lambda: clock_reads.append(1) or perf_counter())
+
+    with app.test_request_context(), query_profiler.recording() as log:
+        g.timings = timings = {}
+        db.session.execute(text("SELECT 1"))
+        db_manager._storage_call("remove", db_manager.storage.remove, ["photos/none.png"])
+
+    # Two clock reads each, whose result the access log, metrics and profiler all share.
+    assert len(clock_reads) == 4
+    [(_, _, seconds)] = log.statements
+    assert timings["db"] == seconds and timings["queries"] == 1
+    assert metrics.histograms[("pintrail_db_query_duration_seconds", (("method", "other"),))][-2] == seconds
+    storage = metrics.histograms[("pintrail_storage_duration_seconds", (("backend", "local"), ("operation", "remove")))]
+    assert timings["storage"] == storage[-2]
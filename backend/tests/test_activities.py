@@ -0,0 +1,30 @@
+def test_activities_nearby_sorted_by_distance(client, db_manager):
+    db_manager.add_trip({
+        "title": "Osaka", "user_id": 1, "country": "Japan",
+        "start_date": "2024-04-01", "end_date": "2024-04-10",
+        "activities": [
+            {"name": "Dotonbori ramen", "lat": 34.6687, "lng": 135.5013},
+            {"name": "Osaka Castle", "lat": 34.6873, "lng": 135.5262},
+            {"name": "Nara deer park", "lat": 34.6851, "lng": 135.8430},
+            {"name": "Hotel", "lat": None, "lng": None},
+        ],
+    })
+
+    response = client.get("/activities/nearby?lat=34.67&lng=135.50&radius=5")
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [a["name"] for a in results] == ["Dotonbori ramen", "Osaka Castle"]
+    assert results[0]["distance_km"] < results[1]["distance_km"] <= 5
+
+    wide = client.get("/activities/nearby?lat=34.67&lng=135.50&radius=50").get_json()
+    assert [a["name"] for a in wide][-1] == "Nara deer park"
+    nearest = client.get("/activities/nearby?lat=34.67&lng=135.50&radius=50&limit=1").get_json()
+    assert [a["name"] for a in nearest] == ["Dotonbori ramen"]
+
+
+def test_activities_nearby_validates_parameters(client):
+    assert client.get("/activities/nearby?lat=34.6").status_code == 400
+    assert client.get("/activities/nearby?lat=95&lng=0").status_code == 400
+    assert client.get("/activities/nearby?lat=0&lng=0&radius=0").status_code == 400
+    for limit in ("0", "-1", "abc", "1001"):
+        assert client.get(f"/activities/nearby?lat=0&lng=0&limit={limit}").status_code == 400
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import threading
+
+from utils.asgi import AsgiAdapter
+
+
+def call(application, method, path, chunks=(b"",), headers=()):
+    """Send one request through ``application`` and return (status, headers, body)."""
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "http_version": "1.1",
+             "headers": list(headers), "client": ("127.0.0.1", 50000), "server": ("testserver", 80)}
+    asyncio.run(application(scope, receive, send))
+    start = sent[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_requests_are_served_through_the_adapter(app, db_manager):
+    application = AsgiAdapter(app, threads=2)
+    db_manager.add_user("ana", "ana@example.com", "secret")
+
+    status, _, body = call(application, "GET", "/")
+    assert (status, body) == (200, b"Welcome to PinTrail API!")
+
+    # A body arriving in pieces, without a Content-Length, reaches the app whole.
+    payload = json.dumps({"email": "ana@example.com", "password": "secret"}).encode()
+    status, headers, body = call(application, "POST", "/users/login", [payload[:10], payload[10:25], payload[25:]],
+                                 [(b"content-type", b"application/json")])
+    assert status == 200 and headers[b"content-type"] == b"application/json"
+    assert json.loads(body)["user"]["username"] == "ana"
+
+
+def test_oversized_bodies_are_refused_before_the_app_runs(app):
+    application = AsgiAdapter(app, threads=1, max_body_size=16)
+    status, _, _ = call(application, "POST", "/users/login", [b"x" * 10, b"x" * 10])
+    assert status == 413
+    status, _, _ = call(application, "POST", "/users/login", [b""], [(b"content-length", b"1000")])
+    assert status == 413
+
+
+def test_responses_are_sent_while_the_app_is_still_producing_them():
+    first_chunk_sent = threading.Event()
+
+    def streaming_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        yield b"first,"
+        # Only returns in time if the first chunk left before the body was complete.
+        yield b"second" if first_chunk_sent.wait(timeout=5) else b"buffered"
+
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+        if message.get("body") == b"first,":
+            first_chunk_sent.set()
+
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": []}
+    asyncio.run(AsgiAdapter(streaming_app, threads=1)(scope, receive, send))
+    assert sent[0]["status"] == 200
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"first,second"
+    assert [message.get("more_body", False) for message in sent[1:]] == [True, True, False]
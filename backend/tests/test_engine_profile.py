@@ -0,0 +1,28 @@
+from flask import Flask
+
+from datamanager import engine_profile
+from datamanager.data_models import db
+from datamanager.sqllite_data_manager import SQLiteDataManager
+
+
+def test_sqlite_profile_is_applied_to_every_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'tuned.db'}")
+    app = Flask("tuned")
+    app.config.update({"supabase": None, "SUPABASE_BUCKET_NAME": None, "STORAGE_ROOT": str(tmp_path),
+                       "SQLITE_PRAGMAS": {"synchronous": "FULL", "mmap_size": None}})
+    SQLiteDataManager(app)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            pragma = lambda name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("busy_timeout") == 5000
+            assert pragma("synchronous") == 2  # FULL, from the app config
+            assert pragma("cache_size") == -65536
+            assert pragma("mmap_size") == 0  # left at SQLite's default
+        db.engine.dispose()
+
+
+def test_server_databases_get_a_sized_pool():
+    options = engine_profile.engine_options({"DB_POOL_SIZE": 4}, "postgresql://pintrail@db/pintrail")
+    assert options["pool_size"] == 4 and options["max_overflow"] == 20 and options["pool_pre_ping"]
+    assert "connect_args" not in options
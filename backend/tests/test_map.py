@@ -0,0 +1,68 @@
+import pytest
+
+from datamanager.data_models import MapCluster
+
+WORLD = "-180,-85,180,85"
+
+
+def _add_pinned_trip(db_manager, lat, lng):
+    return db_manager.add_trip({
+        "title": "Pin", "user_id": 1, "country": "Somewhere",
+        "start_date": "2024-01-01", "end_date": "2024-01-02", "lat": lat, "lng": lng,
+    }).id
+
+
+def _clusters(client, zoom, bbox=WORLD, kind="trip"):
+    response = client.get(f"/map/clusters?zoom={zoom}&bbox={bbox}&kind={kind}")
+    assert response.status_code == 200
+    return response.get_json()["clusters"]
+
+
+def _snapshot():
+    return sorted(
+        (c.kind, c.zoom, c.cx, c.cy, c.count, round(c.lat_sum, 6), round(c.lng_sum, 6))
+        for c in MapCluster.query.all()
+    )
+
+
+def test_clusters_group_pins_per_zoom(client, db_manager):
+    osaka = _add_pinned_trip(db_manager, 34.69, 135.50)
+    _add_pinned_trip(db_manager, 34.70, 135.49)
+    _add_pinned_trip(db_manager, 35.01, 135.77)
+    _add_pinned_trip(db_manager, 48.85, 2.35)
+
+    world = _clusters(client, 0)
+    assert sorted(c["count"] for c in world) == [1, 3]
+    japan = next(c for c in world if c["count"] == 3)
+    assert japan["lat"] == pytest.approx((34.69 + 34.70 + 35.01) / 3)
+    assert japan["representative"]["id"] == osaka
+
+    assert sorted(c["count"] for c in _clusters(client, 10, "135,34,136,36")) == [1, 2]
+    assert len(_clusters(client, 16, "135,34,136,36")) == 3
+    assert _clusters(client, 0, kind="activity") == []
+
+
+def test_clusters_follow_trip_updates_and_deletes(client, db_manager):
+    osaka = _add_pinned_trip(db_manager, 34.69, 135.50)
+    kyoto = _add_pinned_trip(db_manager, 35.01, 135.77)
+    kobe = _add_pinned_trip(db_manager, 34.69, 135.19)
+    _add_pinned_trip(db_manager, -33.86, 151.20)
+
+    client.put(f"/trips/{kyoto}", json={"lat": 51.50, "lng": -0.12})
+    assert sorted(c["count"] for c in _clusters(client, 0)) == [1, 1, 2]
+
+    db_manager.delete_trip(osaka)
+    japan = _clusters(client, 5, "130,30,140,40")
+    assert len(japan) == 1 and japan[0]["count"] == 1
+    assert japan[0]["representative"] == {"id": kobe, "lat": 34.69, "lng": 135.19}
+
+    incremental = _snapshot()
+    db_manager.rebuild_map_clusters()
+    assert _snapshot() == incremental
+
+
+def test_clusters_validate_parameters(client):
+    assert client.get(f"/map/clusters?bbox={WORLD}").status_code == 400
+    assert client.get(f"/map/clusters?zoom=25&bbox={WORLD}").status_code == 400
+    assert client.get("/map/clusters?zoom=3").status_code == 400
+    assert client.get(f"/map/clusters?zoom=3&bbox={WORLD}&kind=photo").status_code == 400
@@ -0,0 +1,61 @@
+import json
+import os
+import re
+
+from flask import Flask
+
+from utils.metrics import Metrics
+
+
+def sample(text, name, **labels):
+    """The value of the ``name`` sample whose labels include ``labels``, or None."""
+    for line in text.splitlines():
+        match = re.fullmatch(rf"{name}(?:{{(.*)}})? (\S+)", line)
+        if match:
+            found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(1) or ""))
+            if all(found.get(key) == value for key, value in labels.items()):
+                return float(match.group(2))
+    return None
+
+
+def test_routes_sql_and_storage_are_measured(app, client, db_manager, monkeypatch):
+    metrics = app.extensions["metrics"]
+    monkeypatch.setattr(metrics, "counters", {})
+    monkeypatch.setattr(metrics, "histograms", {})
+    db_manager.add_user("ana", "ana@example.com", "secret")
+    client.get("/users/?limit=1").close()
+    client.get("/users/?limit=1").close()
+    client.get("/no-such-page").close()
+    monkeypatch.setattr(db_manager, "get_trips", lambda **kwargs: 1 / 0)
+    client.get("/trips/").close()
+    db_manager._storage_call("remove", db_manager.storage.remove, ["photos/none.png"])
+
+    text = client.get("/metrics").get_data(as_text=True)
+    assert sample(text, "pintrail_http_requests_total", route="/users/", method="GET", status="200") == 2
+    assert sample(text, "pintrail_http_request_duration_seconds_count", route="/users/") == 2
+    assert sample(text, "pintrail_http_request_duration_seconds_bucket", route="/users/", le="+Inf") == 2
+    assert sample(text, "pintrail_http_requests_total", route="unmatched", status="404") == 1
+    assert sample(text, "pintrail_http_request_errors_total", route="/trips/") == 1
+    assert sample(text, "pintrail_db_queries_total", method="add_user") >= 1
+    assert sample(text, "pintrail_db_queries_total", method="get_all_users") == 2
+    assert sample(text, "pintrail_storage_requests_total", backend="local", operation="remove", outcome="ok") == 1
+
+
+def test_worker_processes_are_added_up(tmp_path):
+    worker = Flask("worker")
+    worker.config["METRICS_DIR"] = str(tmp_path)
+    this_worker, other_worker = Metrics(worker), Metrics()
+    other_worker.inc("pintrail_db_queries_total", {"method": "get_trips"}, 3)
+    other_worker.observe("pintrail_db_query_duration_seconds", {"method": "get_trips"}, 0.02)
+    with open(os.path.join(tmp_path, "1.json"), "w") as f:
+        json.dump(other_worker.snapshot(), f)
+    this_worker.inc("pintrail_db_queries_total", {"method": "get_trips"}, 2)
+
+    text = this_worker.render()
+    assert sample(text, "pintrail_db_queries_total", method="get_trips") == 5
+    assert sample(text, "pintrail_db_query_duration_seconds_bucket", method="get_trips", le="0.025") == 1
+    assert sample(text, "pintrail_db_query_duration_seconds_bucket", method="get_trips", le="0.01") == 0
+
+    this_worker.flush()
+    with open(this_worker.path) as f:
+        assert json.load(f)["counters"] == [["pintrail_db_queries_total", [["method", "get_trips"]], 2]]
@@ -0,0 +1,272 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import pytest
+
+from datamanager import photo_blobs
+from datamanager.data_models import Photo, PhotoBlob, PhotoJob, PhotoVariant, Trip, db
+from datamanager.storage import LocalStorage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+
+class RecordingStorage(LocalStorage):
+    """Local storage that remembers what was uploaded and can fail the next uploads."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.uploads = {}
+        self.failures = 0
+
+    def upload(self, path, body, content_type):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("storage unavailable")
+        url = super().upload(path, body, content_type)
+        with open(self.local_path(path), "rb") as stored:
+            self.uploads[path] = (type(body).__mro__, stored.read(), content_type)
+        return url
+
+    def remove(self, paths):
+        super().remove(paths)
+        for path in paths:
+            self.uploads.pop(path)
+
+
+@pytest.fixture
+def bucket(db_manager, tmp_path):
+    bucket, previous = RecordingStorage(tmp_path), db_manager.storage
+    db_manager.storage = bucket
+    yield bucket
+    db_manager.storage = previous
+
+
+@pytest.fixture
+def trip_id(db_manager):
+    user = db_manager.add_user("snap", "snap@example.com", "secret")
+    trip = Trip(title="Oslo", user_id=user.id, country="Norway", city="Oslo")
+    db.session.add(trip)
+    db.session.commit()
+    return trip.id
+
+
+def wait_for(client, location, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(location).get_json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job still {job['status']}")
+
+
+def upload(client, trip_id, body, filename="view.png"):
+    return client.post(f"/photos/upload/{trip_id}", content_type="multipart/form-data",
+                       data={"file": (io.BytesIO(body), filename), "caption": "Harbour"})
+
+
+def test_upload_is_accepted_and_ingested_in_the_background(client, bucket, trip_id):
+    response = upload(client, trip_id, PNG)
+    assert response.status_code == 202
+    assert response.get_json()["status"] in ("queued", "running", "done")
+
+    job = wait_for(client, response.headers["Location"])
+    assert job["status"] == "done" and job["attempts"] == 1
+    assert job["photo"]["caption"] == "Harbour"
+    digest = hashlib.sha256(PNG).hexdigest()
+    assert job["photo"]["url"] == f"/uploads/photos/blobs/{digest[:2]}/{digest}.png"
+    [(mro, body, content_type)] = bucket.uploads.values()
+    assert io.BufferedReader in mro and body == PNG and content_type == "image/png"
+    assert client.get("/photos/jobs/unknown").status_code == 404
+
+
+def test_ingestion_retries_failed_uploads_with_backoff(client, bucket, trip_id, db_manager, monkeypatch):
+    monkeypatch.setattr(db_manager.photo_ingestion, "backoff", 0.01)
+    monkeypatch.setattr(db_manager.photo_ingestion, "max_attempts", 3)
+    bucket.failures = 2
+    job = wait_for(client, upload(client, trip_id, PNG).headers["Location"])
+    assert job["status"] == "done" and job["attempts"] == 3
+
+    bucket.failures = 3
+    job = wait_for(client, upload(client, trip_id, PNG + b"other").headers["Location"])
+    assert job["status"] == "failed" and job["error"] == "storage unavailable"
+    assert not os.path.exists(db.session.get(PhotoJob, job["id"]).spool_path)
+
+
+def test_deleting_a_trip_drops_its_jobs_and_spooled_files(client, bucket, trip_id, db_manager, monkeypatch):
+    monkeypatch.setattr(db_manager.photo_ingestion, "submit", lambda job_id, delay=0: None)
+    queued = db.session.get(PhotoJob, upload(client, trip_id, PNG).get_json()["id"])
+    spool_path = queued.spool_path
+    assert os.path.exists(spool_path)
+
+    assert client.delete(f"/trips/{trip_id}").status_code == 200
+    assert PhotoJob.query.count() == 0
+    assert not os.path.exists(spool_path)
+
+
+def test_job_of_a_trip_deleted_mid_upload_removes_its_spool(client, bucket, trip_id, db_manager, monkeypatch):
+    spools = []
+
+    def delete_trip_then_fail(path, body, content_type):
+        spools.append(body.name)
+        db_manager.delete_trip(trip_id)
+        raise ConnectionError("storage unavailable")
+
+    monkeypatch.setattr(bucket, "upload", delete_trip_then_fail)
+    job_id = upload(client, trip_id, PNG).get_json()["id"]
+    deadline = time.monotonic() + 5
+    while (not spools or os.path.exists(spools[0])) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert spools and not os.path.exists(spools[0])
+    assert client.get(f"/photos/jobs/{job_id}").status_code == 404
+
+
+def test_upload_rejects_oversized_and_non_image_bodies(app, client, bucket, trip_id, monkeypatch):
+    monkeypatch.setitem(app.config, "MAX_PHOTO_SIZE", 1024)
+    spooled = set(os.listdir(tempfile.gettempdir()))
+    assert upload(client, trip_id, PNG + b"\0" * 2048).status_code == 413
+    assert upload(client, trip_id, b"<html>" + b"\0" * 100).status_code == 415
+    assert upload(client, trip_id, b"\x89PN").status_code == 415
+    assert bucket.uploads == {}
+    assert set(os.listdir(tempfile.gettempdir())) <= spooled
+
+
+def test_ingestion_renders_variants_once_per_content(client, bucket, trip_id):
+    pytest.importorskip("PIL")
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000), "teal").save(buffer, "PNG")
+    first = wait_for(client, upload(client, trip_id, buffer.getvalue()).headers["Location"])
+    variants = first["photo"]["variants"]
+    assert set(variants) == {"thumb", "medium", "webp"}
+    assert variants["thumb"].endswith("-256.jpg")
+
+    stored = {path: data for path, (_, data, _) in bucket.uploads.items() if path.startswith("variants/")}
+    assert len(stored) == 3
+    assert Image.open(io.BytesIO(stored[variants["thumb"].removeprefix("/uploads/")])).size == (256, 128)
+
+    second = wait_for(client, upload(client, trip_id, buffer.getvalue(), "again.png").headers["Location"])
+    assert second["photo"]["variants"] == variants
+    assert len([path for path in bucket.uploads if path.startswith("variants/")]) == 3
+    assert client.get(f"/photos/trip/{trip_id}").get_json()[0]["variants"] == variants
+
+
+def test_ingestion_uploads_before_writing_any_row(client, bucket, trip_id, monkeypatch):
+    pytest.importorskip("PIL")
+    from PIL import Image
+
+    pending = []
+    store = bucket.upload
+
+    def recording_upload(path, body, content_type):
+        # Rows in the session here would be flushed, and the write lock held, during the upload.
+        pending.append([type(obj).__name__ for obj in list(db.session.new) + list(db.session.identity_map.values())
+                        if isinstance(obj, (Photo, PhotoBlob, PhotoVariant))])
+        return store(path, body, content_type)
+
+    monkeypatch.setattr(bucket, "upload", recording_upload)
+    buffer = io.BytesIO()
+    Image.new("RGB", (600, 400), "teal").save(buffer, "PNG")
+    job = wait_for(client, upload(client, trip_id, buffer.getvalue()).headers["Location"])
+    assert job["status"] == "done" and set(job["photo"]["variants"]) == {"thumb", "medium", "webp"}
+    assert pending == [[], [], [], []]
+
+
+def test_link_to_a_blob_collected_meanwhile_stores_it_again(client, bucket, trip_id, db_manager, monkeypatch):
+    monkeypatch.setattr(db_manager.photo_ingestion, "backoff", 0.01)
+    first = wait_for(client, upload(client, trip_id, PNG).headers["Location"])["photo"]
+    find = photo_blobs.find
+
+    def find_then_collect(session, content_hash):
+        blob = find(session, content_hash)
+        if blob is not None:
+            db_manager.delete_photo(first["id"])  # drops the last reference; the blob goes
+        return blob
+
+    monkeypatch.setattr(photo_blobs, "find", find_then_collect)
+    job = wait_for(client, upload(client, trip_id, PNG, "again.png").headers["Location"])
+    assert job["status"] == "done" and job["attempts"] == 2
+    assert db.session.query(PhotoBlob.ref_count).scalar() == 1
+    assert client.get(job["photo"]["url"]).data == PNG
+
+
+def test_same_content_is_stored_once_and_removed_with_its_last_photo(client, bucket, trip_id, db_manager):
+    other_trip = Trip(title="Bergen", user_id=1, country="Norway", city="Bergen")
+    db.session.add(other_trip)
+    db.session.commit()
+    first = wait_for(client, upload(client, trip_id, PNG).headers["Location"])["photo"]
+    second = wait_for(client, upload(client, other_trip.id, PNG, "copy.png").headers["Location"])["photo"]
+    assert first["url"] == second["url"] and first["id"] != second["id"]
+    [stored] = bucket.uploads
+    assert db.session.query(PhotoBlob.ref_count).scalar() == 2
+
+    assert client.delete(f"/photos/{first['id']}").status_code == 200
+    assert list(bucket.uploads) == [stored]
+    assert db.session.query(PhotoBlob.ref_count).scalar() == 1
+
+    db_manager.delete_trip(other_trip.id)
+    assert bucket.uploads == {} and PhotoBlob.query.count() == 0
+
+
+def test_photos_hosted_elsewhere_are_linked_without_storing_them(client, bucket, trip_id, db_manager, monkeypatch,
+                                                                 caplog):
+    response = client.post("/photos", json={"trip_id": trip_id, "url": "https://example.com/fjord.jpg"})
+    assert response.status_code == 201 and response.get_json()["url"] == "https://example.com/fjord.jpg"
+    assert bucket.uploads == {} and PhotoBlob.query.count() == 0
+    assert client.post("/photos", json={"trip_id": trip_id}).status_code == 400
+    assert client.post("/photos", json={"trip_id": 999, "url": "https://example.com/x.jpg"}).status_code == 404
+
+    # A file that cannot be removed is logged, not printed.
+    photo = wait_for(client, upload(client, trip_id, PNG).headers["Location"])["photo"]
+    monkeypatch.setattr(bucket, "remove", lambda paths: 1 / 0)
+    assert client.delete(f"/photos/{photo['id']}").status_code == 200
+    assert "Could not remove photo files" in caplog.text
+
+
+def test_local_files_are_served_with_ranges_and_immutable_caching(client, bucket, trip_id):
+    url = wait_for(client, upload(client, trip_id, PNG).headers["Location"])["photo"]["url"]
+    full = client.get(url)
+    assert full.status_code == 200 and full.data == PNG
+    assert full.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+    part = client.get(url, headers={"Range": "bytes=0-7"})
+    assert part.status_code == 206 and part.data == PNG[:8]
+    assert part.headers["Content-Range"] == f"bytes 0-7/{len(PNG)}"
+    assert client.get("/uploads/../app.py").status_code == 404
+
+
+def test_batch_upload_stores_files_in_parallel_and_reports_each(client, bucket, trip_id, app, monkeypatch):
+    monkeypatch.setitem(app.config, "MAX_PHOTO_SIZE", 1024)
+    other = PNG + b"other"
+    files = [(io.BytesIO(PNG), "a.png"), (io.BytesIO(b"<html>" + b"\0" * 10), "b.png"),
+             (io.BytesIO(other), "c.png"), (io.BytesIO(PNG), "d.png"),
+             (io.BytesIO(PNG + b"\0" * 2048), "e.png"), (io.BytesIO(other), "f.txt")]
+    response = client.post(f"/photos/upload/{trip_id}/batch", content_type="multipart/form-data",
+                           data={"files": files, "caption": ["First", "", "Third"]})
+    assert response.status_code == 201
+    body = response.get_json()
+    assert [item["index"] for item in body["photos"]] == [0, 2, 3]
+    assert [(item["index"], item["error"]) for item in body["errors"]] == [
+        (1, "File is not a PNG, JPEG or GIF image"), (4, "File too large, the limit is 1024 bytes"),
+        (5, "Invalid file type")]
+    photos = [item["photo"] for item in body["photos"]]
+    assert [photo["caption"] for photo in photos] == ["First", "Third", ""]
+    assert photos[0]["url"] == photos[2]["url"] != photos[1]["url"]
+    assert len(bucket.uploads) == 2
+    assert dict(db.session.query(PhotoBlob.content_hash, PhotoBlob.ref_count)) == {
+        hashlib.sha256(PNG).hexdigest(): 2, hashlib.sha256(other).hexdigest(): 1}
+
+
+def test_batch_whose_rows_fail_to_commit_removes_its_uploads(client, bucket, trip_id, monkeypatch):
+    def failing_sync(session):
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(photo_blobs, "sync_session", failing_sync)
+    response = client.post(f"/photos/upload/{trip_id}/batch", content_type="multipart/form-data",
+                           data={"files": [(io.BytesIO(PNG), "a.png"), (io.BytesIO(PNG + b"b"), "b.png")]})
+    assert response.status_code == 500
+    assert bucket.uploads == {} and PhotoBlob.query.count() == 0
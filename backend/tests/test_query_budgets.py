@@ -0,0 +1,68 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from datamanager.data_models import db, Photo
+from utils import query_profiler
+
+TRIPS = 12
+
+# Statements each endpoint may run against a trip list of any length; a new per-row query
+# shows up both as a repeated statement and as more statements than budgeted.
+BUDGETS = [
+    ("/trips/?limit=10", 2),
+    ("/trips/?limit=10&expand=activities,photos", 3),
+    ("/trips/1", 4),
+    ("/trips/user/1", 4),
+    ("/activities/?limit=10", 1),
+    ("/activities/trip/1", 2),
+    ("/activities/nearby?lat=34.69&lng=135.50&radius=50", 2),
+    ("/photos/?limit=10", 1),
+    ("/photos/trip/1", 2),
+    ("/map/clusters?zoom=3&bbox=-180,-60,180,70", 1),
+    ("/search?q=osaka", 2),
+    ("/users/?limit=10", 1),
+]
+
+
+@pytest.fixture
+def seeded(db_manager):
+    user_id = db_manager.add_user("traveller", "traveller@example.com", "secret").id
+    for i in range(TRIPS):
+        trip = db_manager.add_trip({
+            "title": f"Osaka {i}", "user_id": user_id, "country": "Japan", "city": "Osaka",
+            "start_date": "2024-04-01", "end_date": "2024-04-10", "lat": 34.69, "lng": 135.50,
+            "activities": [
+                {"name": "Ramen", "type": "restaurant", "lat": 34.67, "lng": 135.50},
+                {"name": "Castle", "type": "sightseeing", "lat": 34.69, "lng": 135.53},
+            ],
+        })
+        db.session.add(Photo(trip_id=trip.id, url=f"https://example.com/{i}.jpg"))
+    db.session.commit()
+    db.session.expire_all()
+    return {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+
+
+@pytest.mark.parametrize("url, max_queries", BUDGETS)
+def test_endpoint_stays_within_its_query_budget(client, seeded, query_budget, url, max_queries):
+    with query_budget(max_queries):
+        response = client.get(url, headers=seeded)
+    assert response.status_code == 200
+
+
+def test_per_row_queries_are_reported(client, db_manager, seeded):
+    with pytest.raises(query_profiler.QueryBudgetExceeded, match="12 runs of: SELECT"):
+        with query_profiler.budget(20):
+            for trip in db_manager.get_trips(expand=()):
+                db_manager.get_photos_by_trip_id(trip["id"])
+
+
+def test_profiled_requests_report_their_query_count_and_repeats(app, client, db_manager, seeded, monkeypatch,
+                                                                caplog):
+    monkeypatch.setattr(db_manager, "get_trips_by_user", lambda user_id, fields=None, expand=(): [
+        {"id": trip["id"], "photos": db_manager.get_photos_by_trip_id(trip["id"])}
+        for trip in db_manager.get_trips(expand=())])
+    response = client.get("/trips/user/1", headers=seeded)
+    assert response.status_code == 200
+    assert int(response.headers["X-Query-Count"]) > TRIPS
+    assert any(f"Possible N+1 in GET /trips/user/1: {TRIPS} runs of SELECT" in message
+               for message in caplog.messages)
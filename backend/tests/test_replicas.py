@@ -0,0 +1,106 @@
+from flask import Flask
+
+from datamanager import replicas
+from datamanager.data_models import db, Trip, User
+from datamanager.sqllite_data_manager import SQLiteDataManager
+
+
+def make_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primary.db'}")
+    app = Flask("replicated")
+    app.config.update({"supabase": None, "SUPABASE_BUCKET_NAME": None, "STORAGE_ROOT": str(tmp_path),
+                       "SQLALCHEMY_REPLICA_URIS": [f"sqlite:///{tmp_path / 'replica.db'}"]})
+    manager = SQLiteDataManager(app)
+    # A replica that has not caught up: the same trip under an older title.
+    replica = manager.replicas.engines[0]
+    db.metadata.create_all(replica)
+    with replica.begin() as conn:
+        conn.execute(User.__table__.insert(), {"id": 1, "username": "ana", "email": "a@x.io", "password_hash": "x"})
+        conn.execute(Trip.__table__.insert(), {"id": 1, "title": "Old title", "user_id": 1, "country": "PT"})
+    with app.app_context():
+        db.session.add(User(id=1, username="ana", email="a@x.io", password_hash="x"))
+        db.session.add(Trip(id=1, title="New title", user_id=1, country="PT"))
+        db.session.commit()
+    return app, manager
+
+
+def test_reads_go_to_the_replica_until_the_request_writes(tmp_path, monkeypatch):
+    app, manager = make_app(tmp_path, monkeypatch)
+    try:
+        with app.test_request_context():
+            assert manager.get_trip_dict(1, expand=())["title"] == "Old title"
+            assert manager.get_trip_by_id(1).title == "Old title"
+            # Queries outside the methods marked as reads stay on the primary.
+            assert db.session.get(Trip, 1).title == "New title"
+
+            manager.add_trip({"title": "Second", "user_id": 1, "country": "ES",
+                              "start_date": "2024-05-01", "end_date": "2024-05-03"})
+            assert manager.get_trip_dict(1, expand=())["title"] == "New title"
+            assert [t["title"] for t in manager.get_trips_by_user(1, expand=())] == ["New title", "Second"]
+
+        with app.test_request_context():
+            assert manager.get_trip_dict(1, expand=())["title"] == "Old title"
+            assert [t["title"] for t in manager.get_trips_by_user(1, expand=())] == ["Old title"]
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        manager.replicas.dispose()
+
+
+def test_changes_to_objects_read_from_a_replica_are_written_to_the_primary(tmp_path, monkeypatch):
+    app, manager = make_app(tmp_path, monkeypatch)
+    try:
+        with app.test_request_context():
+            trip = manager.get_trip_by_id(1)
+            trip.notes = "Edited"
+            manager.save_changes()
+        with app.app_context(), db.engine.connect() as conn, manager.replicas.engines[0].connect() as replica:
+            assert conn.execute(Trip.__table__.select()).first().notes == "Edited"
+            assert replica.execute(Trip.__table__.select()).first().notes is None
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        manager.replicas.dispose()
+
+
+def test_etags_and_writes_agree_with_the_database_they_read(tmp_path, monkeypatch):
+    app, manager = make_app(tmp_path, monkeypatch)
+    try:
+        with app.test_request_context():
+            # The lagging replica has no revision for the trip yet, like the old title it serves.
+            assert manager.get_etag("trip", 1) == "trip-1-r0"
+            assert manager.get_trip_by_id(1).title == "Old title"
+            # A write reloads the trip from the primary instead of reusing the replica's copy.
+            assert manager.update_trip(1, {"notes": "Edited"}).title == "New title"
+            assert manager.get_etag("trip", 1) == "trip-1-r2"
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        manager.replicas.dispose()
+
+
+def test_search_runs_on_a_caught_up_replica(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primary.db'}")
+    app = Flask("replicated")
+    app.config.update({"supabase": None, "SUPABASE_BUCKET_NAME": None, "STORAGE_ROOT": str(tmp_path),
+                       "SQLALCHEMY_REPLICA_URIS": [f"sqlite:///{tmp_path / 'replica.db'}"]})
+    manager = SQLiteDataManager(app)
+    try:
+        with app.app_context():
+            db.session.add(User(id=1, username="ana", email="a@x.io", password_hash="x"))
+            db.session.add(Trip(id=1, title="Lisbon trams", user_id=1, country="PT"))
+            db.session.commit()
+            # A copy made outside this process, as replication would.
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql(f"VACUUM INTO '{tmp_path / 'replica.db'}'")
+        with app.test_request_context():
+            assert [result["title"] for result in manager.search("tram")] == ["Lisbon trams"]
+            assert replicas.read_from_replica()
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        manager.replicas.dispose()
@@ -0,0 +1,85 @@
+import pytest
+
+from datamanager import search_index
+from datamanager.data_models import db
+
+
+@pytest.fixture(params=["fts5", "tokens"])
+def search_mode(request, app, monkeypatch):
+    monkeypatch.setattr(search_index, "PREFER_FTS5", request.param == "fts5")
+    db.drop_all()
+    db.create_all()
+    assert search_index.uses_fts5(db.session) == (request.param == "fts5")
+    return request.param
+
+
+def _seed(db_manager):
+    osaka = db_manager.add_trip({
+        "title": "Kansai food trip", "user_id": 1, "country": "Japan", "city": "Osaka",
+        "start_date": "2024-04-01", "end_date": "2024-04-10", "description": "Eating everything",
+        "activities": [
+            {"name": "Ichiran ramen", "type": "restaurant", "location": "Dotonbori, Osaka"},
+            {"name": "Osaka Castle", "type": "museum", "location": "Chuo-ku"},
+        ],
+    })
+    db_manager.add_trip({
+        "title": "Ramen tour", "user_id": 1, "country": "Japan", "city": "Tokyo",
+        "start_date": "2024-05-01", "end_date": "2024-05-03", "notes": "Try the Sapporo miso",
+    })
+    db_manager.add_trip({
+        "title": "Café hopping", "user_id": 1, "country": "France", "city": "Paris",
+        "start_date": "2024-06-01", "end_date": "2024-06-03",
+    })
+    return osaka.id
+
+
+def _search(client, query, **params):
+    response = client.get("/search", query_string={"q": query, **params})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_search_ranks_prefix_matches(client, db_manager, search_mode):
+    _seed(db_manager)
+
+    results = _search(client, "ramen osa")["results"]
+    assert [(r["kind"], r["title"]) for r in results] == [("activity", "Ichiran ramen")]
+
+    ramen = _search(client, "RAM")["results"]
+    assert {r["title"] for r in ramen} == {"Ichiran ramen", "Ramen tour"}
+    assert _search(client, "cafe")["results"][0]["title"] == "Café hopping"
+    assert [r["kind"] for r in _search(client, "osaka", type="trip")["results"]] == ["trip"]
+
+
+def test_search_pages_and_follows_writes(client, db_manager, search_mode):
+    trip_id = _seed(db_manager)
+
+    first = _search(client, "japan", limit=1)
+    assert len(first["results"]) == 1 and first["next_offset"] == 1
+    second = _search(client, "japan", limit=1, offset=1)
+    assert second["next_offset"] is None
+    assert first["results"][0]["id"] != second["results"][0]["id"]
+
+    client.put(f"/trips/{trip_id}", json={"title": "Kansai okonomiyaki crawl"})
+    assert [r["id"] for r in _search(client, "okonomi")["results"]] == [trip_id]
+
+    db_manager.delete_trip(trip_id)
+    assert _search(client, "ichiran")["results"] == []
+    assert _search(client, "okonomiyaki")["results"] == []
+
+
+def test_search_requires_query(client):
+    assert client.get("/search").status_code == 400
+    assert client.get("/search?q=ramen&type=photo").status_code == 400
+    assert client.get("/search?q=ramen&limit=0").status_code == 400
+    assert client.get("/search?q=ramen&limit=abc").status_code == 400
+    assert client.get("/search?q=ramen&offset=-1").status_code == 400
+
+
+def test_search_ranks_every_match(app, search_mode):
+    # The best match is the oldest document, behind thousands of newer, weaker ones.
+    documents = [("trip", 1, {"title": "Lagoon", "place": "", "body": "", "tags": ""})]
+    documents += [("trip", ref_id, {"title": "", "place": "", "body": f"lagoon walk {ref_id}", "tags": ""})
+                  for ref_id in range(2, 6002)]
+    search_index.index_documents(db.session, documents, replace=False)
+    assert search_index.search(db.session, "lagoon", limit=1)[0][:2] == ("trip", 1)
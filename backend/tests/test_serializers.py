@@ -0,0 +1,41 @@
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+from datamanager import serializers
+from datamanager.data_models import db, Photo
+from utils.json_provider import OrjsonProvider
+
+
+def test_trip_payload_is_the_same_on_every_endpoint(client, db_manager):
+    user_id = db_manager.add_user("same", "same@example.com", "secret").id
+    created = client.post("/trips/add_trip", json={
+        "title": "Lisbon", "user_id": user_id, "country": "Portugal", "city": "Lisbon",
+        "start_date": "2024-05-01", "end_date": "2024-05-05", "description": "Tiles",
+        "notes": "Tram 28", "is_public": True, "lat": 38.72, "lng": -9.14,
+        "activities": [{"name": "Belem", "type": "sightseeing", "lat": 38.69, "lng": -9.21}],
+    }).get_json()
+    db.session.add(Photo(trip_id=created["id"], url="https://example.com/lisbon.jpg"))
+    db.session.commit()
+
+    single = client.get(f"/trips/{created['id']}").get_json()
+    listed = client.get("/trips/?expand=activities,photos").get_json()[0]
+    orm = db_manager.get_trip_by_id(created["id"]).to_dict()
+    assert single == listed == orm
+    assert {**single, "photos": []} == created
+    assert single["activities"][0]["lat"] == 38.69
+
+
+def test_row_serializer_matches_instance_serializer(app, db_manager):
+    user = db_manager.add_user("rows", "rows@example.com", "secret")
+    row = db.session.execute(db.select(*serializers.columns(type(user), "user"))).one()
+    assert serializers.row_serializer("user")(row) == user.to_dict()
+    assert serializers.row_serializer("trip", ("id", "start_date"))((1, date(2024, 1, 2))) == \
+        {"id": 1, "start_date": "2024-01-02"}
+
+
+def test_orjson_provider_matches_default_provider(app):
+    value = {"b": [1, 2.5, None, True], "a": {"when": datetime(2024, 1, 2, 3, 4, 5)}, "ü": "ñ"}
+    fast, default = OrjsonProvider(app), DefaultJSONProvider(app)
+    assert fast.loads(fast.dumps(value)) == default.loads(default.dumps(value))
+    assert fast.dumps(value) == default.dumps(value, separators=(",", ":"), ensure_ascii=False)
@@ -1,16 +1,11 @@
-import pytest
-from backend import app
-from backend.datamanager.sqllite_data_manager import db
+from flask_jwt_extended import create_access_token
 
+from datamanager.data_models import db, Photo, ResourceRevision
+from utils.pagination import encode_cursor
 
-@pytest.fixture
-def client():
-    app.config['TESTING'] = True
-    with app.test_client() as client:
-        yield client
 
 def test_add_trip_success(client):
-    response = client.post('/add_trip', json={
+    response = client.post('/trips/add_trip', json={
         "title": "Test Trip",
         "user_id": 1,
         "country": "France",
@@ -31,3 +26,316 @@ def test_add_trip_success(client):
     assert response.status_code == 201
     data = response.get_json()
     assert data["title"] == "Test Trip"
+
+
+def _seed_trips(db_manager, user_id, count):
+    for i in range(count):
+        trip = db_manager.add_trip({
+            "title": f"Trip {i}",
+            "user_id": user_id,
+            "country": "Japan",
+            "city": "Osaka",
+            "start_date": "2024-04-01",
+            "end_date": "2024-04-10",
+            "activities": [
+                {"name": "Ramen", "type": "restaurant"},
+                {"name": "Castle", "type": "sightseeing"},
+            ],
+        })
+        db.session.add(Photo(trip_id=trip.id, url=f"https://example.com/{i}.jpg"))
+    db.session.commit()
+
+
+def _count_queries(client, query_counter, url, headers=None):
+    query_counter.clear()
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return len(query_counter), response.get_json()
+
+
+def test_trip_listings_use_constant_query_count(client, db_manager, query_counter):
+    user_id = db_manager.add_user("traveller", "traveller@example.com", "secret").id
+    headers = {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+
+    _seed_trips(db_manager, user_id, 2)
+    few_all, _ = _count_queries(client, query_counter, "/trips/")
+    few_user, _ = _count_queries(client, query_counter, f"/trips/user/{user_id}", headers)
+
+    _seed_trips(db_manager, user_id, 20)
+    many_all, trips = _count_queries(client, query_counter, "/trips/")
+    many_user, user_trips = _count_queries(client, query_counter, f"/trips/user/{user_id}", headers)
+
+    assert len(trips) == 22
+    assert all(len(trip["activities"]) == 2 for trip in trips)
+    assert all(len(trip["photos"]) == 1 for trip in user_trips)
+    assert many_all == few_all
+    assert many_user == few_user
+
+
+def _walk_pages(client, url):
+    pages, cursor = [], None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        pages.append(response.get_json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_trip_keyset_pagination(client, db_manager):
+    for day in (5, 1, 3, 1, 2):
+        db_manager.add_trip({
+            "title": f"Day {day}", "user_id": 1, "country": "Italy",
+            "start_date": f"2024-05-0{day}", "end_date": "2024-05-10",
+        })
+
+    pages = _walk_pages(client, "/trips/?limit=2")
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [t["id"] for page in pages for t in page] == [1, 2, 3, 4, 5]
+
+    pages = _walk_pages(client, "/trips/?limit=2&sort=start_date")
+    ordered = [(t["start_date"], t["id"]) for page in pages for t in page]
+    assert ordered == sorted(ordered)
+    assert len(ordered) == 5
+
+
+def test_trip_pagination_rejects_bad_parameters(client):
+    assert client.get("/trips/?limit=0").status_code == 400
+    assert client.get("/trips/?cursor=not-a-cursor").status_code == 400
+    for values in ([{"a": 1}], [], ["x"], [None], [[1]]):
+        cursor = encode_cursor(values)
+        for path in ("/trips/", "/activities/", "/photos/", "/users/"):
+            response = client.get(f"{path}?limit=1&cursor={cursor}")
+            assert (response.status_code, response.get_json()) == (400, {"error": "Invalid cursor"})
+    assert client.get("/trips/?sort=title").status_code == 400
+
+
+def test_trips_stream_matches_list(client, db_manager):
+    _seed_trips(db_manager, 1, 3)
+    streamed = client.get("/trips/?stream=1")
+    assert streamed.is_streamed
+    assert streamed.get_json() == client.get("/trips/").get_json()
+
+
+def _add_pinned_trip(db_manager, title, lat, lng):
+    return db_manager.add_trip({
+        "title": title, "user_id": 1, "country": "Somewhere",
+        "start_date": "2024-01-01", "end_date": "2024-01-02", "lat": lat, "lng": lng,
+    }).id
+
+
+def _titles_within(client, bbox):
+    response = client.get(f"/trips/within?bbox={bbox}")
+    assert response.status_code == 200
+    return sorted(trip["title"] for trip in response.get_json())
+
+
+def test_trips_within_bbox_follows_writes(client, db_manager):
+    osaka = _add_pinned_trip(db_manager, "Osaka", 34.69, 135.50)
+    _add_pinned_trip(db_manager, "Kyoto", 35.01, 135.77)
+    _add_pinned_trip(db_manager, "Fiji", -17.7, 179.9)
+    _add_pinned_trip(db_manager, "Samoa", -13.8, -172.1)
+    _add_pinned_trip(db_manager, "Nowhere", None, None)
+
+    assert _titles_within(client, "135.3,34.5,135.7,34.8") == ["Osaka"]
+    assert _titles_within(client, "135,34,136,36") == ["Kyoto", "Osaka"]
+    assert _titles_within(client, "170,-20,-170,-10") == ["Fiji", "Samoa"]
+
+    client.put(f"/trips/{osaka}", json={"lat": 48.85, "lng": 2.35})
+    assert _titles_within(client, "135,34,136,36") == ["Kyoto"]
+    assert _titles_within(client, "2,48,3,49") == ["Osaka"]
+
+    db_manager.delete_trip(osaka)
+    assert _titles_within(client, "2,48,3,49") == []
+
+
+def test_trips_within_rejects_bad_bbox(client):
+    assert client.get("/trips/within").status_code == 400
+    assert client.get("/trips/within?bbox=1,2,3").status_code == 400
+    assert client.get("/trips/within?bbox=0,10,1,5").status_code == 400
+
+
+def test_trip_etag_answers_304_until_a_write(client, db_manager, query_counter):
+    user_id = db_manager.add_user("poller", "poller@example.com", "secret").id
+    headers = {"Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}
+    _seed_trips(db_manager, user_id, 1)
+    trip_id = db_manager.get_trips()[0]["id"]
+
+    for url, extra in ((f"/trips/{trip_id}", {}), (f"/trips/user/{user_id}", headers)):
+        first = client.get(url, headers=extra)
+        etag = first.headers["ETag"]
+        assert first.status_code == 200 and not etag.startswith("W/")
+
+        query_counter.clear()
+        repeat = client.get(url, headers={**extra, "If-None-Match": etag})
+        assert repeat.status_code == 304
+        assert repeat.headers["ETag"] == etag
+        assert len([q for q in query_counter if "trips" in q or "activities" in q]) == 0
+
+    trip_etag = client.get(f"/trips/{trip_id}").headers["ETag"]
+    user_etag = client.get(f"/trips/user/{user_id}", headers=headers).headers["ETag"]
+    activity_id = client.get(f"/trips/{trip_id}").get_json()["activities"][0]["id"]
+    db_manager.update_activity(activity_id, {"notes": "Go early"})
+
+    for url, extra, etag in ((f"/trips/{trip_id}", {}, trip_etag),
+                             (f"/trips/user/{user_id}", headers, user_etag)):
+        changed = client.get(url, headers={**extra, "If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+
+
+def test_trip_fieldsets_skip_unrequested_columns_and_relationships(client, db_manager, query_counter):
+    user_id = db_manager.add_user("mapper", "mapper@example.com", "secret").id
+    _seed_trips(db_manager, user_id, 3)
+
+    query_counter.clear()
+    response = client.get("/trips/?fields=title,start_date,lat,lng&expand=")
+    assert response.status_code == 200
+    assert response.get_json()[0] == {"id": 1, "title": "Trip 0", "start_date": "2024-04-01",
+                                      "lat": None, "lng": None}
+    trip_queries = [q for q in query_counter if "FROM trips" in q]
+    assert len(trip_queries) == 1 and "description" not in trip_queries[0]
+    assert not any("FROM activities" in q or "FROM photos" in q for q in query_counter)
+
+    trip = client.get("/trips/1?fields=title&expand=photos").get_json()
+    assert set(trip) == {"id", "title", "photos"}
+    assert client.get("/trips/?fields=password").status_code == 400
+    assert client.get("/trips/?expand=owner").status_code == 400
+
+
+def test_etags_do_not_vouch_for_missing_trips_activities_or_photos(client, db_manager):
+    for kind, url in (("trip", "/trips/999999"), ("activity", "/activities/999999"), ("photo", "/photos/999999")):
+        for guess in ("*", f'"{kind}-999999-r0"'):
+            assert client.get(url, headers={"If-None-Match": guess}).status_code == 404
+
+    _seed_trips(db_manager, 1, 1)
+    # A trip written before revisions were tracked still revalidates under its "-r0" tag.
+    db.session.query(ResourceRevision).delete()
+    db.session.commit()
+    assert client.get("/trips/1", headers={"If-None-Match": "*"}).status_code == 200
+    assert client.get("/trips/1", headers={"If-None-Match": '"trip-1-r0"'}).status_code == 304
+
+
+def test_trip_etag_depends_on_fieldset(client, db_manager):
+    _seed_trips(db_manager, 1, 1)
+    full = client.get("/trips/1").headers["ETag"]
+    sparse = client.get("/trips/1?fields=title").headers["ETag"]
+    assert full != sparse
+    assert client.get("/trips/1?fields=title", headers={"If-None-Match": full}).status_code == 200
+    assert client.get("/trips/1?fields=title", headers={"If-None-Match": sparse}).status_code == 304
+
+
+def _bulk_trip(user_id, title, **extra):
+    return {"title": title, "user_id": user_id, "country": "Japan",
+            "start_date": "2024-04-01", "end_date": "2024-04-03", **extra}
+
+
+def test_bulk_import_writes_valid_trips_and_reports_errors(client, db_manager):
+    user_id = db_manager.add_user("importer", "importer@example.com", "secret").id
+    etag = client.get(f"/trips/user/{user_id}", headers={
+        "Authorization": f"Bearer {create_access_token(identity=str(user_id))}"}).headers["ETag"]
+    response = client.post("/trips/bulk", json=[
+        _bulk_trip(user_id, "Osaka", lat=34.69, lng=135.50,
+                   activities=[{"name": "Umeda Sky", "lat": 34.705, "lng": 135.49}, {"name": "Hotel"}]),
+        _bulk_trip(user_id, "No dates", start_date="April"),
+        _bulk_trip(999, "Nobody"),
+        _bulk_trip(user_id, "Kyoto", lat=35.01, lng=135.77),
+    ])
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["created"] == 2
+    assert [trip["index"] for trip in body["trips"]] == [0, 3]
+    assert [(error["index"], error["error"]) for error in body["errors"]] == [
+        (1, "start_date must be a YYYY-MM-DD date"), (2, "User 999 not found")]
+
+    osaka = client.get(f"/trips/{body['trips'][0]['id']}").get_json()
+    assert [a["name"] for a in osaka["activities"]] == ["Umeda Sky", "Hotel"]
+    assert _titles_within(client, "135.3,34.5,135.9,35.1") == ["Kyoto", "Osaka"]
+    assert client.get("/activities/nearby?lat=34.70&lng=135.49&radius=2").get_json()[0]["name"] == "Umeda Sky"
+    assert client.get("/search?q=umeda").get_json()["results"][0]["title"] == "Umeda Sky"
+    assert client.get("/map/clusters?bbox=-180,-85,180,85&zoom=0").get_json()["clusters"][0]["count"] == 2
+    assert client.get(f"/trips/user/{user_id}", headers={
+        "Authorization": f"Bearer {create_access_token(identity=str(user_id))}",
+        "If-None-Match": etag}).status_code == 200
+
+
+def test_bulk_import_accepts_ndjson(client, db_manager):
+    import json
+    user_id = db_manager.add_user("lines", "lines@example.com", "secret").id
+    lines = [json.dumps(_bulk_trip(user_id, f"Trip {i}")) for i in range(5)] + ["", "{not json"]
+    response = client.post("/trips/bulk", data="\n".join(lines) + "\n",
+                           content_type="application/x-ndjson")
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["created"] == 5 and [error["index"] for error in body["errors"]] == [6]
+    assert client.post("/trips/bulk", json={"title": "not a list"}).status_code == 400
+
+
+def test_bulk_import_rejects_mistyped_fields(client, db_manager):
+    user_id = db_manager.add_user("typed", "typed@example.com", "secret").id
+    response = client.post("/trips/bulk", json=[
+        _bulk_trip(user_id, {"en": "Lisbon"}),
+        _bulk_trip(user_id, "Porto", is_public="false"),
+        _bulk_trip(user_id, "Faro", activities=[{"name": ["beach"]}]),
+        _bulk_trip(user_id, "Braga", is_public=True),
+    ])
+    assert response.status_code == 201
+    assert [trip["index"] for trip in response.get_json()["trips"]] == [3]
+    assert [(error["index"], error["error"]) for error in response.get_json()["errors"]] == [
+        (0, "title must be a string"), (1, "is_public must be true or false"),
+        (2, "activities[0]: name must be a string")]
+
+
+def test_bulk_import_isolates_rows_the_database_rejects(client, db_manager, monkeypatch):
+    user_id = db_manager.add_user("rejected", "rejected@example.com", "secret").id
+    insert_chunk = db_manager._insert_trip_chunk
+
+    def failing_insert(items):
+        if any(trip["title"] == "Broken" for _, trip, _ in items):
+            raise RuntimeError("INSERT INTO trips ... secret parameters")
+        return insert_chunk(items)
+
+    monkeypatch.setattr(db_manager, "_insert_trip_chunk", failing_insert)
+    response = client.post("/trips/bulk", json=[_bulk_trip(user_id, title) for title in ("Bern", "Broken", "Basel")])
+    body = response.get_json()
+    assert body["created"] == 2 and [trip["index"] for trip in body["trips"]] == [0, 2]
+    assert body["errors"] == [{"index": 1, "error": "Trip could not be saved"}]
+
+
+def test_update_trip_diffs_activities_by_id(client, db_manager, query_counter):
+    trip = db_manager.add_trip({
+        "title": "Long trip", "user_id": 1, "country": "Italy",
+        "start_date": "2024-06-01", "end_date": "2024-06-30",
+        "activities": [{"name": f"Stop {i}", "rating": 3} for i in range(100)],
+    })
+    activities = client.get(f"/trips/{trip.id}").get_json()["activities"]
+    activities[10]["rating"] = 5
+
+    query_counter.clear()
+    response = client.put(f"/trips/{trip.id}", json={"activities": activities})
+    assert response.status_code == 200
+    writes = [q for q in query_counter if q.startswith(("INSERT INTO activities", "UPDATE activities", "DELETE FROM activities"))]
+    assert len(writes) == 1 and writes[0].startswith("UPDATE activities")
+    updated = response.get_json()["activities"]
+    assert [a["id"] for a in updated] == [a["id"] for a in activities]
+    assert updated[10]["rating"] == 5
+
+    kept = [a for a in updated if a["id"] != activities[0]["id"]] + [{"name": "Encore"}]
+    result = client.put(f"/trips/{trip.id}", json={"activities": kept}).get_json()["activities"]
+    assert len(result) == 100
+    assert activities[0]["id"] not in {a["id"] for a in result}
+    assert result[-1]["name"] == "Encore" and result[-1]["id"] > activities[-1]["id"]
+
+
+def test_update_trip_removes_dropped_activities_from_the_indexes(client, db_manager):
+    trip = db_manager.add_trip({
+        "title": "Safari", "user_id": 1, "country": "Kenya", "start_date": "2024-02-01", "end_date": "2024-02-10",
+        "activities": [{"name": "Zebra crossing", "lat": -1.29, "lng": 36.82}],
+    })
+    assert client.get("/search?q=zebra").get_json()["results"]
+
+    assert client.put(f"/trips/{trip.id}", json={"activities": []}).status_code == 200
+    assert client.get("/map/clusters?zoom=0&bbox=-180,-85,180,85&kind=activity").get_json()["clusters"] == []
+    assert client.get("/activities/nearby?lat=-1.29&lng=36.82&radius=5").get_json() == []
+    assert client.get("/search?q=zebra").get_json()["results"] == []
@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from datamanager.data_models import db, TokenBlackList, User
+from utils.passwords import HashingBusy, PasswordHasher
+
+
+def test_users_pagination_and_stream(client, db_manager):
+    for i in range(5):
+        db_manager.add_user(f"user{i}", f"user{i}@example.com", "secret")
+
+    first = client.get("/users/?limit=3")
+    assert [u["username"] for u in first.get_json()] == ["user0", "user1", "user2"]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get(f"/users/?limit=3&cursor={cursor}")
+    assert [u["username"] for u in second.get_json()] == ["user3", "user4"]
+    assert "X-Next-Cursor" not in second.headers
+
+    streamed = client.get("/users/?stream=true")
+    assert [u["id"] for u in streamed.get_json()] == [1, 2, 3, 4, 5]
+
+
+def test_logout_revokes_token_and_lookups_skip_the_database(client, db_manager, query_counter):
+    db_manager.add_user("leaver", "leaver@example.com", "secret")
+    token = client.post("/users/login", json={"email": "leaver@example.com", "password": "secret"}) \
+        .get_json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.post("/users/logout", headers=headers).status_code == 200
+    row = TokenBlackList.query.one()
+    assert row.expires_at > datetime.utcnow()
+
+    assert client.get("/users/protected", headers=headers).status_code == 401
+    query_counter.clear()
+    assert not db_manager.is_token_blacklisted("never-revoked")
+    assert not any("token_blacklist" in statement for statement in query_counter)
+
+
+def test_purge_drops_expired_revocations(app, db_manager):
+    now = datetime.utcnow()
+    db_manager.blacklist_token("expired", now - timedelta(minutes=1))
+    db_manager.blacklist_token("live", now + timedelta(hours=1))
+    db_manager.blacklist_token("legacy-old")
+    TokenBlackList.query.filter_by(jti="legacy-old").update({"created_at": now - timedelta(days=60)})
+    db.session.commit()
+
+    assert db_manager.purge_revoked_tokens() == 2
+    assert [row.jti for row in TokenBlackList.query] == ["live"]
+    assert db_manager.is_token_blacklisted("live")
+    assert not db_manager.is_token_blacklisted("expired")
+
+
+def test_refresh_picks_up_revocations_committed_out_of_order(app, db_manager):
+    now = datetime.utcnow()
+    db.session.add(TokenBlackList(id=10, jti="other-worker-late", created_at=now))
+    db.session.commit()
+    db_manager._refresh_revocations()
+
+    # Given an earlier id and time than the row already seen, but committed after the last refresh.
+    db.session.add(TokenBlackList(id=5, jti="other-worker-early", created_at=now - timedelta(seconds=10)))
+    db.session.commit()
+    db_manager._refresh_revocations()
+    assert db_manager.revocations.is_revoked("other-worker-early", lambda jti: False)
+
+
+def test_revocations_are_purged_and_reloaded_on_a_timer_thread(app, db_manager, monkeypatch):
+    monkeypatch.setattr(db_manager, "revocation_refresh", 0.01)
+    monkeypatch.setattr(db_manager, "revocation_purge", 0)
+    db.session.add(TokenBlackList(jti="other-worker", created_at=datetime.utcnow()))
+    db.session.add(TokenBlackList(jti="expired", expires_at=datetime.utcnow() - timedelta(minutes=1)))
+    db.session.commit()
+
+    db_manager.start_revocation_refresh()
+    try:
+        deadline = time.monotonic() + 5
+        # Only the in-memory cache is consulted here; the thread does all the reading and writing.
+        while not db_manager.revocations.is_revoked("other-worker", lambda jti: False):
+            assert time.monotonic() < deadline, "the blacklist was never reloaded"
+            time.sleep(0.01)
+    finally:
+        db_manager.stop_revocation_refresh()
+    assert [row.jti for row in TokenBlackList.query] == ["other-worker"]
+
+
+def test_login_rehashes_when_hash_parameters_change(client, db_manager):
+    user = db_manager.add_user("rehash", "rehash@example.com", "secret")
+    assert user.password_hash.startswith("scrypt:")
+    previous = db_manager.passwords
+    db_manager.passwords = PasswordHasher("pbkdf2:sha256:1000", workers=1)
+    try:
+        login = {"email": "rehash@example.com", "password": "secret"}
+        assert client.post("/users/login", json=login).status_code == 200
+        assert db.session.get(User, user.id).password_hash.startswith("pbkdf2:sha256:1000$")
+        assert client.post("/users/login", json=login).status_code == 200
+        assert client.post("/users/login", json={**login, "password": "wrong"}).status_code == 401
+    finally:
+        db_manager.passwords = previous
+
+
+def test_login_succeeds_when_the_rehash_is_turned_away(client, db_manager, monkeypatch):
+    user = db_manager.add_user("rehash-busy", "rehash-busy@example.com", "secret")
+    previous = db_manager.passwords
+    db_manager.passwords = PasswordHasher("pbkdf2:sha256:1000", workers=1)
+
+    def busy(password):
+        raise HashingBusy()
+
+    monkeypatch.setattr(db_manager.passwords, "hash", busy)
+    try:
+        login = {"email": "rehash-busy@example.com", "password": "secret"}
+        assert client.post("/users/login", json=login).status_code == 200
+        assert db.session.get(User, user.id).password_hash.startswith("scrypt:")
+    finally:
+        db_manager.passwords = previous
+
+
+def test_login_answers_503_when_hashing_queue_is_full(client, db_manager):
+    db_manager.add_user("busy", "busy@example.com", "secret")
+    previous = db_manager.passwords
+    db_manager.passwords = PasswordHasher(workers=1, max_pending=1)
+    started, release = threading.Event(), threading.Event()
+
+    def hold_the_only_slot():
+        started.set()
+        release.wait()
+
+    blocker = threading.Thread(target=db_manager.passwords.run, args=(hold_the_only_slot,))
+    blocker.start()
+    try:
+        assert started.wait(timeout=5)
+        response = client.post("/users/login", json={"email": "busy@example.com", "password": "secret"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        release.set()
+        blocker.join()
+        db_manager.passwords = previous
+    assert client.post("/users/login", json={"email": "busy@example.com", "password": "secret"}).status_code == 200
@@ -0,0 +1,155 @@
+"""Structured access log: one JSON line per request, written off the request thread.
+
+Requests only put a record on a bounded queue; a ``QueueListener`` thread formats and writes
+it, so workers never wait on stdout. When the queue is full, records are dropped and counted
+rather than blocking. Records go to stdout, or to ``ACCESS_LOG_FILE`` when it is set.
+
+``ACCESS_LOG_SAMPLE_RATE`` logs that fraction of requests, but errors and requests slower than
+``ACCESS_LOG_SLOW_MS`` are always logged. Credentials are never written: no request headers are
+logged except the user agent and origin, and query parameters that look like secrets are
+redacted.
+
+Each record carries the total time plus the time spent in SQL and in photo storage calls, as
+measured by ``utils.timing``; ``timed`` adds blocks of work such as parallel uploads.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import parse_qsl, urlencode
+
+from flask import g, has_app_context, request
+
+from utils import timing
+
+SENSITIVE_PARAMS = ("token", "password", "secret", "key", "signature", "code", "jwt", "auth")
+REDACTED = "[redacted]"
+
+
+@contextmanager
+def timed(kind):
+    """Add the time spent in the block to the current request's ``kind`` time."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.get("timings") if has_app_context() else None
+        if timings is not None:
+            timings[kind] = timings.get(kind, 0.0) + time.perf_counter() - start
+
+
+def _record_query(statement, parameters, seconds):
+    timings = g.get("timings") if has_app_context() else None
+    if timings is not None:
+        timings["db"] = timings.get("db", 0.0) + seconds
+        timings["queries"] = timings.get("queries", 0) + 1
+
+
+def _record_storage_call(backend, operation, outcome, seconds):
+    timings = g.get("timings") if has_app_context() else None
+    if timings is not None:
+        timings["storage"] = timings.get("storage", 0.0) + seconds
+
+
+def redact_query(query_string):
+    """The query string with the values of secret-looking parameters replaced."""
+    if not query_string:
+        return ""
+    pairs = parse_qsl(query_string, keep_blank_values=True)
+    return urlencode([(name, REDACTED if any(word in name.lower() for word in SENSITIVE_PARAMS) else value)
+                      for name, value in pairs])
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, separators=(",", ":"), default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks: a record that does not fit in the queue is counted in ``dropped`` instead."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # the message is already a dict; formatting happens on the listener thread
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog:
+    def __init__(self, app=None, stream=None):
+        self.stream = stream
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sample_rate = app.config.get("ACCESS_LOG_SAMPLE_RATE", 1.0)
+        self.slow_ms = app.config.get("ACCESS_LOG_SLOW_MS", 1000)
+        self.queue = queue.Queue(app.config.get("ACCESS_LOG_QUEUE_SIZE", 10000))
+        self.handler = DroppingQueueHandler(self.queue)
+        path = app.config.get("ACCESS_LOG_FILE")
+        output = logging.FileHandler(path) if path else logging.StreamHandler(self.stream or sys.stdout)
+        output.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, output)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+        timing.on_query(_record_query)
+        timing.on_storage_call(_record_storage_call)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions["access_log"] = self
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        self.queue.join()
+
+    def _start(self):
+        g.request_start = time.perf_counter()
+        g.timings = {}
+
+    def _finish(self, response):
+        start, timings = g.get("request_start"), g.get("timings")
+        if start is None:
+            return response
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "method": request.method,
+            "path": request.path,
+            "query": redact_query(request.query_string.decode("latin-1")),
+            "status": response.status_code,
+            "bytes": response.content_length,
+            "remote_addr": request.remote_addr,
+            "origin": request.headers.get("Origin"),
+            "user_agent": request.headers.get("User-Agent"),
+        }
+
+        def log():
+            duration_ms = (time.perf_counter() - start) * 1000
+            if (response.status_code < 500 and duration_ms < self.slow_ms
+                    and random.random() >= self.sample_rate):
+                return
+            entry.update({
+                "duration_ms": round(duration_ms, 2),
+                "db_ms": round(timings.get("db", 0.0) * 1000, 2),
+                "db_queries": timings.get("queries", 0),
+                "storage_ms": round(timings.get("storage", 0.0) * 1000, 2),
+            })
+            self.handler.handle(logging.makeLogRecord(
+                {"name": "pintrail.access", "levelno": logging.INFO, "levelname": "INFO", "msg": entry}))
+
+        # After the body has been sent, so streamed responses are timed in full.
+        response.call_on_close(log)
+        return response
@@ -0,0 +1,234 @@
+"""Serving the Flask app from an ASGI server, with slow clients kept off the worker threads.
+
+Under a threaded WSGI server every connection holds a thread for as long as its client takes
+to send the request body and to read the response. Here the event loop does that waiting: the
+body is read into a spooled temporary file before the app runs on a small thread pool, and the
+app's response is appended to another spooled file that the loop sends from as it grows. So a
+streamed response goes out while the app is still producing it, yet a worker thread never waits
+for a slow reader: a thread is busy only while the app itself works, and a large response that
+the client reads slowly waits on disk rather than in memory.
+"""
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+# Bodies and responses up to this size stay in memory; larger ones spill to a temporary file.
+SPOOL_MEMORY_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class AsgiAdapter:
+    """An ASGI application running the WSGI app ``wsgi_app`` on ``threads`` worker threads."""
+
+    def __init__(self, wsgi_app, threads=16, max_body_size=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+        with SpooledTemporaryFile(SPOOL_MEMORY_SIZE) as body:
+            try:
+                size = await self._read_body(scope, receive, body)
+            except ClientDisconnected:
+                return
+            if size is None:
+                return await self._respond(send, 413, b"Request body too large")
+            body.seek(0)
+            loop = asyncio.get_running_loop()
+            with ResponsePipe(loop) as pipe:
+                app = loop.run_in_executor(self.executor, self._run, scope, body, size, pipe)
+                try:
+                    if await pipe.wait_started():
+                        await send({"type": "http.response.start", "status": pipe.status, "headers": pipe.headers})
+                        async for chunk in pipe.chunks():
+                            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                        if pipe.error is None:
+                            await send({"type": "http.response.body"})
+                finally:
+                    # Raises what the app raised: a 500 before the response started, a cut-off one after.
+                    await app
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, scope, receive, body):
+        """Read the request body into ``body``; returns its size, or None once it exceeds the limit."""
+        limit = self.max_body_size
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length" and limit is not None and value.isdigit() and int(value) > limit:
+                return None
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if limit is not None and size > limit:
+                return None
+            body.write(chunk)
+            if not message.get("more_body"):
+                return size
+
+    async def _respond(self, send, status, text):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(text)).encode())]})
+        await send({"type": "http.response.body", "body": text})
+
+    def _run(self, scope, body, size, pipe):
+        """Run the WSGI app on a worker thread, handing its response to ``pipe`` as it is produced."""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and pipe.status is not None:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return write
+
+        def write(chunk):
+            if chunk:
+                if pipe.status is None:
+                    pipe.start(response["status"], response["headers"])
+                pipe.write(chunk)
+
+        try:
+            result = self.wsgi_app(environ(scope, body, size), start_response)
+            try:
+                for chunk in result:
+                    write(chunk)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            if pipe.status is None:
+                pipe.start(response["status"], response["headers"])
+        except BaseException as e:
+            pipe.finish(e)
+            raise
+        pipe.finish()
+
+
+class ResponsePipe:
+    """A response passed from the worker thread that produces it to the event loop that sends it.
+
+    The thread appends to a spooled file and never waits; the loop sends whatever has arrived.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.file = SpooledTemporaryFile(SPOOL_MEMORY_SIZE)
+        self.lock = threading.Lock()
+        self.changed = asyncio.Event()
+        self.status = self.headers = None
+        self.size = 0
+        self.done = False
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    # Called on the worker thread.
+
+    def start(self, status, headers):
+        self.headers, self.status = headers, status
+        self._notify()
+
+    def write(self, chunk):
+        with self.lock:
+            self.file.seek(0, 2)
+            self.file.write(chunk)
+            self.size += len(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        self.error, self.done = error, True
+        self._notify()
+
+    def _notify(self):
+        self.loop.call_soon_threadsafe(self.changed.set)
+
+    # Called on the event loop.
+
+    async def wait_started(self):
+        """Wait for the status and headers; False if the app failed before giving them."""
+        while self.status is None and not self.done:
+            await self.changed.wait()
+            self.changed.clear()
+        return self.status is not None
+
+    async def chunks(self):
+        """Yield the body as it is written, until the app has finished."""
+        sent = 0
+        while True:
+            # ``done`` is read before ``size``, so everything written before the end is sent.
+            done, size = self.done, self.size
+            while sent < size:
+                with self.lock:
+                    self.file.seek(sent)
+                    chunk = self.file.read(min(CHUNK_SIZE, size - sent))
+                sent += len(chunk)
+                yield chunk
+            if done:
+                return
+            await self.changed.wait()
+            self.changed.clear()
+
+
+def environ(scope, body, size):
+    """The WSGI environ for an ASGI HTTP ``scope`` whose body, ``size`` bytes, is in ``body``."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "CONTENT_LENGTH": str(size),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        env["REMOTE_ADDR"], env["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", ()):
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-length":
+            continue
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        if key in env:
+            value = env[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+        env[key] = value
+    return env
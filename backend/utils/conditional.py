@@ -0,0 +1,35 @@
+import hashlib
+
+from flask import current_app, request
+
+
+def is_fresh(etag):
+    """True when the request's If-None-Match names ``etag`` itself.
+
+    ``*`` is not taken as a match: the routes ask before loading anything, so they cannot tell
+    whether the resource exists. A None ``etag`` (nothing to tag) is never fresh.
+    """
+    if etag is None:
+        return False
+    tags = request.if_none_match
+    return tags.is_strong(etag) or tags.is_weak(etag)
+
+
+def tag_response(response, etag):
+    """Attach ``etag`` when there is one and make caches revalidate before reusing the response."""
+    if etag is not None:
+        response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag):
+    return tag_response(current_app.response_class(status=304), etag)
+
+
+def variant_etag(etag, *parts):
+    """Derive the ETag of one representation of a resource, e.g. a sparse fieldset of it."""
+    if etag is None or all(part is None for part in parts):
+        return etag
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:10]
+    return f"{etag}-{digest}"
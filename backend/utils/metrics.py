@@ -0,0 +1,252 @@
+"""Request, SQL and storage metrics, served in the Prometheus text format at /metrics.
+
+Counters and histograms are plain dicts behind one lock, so recording one is a dict update.
+Each worker process only sees its own requests: with several workers (gunicorn -w, uvicorn
+--workers), set ``METRICS_DIR`` to a directory they share. Every process then writes its totals
+there every ``METRICS_FLUSH_SECONDS`` from a background thread, and /metrics adds up all the
+files. Files of workers that have exited are kept, so their counts stay in the totals.
+
+SQL statements are attributed to the data manager method they ran in, through ``instrument``;
+statements outside any method are counted under "other". Statement and storage call times come
+from ``utils.timing``.
+"""
+import atexit
+import bisect
+import functools
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import g, request
+
+from utils import timing
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_SECONDS = 5
+
+METRICS = {
+    "pintrail_http_requests_total": ("counter", "HTTP requests by route, method and status."),
+    "pintrail_http_request_errors_total": ("counter", "HTTP requests answered with a 5xx status."),
+    "pintrail_http_request_duration_seconds": ("histogram", "Time to serve a request, body included."),
+    "pintrail_db_queries_total": ("counter", "SQL statements by data manager method."),
+    "pintrail_db_query_duration_seconds": ("histogram", "SQL statement time by data manager method."),
+    "pintrail_storage_requests_total": ("counter", "Photo storage calls by backend, operation and outcome."),
+    "pintrail_storage_duration_seconds": ("histogram", "Photo storage call time by backend and operation."),
+}
+
+_db_method = ContextVar("db_method", default=None)
+
+
+def instrument(cls):
+    """Attribute the SQL run inside each public method of ``cls`` to that method.
+
+    Only the outermost call counts, so a query is charged to the method the route called.
+    """
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(method):
+            continue
+        setattr(cls, name, (_wrap_generator if inspect.isgeneratorfunction(method) else _wrap)(name, method))
+    return cls
+
+
+def _wrap(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if _db_method.get() is not None:
+            return method(*args, **kwargs)
+        token = _db_method.set(name)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _db_method.reset(token)
+    return wrapper
+
+
+def _wrap_generator(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        items = method(*args, **kwargs)
+        while True:
+            token = _db_method.set(_db_method.get() or name)
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                _db_method.reset(token)
+            yield item
+    return wrapper
+
+
+def _key(labels):
+    return tuple(sorted(labels.items())) if isinstance(labels, dict) else tuple(labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> per-bucket counts (the last one is +Inf), then the sum and the count
+        self.histograms = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get("METRICS_DIR")
+        self.flush_interval = app.config.get("METRICS_FLUSH_SECONDS", FLUSH_SECONDS)
+        self.pid = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+        timing.on_query(self._record_query)
+        timing.on_storage_call(self._record_storage_call)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions["metrics"] = self
+
+    def inc(self, name, labels, amount=1):
+        key = (name, _key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        key = (name, _key(labels))
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            values[index] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def _record_query(self, statement, parameters, seconds):
+        labels = (("method", _db_method.get() or "other"),)
+        self.inc("pintrail_db_queries_total", labels)
+        self.observe("pintrail_db_query_duration_seconds", labels, seconds)
+
+    def _record_storage_call(self, backend, operation, outcome, seconds):
+        labels = {"backend": backend, "operation": operation}
+        self.observe("pintrail_storage_duration_seconds", labels, seconds)
+        self.inc("pintrail_storage_requests_total", {**labels, "outcome": outcome})
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(labels), list(values)]
+                               for (name, labels), values in self.histograms.items()],
+            }
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def _start_flushing(self):
+        """Start the flush thread in this process, dropping counts inherited from a forking parent."""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.counters, self.histograms = {}, {}
+            self.pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+
+    def flush(self):
+        """Write this process's totals to ``METRICS_DIR``."""
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+        with os.fdopen(fd, "w") as out:
+            json.dump(self.snapshot(), out)
+        os.replace(temporary, self.path)
+
+    def _flush_periodically(self):
+        while self.pid == os.getpid():
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        """The totals of every process: this one's live values plus the files of the others."""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            for filename in os.listdir(self.directory):
+                path = os.path.join(self.directory, filename)
+                if filename.endswith(".json") and path != self.path:
+                    try:
+                        with open(path) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue  # being replaced or unreadable; picked up on the next scrape
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return counters, histograms
+
+    def render(self):
+        """The Prometheus text exposition of every metric."""
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), values):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(values[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def _start(self):
+        if self.directory and self.pid != os.getpid():
+            self._start_flushing()
+        g.metrics_start = time.perf_counter()
+
+    def _finish(self, response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        labels = {"method": request.method, "route": route}
+        status = response.status_code
+
+        def record():
+            self.observe("pintrail_http_request_duration_seconds", labels, time.perf_counter() - start)
+            self.inc("pintrail_http_requests_total", {**labels, "status": str(status)})
+            if status >= 500:
+                self.inc("pintrail_http_request_errors_total", labels)
+
+        response.call_on_close(record)
+        return response
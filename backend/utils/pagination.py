@@ -0,0 +1,83 @@
+import base64
+import json
+
+from flask import current_app
+
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+class Page(list):
+    """A list of results that also carries the cursor of the next page (None on the last page)."""
+
+    def __init__(self, items, next_cursor=None):
+        super().__init__(items)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=lambda value: value.isoformat())
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The keyset values of a cursor: scalars ending with the row id, which is returned as an int."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or not values:
+            raise ValueError
+        if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+            raise ValueError
+        values[-1] = int(values[-1])
+    except (ValueError, TypeError, OverflowError):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_limit(args, maximum=MAX_PAGE_SIZE):
+    """Read the ``limit`` query parameter, or None when absent; raises ValueError on bad input."""
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if not 1 <= limit <= maximum:
+            raise ValueError(f"limit must be between 1 and {maximum}")
+    return limit
+
+
+def parse_page_args(args):
+    """Read ``limit`` and ``cursor`` query parameters; raises ValueError on bad input."""
+    limit = parse_limit(args)
+    cursor = args.get("cursor")
+    after = decode_cursor(cursor) if cursor else None
+    return limit, after
+
+
+def wants_stream(args):
+    return args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def page_headers(page):
+    if getattr(page, "next_cursor", None):
+        return {"X-Next-Cursor": page.next_cursor}
+    return {}
+
+
+def stream_json_array(items, serialize=lambda item: item, batch_size=STREAM_BATCH_SIZE):
+    """Yield a JSON array in chunks of ``batch_size`` items so the whole list is never built in memory."""
+    dumps = current_app.json.dumps
+    yield "["
+    batch = []
+    first = True
+    for item in items:
+        batch.append(dumps(serialize(item)))
+        if len(batch) >= batch_size:
+            yield ("" if first else ",") + ",".join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ("" if first else ",") + ",".join(batch)
+    yield "]"
@@ -0,0 +1,58 @@
+"""Password hashing on a bounded worker pool.
+
+Hashing is deliberately slow, so it runs on a fixed number of threads (hashlib's scrypt and
+PBKDF2 release the GIL) rather than in every request thread at once, and requests beyond the
+pool's queue limit are turned away with ``HashingBusy`` instead of piling up behind it.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full; the request should be retried later."""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Too many password checks in progress, try again shortly")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Hash and check passwords on ``workers`` threads with at most ``max_pending`` jobs admitted.
+
+    ``method`` is any werkzeug hash method, e.g. ``"scrypt:32768:8:1"`` or
+    ``"pbkdf2:sha256:600000"``; the default is werkzeug's.
+    """
+
+    def __init__(self, method=None, workers=None, max_pending=None, retry_after=1):
+        workers = workers or os.cpu_count() or 1
+        self.method = method or "scrypt"
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * workers)
+        # The parameters as written into hashes, e.g. "pbkdf2" expands to "pbkdf2:sha256:<iterations>".
+        self.scheme = generate_password_hash("", self.method).split("$", 1)[0]
+
+    def run(self, fn, *args):
+        """Run ``fn(*args)`` on the pool and wait for it, or raise ``HashingBusy`` if the queue is full."""
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy(self.retry_after)
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when ``password_hash`` was made with other parameters than the configured ones."""
+        return password_hash.split("$", 1)[0] != self.scheme
@@ -0,0 +1,137 @@
+"""Counting the SQL statements of a request, to catch N+1 queries before they ship.
+
+``recording()`` collects every statement run in its block on this thread, with its
+parameters and duration. Statements are grouped by shape: the SQL text with expanded
+``IN (?, ?, ...)`` lists collapsed, so the same query for different ids counts as one shape.
+
+With ``QUERY_PROFILER`` set, every request is recorded: the response carries an
+``X-Query-Count`` header, and a warning is logged for each shape run ``QUERY_REPEAT_LIMIT``
+times or more (the mark of a per-row query inside a loop) and for each statement slower than
+``QUERY_SLOW_MS``, with its parameters. Tests use ``budget`` to fail when a block runs more
+statements than declared or repeats a shape.
+"""
+import logging
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+
+from utils import timing
+
+logger = logging.getLogger(__name__)
+
+REPEAT_LIMIT = 3
+SLOW_MS = 100
+MAX_PARAMETERS_LENGTH = 500
+
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)+\s*\)")
+_recordings = ContextVar("query_recordings", default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def shape(statement):
+    return _IN_LIST.sub("(?)", " ".join(statement.split()))
+
+
+class QueryLog:
+    """The statements run while recording, as ``(statement, parameters, seconds)``."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def repeated(self, limit=REPEAT_LIMIT):
+        """``(shape, times)`` of every shape run at least ``limit`` times, most repeated first."""
+        counts = Counter(shape(statement) for statement, _, _ in self.statements)
+        return [(query, times) for query, times in counts.most_common() if times >= limit]
+
+    def slow(self, slow_ms=SLOW_MS):
+        return [(statement, parameters, seconds) for statement, parameters, seconds in self.statements
+                if seconds * 1000 >= slow_ms]
+
+    def describe(self):
+        return "\n".join(f"  {seconds * 1000:7.2f} ms  {shape(statement)}"
+                         for statement, _, seconds in self.statements)
+
+
+def _record_query(statement, parameters, seconds):
+    entry = (statement, parameters, seconds)
+    for log in _recordings.get():
+        log.statements.append(entry)
+
+
+def start():
+    """Start recording on this thread; pass the returned log to ``stop``."""
+    timing.on_query(_record_query)
+    log = QueryLog()
+    _recordings.set(_recordings.get() + (log,))
+    return log
+
+
+def stop(log):
+    _recordings.set(tuple(active for active in _recordings.get() if active is not log))
+
+
+@contextmanager
+def recording():
+    log = start()
+    try:
+        yield log
+    finally:
+        stop(log)
+
+
+@contextmanager
+def budget(max_queries, repeat_limit=REPEAT_LIMIT):
+    """Fail with ``QueryBudgetExceeded`` when the block runs more than ``max_queries`` statements
+    or any statement shape ``repeat_limit`` times or more."""
+    with recording() as log:
+        yield log
+    problems = []
+    if len(log) > max_queries:
+        problems.append(f"{len(log)} queries, the budget is {max_queries}")
+    problems += [f"{times} runs of: {query}" for query, times in log.repeated(repeat_limit)]
+    if problems:
+        raise QueryBudgetExceeded("\n".join(problems) + "\nStatements:\n" + log.describe())
+
+
+class QueryProfiler:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.repeat_limit = app.config.get("QUERY_REPEAT_LIMIT", REPEAT_LIMIT)
+        self.slow_ms = app.config.get("QUERY_SLOW_MS", SLOW_MS)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.extensions["query_profiler"] = self
+
+    def _start(self):
+        g.query_log = start()
+
+    def _finish(self, response):
+        log = g.get("query_log")
+        if log is None:
+            return response
+        response.headers["X-Query-Count"] = str(len(log))
+        for query, times in log.repeated(self.repeat_limit):
+            logger.warning("Possible N+1 in %s %s: %d runs of %s", request.method, request.path, times, query)
+        for statement, parameters, seconds in log.slow(self.slow_ms):
+            logger.warning("Slow query in %s %s (%.1f ms): %s; parameters %s", request.method, request.path,
+                           seconds * 1000, shape(statement), repr(parameters)[:MAX_PARAMETERS_LENGTH])
+        return response
+
+    def _teardown(self, exc):
+        log = g.pop("query_log", None)
+        if log is not None:
+            stop(log)
+
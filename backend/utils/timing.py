@@ -0,0 +1,58 @@
+"""SQL statement and storage call timing, measured once and shared by every consumer.
+
+One pair of cursor events on every engine times each statement, and ``storage_call`` times each
+photo storage call. The access log, the metrics and the query profiler register with
+``on_query`` and ``on_storage_call`` to receive those timings instead of each keeping their
+own timers, so a statement costs one pair of clock reads however many of them are enabled.
+"""
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_query_listeners = []
+_storage_listeners = []
+
+
+def on_query(listener):
+    """Call ``listener(statement, parameters, seconds)`` after every SQL statement, on its thread."""
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    return listener
+
+
+def on_storage_call(listener):
+    """Call ``listener(backend, operation, outcome, seconds)`` after every ``storage_call``."""
+    if listener not in _storage_listeners:
+        _storage_listeners.append(listener)
+    return listener
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    seconds = time.perf_counter() - starts.pop()
+    for listener in _query_listeners:
+        listener(statement, parameters, seconds)
+
+
+def storage_call(backend, operation, fn, *args):
+    """Call ``fn(*args)`` as a ``backend`` storage ``operation``, reporting its time and outcome."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = fn(*args)
+        outcome = "ok"
+        return result
+    finally:
+        seconds = time.perf_counter() - start
+        for listener in _storage_listeners:
+            listener(backend, operation, outcome, seconds)
@@ -0,0 +1,172 @@
+"""Receiving image uploads without holding them in memory.
+
+The multipart body is parsed straight off the request stream in 64 KiB pieces (werkzeug's
+buffer size), and the file part is written to a spool file on disk as it arrives. The spool
+enforces the size limit on the running total and sniffs the first bytes for an image
+signature, so an oversized or non-image upload is rejected as soon as it shows, not after it
+has been read in full.
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import request
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.formparser import FormDataParser
+
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+# Room for the multipart boundaries and the caption on top of the file itself.
+MAX_FORM_OVERHEAD = 64 * 1024
+MAX_BATCH_FILES = 50
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+SNIFF_BYTES = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+
+def sniff_image(head):
+    """The mimetype of the image ``head`` starts, or None when it is not (or not yet) one."""
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    return None
+
+
+class ImageSpool(io.FileIO):
+    """Disk file an upload is streamed into, hashed on the way; removed again when closed.
+
+    It is a real ``FileIO``, so storage clients can stream it back out without reading it into
+    memory either. A ``strict`` spool raises on the first violation; otherwise the violation is
+    kept in ``error`` and the rest of the file is skipped, so the other parts can still be read.
+    """
+
+    def __init__(self, max_size=MAX_UPLOAD_SIZE, directory=None, strict=True):
+        fd, path = tempfile.mkstemp(prefix="upload-", dir=directory)
+        os.close(fd)
+        super().__init__(path, "w+")
+        self.max_size = max_size
+        self.size = 0
+        self.head = b""
+        self.mimetype = None
+        self.kept = False
+        self.hasher = hashlib.sha256()
+        self.strict = strict
+        self.error = None
+
+    def _reject(self, error):
+        if self.strict:
+            raise error
+        self.error = error
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        self.size += len(data)
+        if self.size > self.max_size:
+            self._reject(RequestEntityTooLarge(f"File too large, the limit is {self.max_size} bytes"))
+            return len(data)
+        if self.mimetype is None:
+            self.head = (self.head + bytes(data[:SNIFF_BYTES]))[:SNIFF_BYTES]
+            self.mimetype = sniff_image(self.head)
+            if self.mimetype is None and len(self.head) == SNIFF_BYTES:
+                self._reject(UnsupportedMediaType("File is not a PNG, JPEG or GIF image"))
+                return len(data)
+        self.hasher.update(data)
+        return super().write(data)
+
+    @property
+    def content_hash(self):
+        """sha256 of everything written so far, as hex."""
+        return self.hasher.hexdigest()
+
+    def keep(self):
+        """Close the spool but leave the file in place for later processing; returns its path."""
+        self.kept = True
+        self.close()
+        return self.name
+
+    def close(self):
+        super().close()
+        if self.kept:
+            return
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+def _parse_spooled(spool_factory, max_parts):
+    """Parse the multipart request with every file part going to a spool from ``spool_factory``."""
+    spools = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        spools.append(spool_factory(len(spools)))
+        return spools[-1]
+
+    parser = FormDataParser(stream_factory, max_form_memory_size=MAX_FORM_OVERHEAD, silent=False,
+                            max_form_parts=max_parts)
+    try:
+        _, form, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                      request.mimetype_params)
+    except Exception:
+        for spool in spools:
+            spool.close()
+        raise
+    return form, files, spools
+
+
+def _image_file(file, field):
+    return FileStorage(file.stream, file.filename, field, content_type=file.stream.mimetype)
+
+
+def receive_image(field="file", max_size=MAX_UPLOAD_SIZE, directory=None):
+    """Parse the multipart request, spooling the ``field`` file part to disk.
+
+    Returns ``(form, file)``; ``file`` is None when the part is missing, otherwise a
+    ``FileStorage`` over an ``ImageSpool`` in ``directory`` with the sniffed mimetype. The caller
+    closes it, or keeps it.
+    Raises ``RequestEntityTooLarge`` or ``UnsupportedMediaType`` for uploads that do not fit.
+    """
+    if request.content_length and request.content_length > max_size + MAX_FORM_OVERHEAD:
+        raise RequestEntityTooLarge(f"File too large, the limit is {max_size} bytes")
+    form, files, spools = _parse_spooled(lambda index: ImageSpool(max_size, directory), 16)
+    file = files.get(field)
+    for spool in spools:
+        if file is None or spool is not file.stream:
+            spool.close()
+    if file is None:
+        return form, None
+    if file.stream.mimetype is None:
+        file.stream.close()
+        raise UnsupportedMediaType("File is not a PNG, JPEG or GIF image")
+    return form, _image_file(file, field)
+
+
+def receive_images(field="files", max_size=MAX_UPLOAD_SIZE, max_files=MAX_BATCH_FILES, directory=None):
+    """Like ``receive_image`` for every ``field`` part, up to ``max_files`` of them.
+
+    A file that is too large or not an image does not fail the request: its spool is returned
+    with ``stream.error`` set. Returns ``(form, files)``; the caller closes the files.
+    """
+    if request.content_length and request.content_length > max_files * max_size + MAX_FORM_OVERHEAD:
+        raise RequestEntityTooLarge(f"Upload too large, the limit is {max_files} files of {max_size} bytes")
+
+    def spool_factory(index):
+        if index >= max_files:
+            raise RequestEntityTooLarge(f"Too many files, the limit is {max_files}")
+        return ImageSpool(max_size, directory, strict=False)
+
+    form, files, spools = _parse_spooled(spool_factory, max_files + 16)
+    images = files.getlist(field)
+    wanted = {id(file.stream) for file in images}
+    for spool in spools:
+        if id(spool) not in wanted:
+            spool.close()
+        elif spool.mimetype is None and spool.error is None:
+            spool.error = UnsupportedMediaType("File is not a PNG, JPEG or GIF image")
+    return form, [_image_file(file, field) for file in images]
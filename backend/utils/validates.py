@@ -1,3 +1,6 @@
+from datetime import datetime
+
+
 def validate_fields(data, required_fields):
     if not data:
         return {"error": "Request must be in JSON format."}
@@ -5,3 +8,144 @@ def validate_fields(data, required_fields):
     if missing:
         return {"error": f"Missing required field(s): {', '.join(missing)}"}
     return None
+
+
+def parse_bbox(value):
+    """Parse a ``west,south,east,north`` box into (south, west, north, east); raises ValueError."""
+    if not value:
+        raise ValueError("bbox is required as west,south,east,north")
+    try:
+        west, south, east, north = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("bbox must be four numbers: west,south,east,north")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox is out of range")
+    return south, west, north, east
+
+
+def parse_point(args, max_radius_km=500.0, default_radius_km=5.0):
+    """Read ``lat``, ``lng`` and ``radius`` (km) query parameters; raises ValueError."""
+    lat = args.get("lat", type=float)
+    lng = args.get("lng", type=float)
+    radius = args.get("radius", default_radius_km, type=float)
+    if lat is None or lng is None:
+        raise ValueError("lat and lng are required numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat or lng is out of range")
+    if not 0 < radius <= max_radius_km:
+        raise ValueError(f"radius must be between 0 and {max_radius_km:g} km")
+    return lat, lng, radius
+
+
+def _name_list(value):
+    return [name for name in (part.strip() for part in value.split(",")) if name]
+
+
+def parse_fieldset(args, allowed, always=("id",)):
+    """Read the ``fields`` query parameter as a tuple of column names, or None when absent; raises ValueError."""
+    value = args.get("fields")
+    if value is None:
+        return None
+    names = _name_list(value)
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return tuple(name for name in allowed if name in always or name in names)
+
+
+def parse_expand(args, allowed, default=()):
+    """Read the ``expand`` query parameter as a tuple of relationship names; raises ValueError."""
+    value = args.get("expand")
+    if value is None:
+        return tuple(default)
+    names = _name_list(value)
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown expansion(s): {', '.join(unknown)}")
+    return tuple(name for name in allowed if name in names)
+
+
+BULK_TRIP_REQUIRED = ("title", "user_id", "country", "start_date", "end_date")
+BULK_TRIP_FIELDS = ("title", "user_id", "country", "city", "start_date", "end_date",
+                    "description", "notes", "is_public", "lat", "lng")
+BULK_ACTIVITY_FIELDS = ("name", "location", "type", "notes", "cost", "rating", "lat", "lng")
+# Longest value of each text column; None for unbounded text.
+BULK_TRIP_TEXT = {"title": 100, "country": 100, "city": 100, "description": None, "notes": None}
+BULK_ACTIVITY_TEXT = {"name": 100, "location": 200, "type": 50, "notes": None}
+
+
+def _text(data, field, max_length=None):
+    value = data.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string")
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f"{field} must be at most {max_length} characters")
+    return value
+
+
+def _boolean(data, field, default):
+    value = data.get(field, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"{field} must be true or false")
+    return value
+
+
+def _number(data, field, kind=float):
+    value = data.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{field} must be a number")
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a number")
+
+
+def _coordinates(data):
+    lat, lng = _number(data, "lat"), _number(data, "lng")
+    if (lat is None) != (lng is None):
+        raise ValueError("lat and lng must be given together")
+    if lat is not None and not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat or lng is out of range")
+    return lat, lng
+
+
+def parse_bulk_trip(data):
+    """Validate one trip of a bulk import into (trip columns, [activity columns]); raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Each trip must be a JSON object")
+    error = validate_fields(data, BULK_TRIP_REQUIRED)
+    if error:
+        raise ValueError(error["error"])
+    trip = {field: data.get(field) for field in BULK_TRIP_FIELDS}
+    for field, max_length in BULK_TRIP_TEXT.items():
+        trip[field] = _text(data, field, max_length)
+    trip["user_id"] = _number(data, "user_id", int)
+    trip["is_public"] = _boolean(data, "is_public", False)
+    trip["lat"], trip["lng"] = _coordinates(data)
+    for field in ("start_date", "end_date"):
+        try:
+            trip[field] = datetime.strptime(str(data[field]), "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError(f"{field} must be a YYYY-MM-DD date")
+    activities = data.get("activities") or []
+    if not isinstance(activities, list):
+        raise ValueError("activities must be a list")
+    rows = []
+    for position, activity in enumerate(activities):
+        if not isinstance(activity, dict):
+            raise ValueError(f"activities[{position}] must be a JSON object")
+        try:
+            row = {field: activity.get(field) for field in BULK_ACTIVITY_FIELDS}
+            for field, max_length in BULK_ACTIVITY_TEXT.items():
+                row[field] = _text(activity, field, max_length)
+            row["cost"] = _number(activity, "cost")
+            row["rating"] = _number(activity, "rating", int)
+            row["lat"], row["lng"] = _coordinates(activity)
+        except ValueError as e:
+            raise ValueError(f"activities[{position}]: {e}")
+        rows.append(row)
+    return trip, rows
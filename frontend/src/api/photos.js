@@ -12,6 +12,17 @@ export const getUserPhotos = async (tripId) => {
   }
 };
 
+// Wait for a background photo upload job to finish and return the photo
+const waitForPhotoJob = async (jobId, { interval = 500, attempts = 120 } = {}) => {
+  for (let i = 0; i < attempts; i++) {
+    const { data: job } = await api.get(`/photos/jobs/${jobId}`);
+    if (job.status === 'done') return job.photo;
+    if (job.status === 'failed') throw new Error(job.error || 'Photo upload failed');
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+  throw new Error('Photo upload timed out');
+};
+
 // Upload photo file(s) associated with a trip
 
 export const uploadPhotos = async (tripId, photos) => {
@@ -25,7 +36,8 @@ export const uploadPhotos = async (tripId, photos) => {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
 
-      return response.data;
+      // The server answers 202 with a job; the photo exists once the job is done
+      return waitForPhotoJob(response.data.id);
     });
 
     const results = await Promise.allSettled(uploadPromises);